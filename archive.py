@@ -0,0 +1,186 @@
+"""
+Archival of settled maintenance years
+
+The maintenance table only keeps recent years ("hot" storage). Older, fully settled
+years are moved to one gzip-compressed JSON-lines file per society and year under
+ARCHIVE_DIR and can still be read back on demand as detached models.Maintenance objects.
+
+Each flat's rows are a separate gzip member of the file, and a small JSON index next to
+it records where each member starts, so reading one flat decompresses only its rows.
+"""
+import gzip
+import itertools
+import json
+import os
+from datetime import datetime
+from decimal import Decimal
+from functools import lru_cache
+from typing import List, Optional
+
+from sqlalchemy import and_, delete, func, select, update
+from sqlalchemy.orm import Session
+
+import models
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+# Current year plus this many previous years always stay in the database
+ARCHIVE_KEEP_YEARS = int(os.getenv("ARCHIVE_KEEP_YEARS", "1"))
+
+_DATETIME_FIELDS = ("due_date", "paid_date", "created_at", "updated_at")
+_FIELDS = [column.name for column in models.Maintenance.__table__.columns]
+_MONEY_FIELDS = [column.name for column in models.Maintenance.__table__.columns if isinstance(column.type, models.Money)]
+
+def _maintenance_dir(society_id: int):
+    return os.path.join(ARCHIVE_DIR, "maintenance", str(society_id))
+
+def archive_path(society_id: int, year: int):
+    return os.path.join(_maintenance_dir(society_id), f"maintenance_{year}.jsonl.gz")
+
+def index_path(society_id: int, year: int):
+    return os.path.join(_maintenance_dir(society_id), f"maintenance_{year}.index.json")
+
+def is_archived(society_id: int, year: int):
+    return os.path.exists(archive_path(society_id, year))
+
+def archived_years(society_id: int):
+    if not os.path.isdir(_maintenance_dir(society_id)):
+        return []
+    years = []
+    for name in os.listdir(_maintenance_dir(society_id)):
+        if name.startswith("maintenance_") and name.endswith(".jsonl.gz"):
+            years.append(int(name[len("maintenance_"):-len(".jsonl.gz")]))
+    return sorted(years, reverse=True)
+
+def _to_row(record: models.Maintenance):
+    row = {}
+    for field in _FIELDS:
+        value = getattr(record, field)
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        elif isinstance(value, models.PaymentStatus):
+            value = value.value
+        elif isinstance(value, Decimal):
+            value = str(value)
+        row[field] = value
+    return row
+
+def _from_row(row: dict):
+    for field in _DATETIME_FIELDS:
+        if row.get(field):
+            row[field] = datetime.fromisoformat(row[field])
+    for field in _MONEY_FIELDS:
+        if row.get(field) is not None:
+            # Archives written before amounts were Decimals hold floats
+            row[field] = Decimal(str(row[field])).quantize(Decimal("0.01"))
+    row["payment_status"] = models.PaymentStatus(row["payment_status"])
+    return models.Maintenance(**row)
+
+def archive_year(db: Session, society_id: int, year: int):
+    """Move a society's settled year of maintenance records to a compressed archive file"""
+    if year > datetime.utcnow().year - 1 - ARCHIVE_KEEP_YEARS:
+        raise ValueError(f"Year {year} is still within the hot retention window")
+    year_records = and_(models.Maintenance.society_id == society_id, models.Maintenance.year == year)
+    if is_archived(society_id, year):
+        if db.query(models.Maintenance.id).filter(year_records).first() is None:
+            raise ValueError(f"Year {year} is already archived")
+        # An earlier run wrote the archive but died before its delete committed; the
+        # rows are still authoritative, so archive them again and finish the delete
+        print(f"⚠️  Year {year} of society {society_id} is archived but still has rows, re-archiving")
+
+    open_records = db.query(func.count(models.Maintenance.id)).filter(
+        and_(
+            models.Maintenance.society_id == society_id,
+            models.Maintenance.year == year,
+            models.Maintenance.payment_status != models.PaymentStatus.PAID
+        )
+    ).scalar()
+    if open_records:
+        raise ValueError(f"Year {year} still has {open_records} unpaid maintenance records")
+
+    records = db.query(models.Maintenance).filter(year_records).order_by(models.Maintenance.flat_id, models.Maintenance.month).yield_per(1000)
+
+    # Write to temp files and rename, so a crash never leaves a partial archive behind;
+    # the archive file goes last since its presence marks the year archived
+    os.makedirs(_maintenance_dir(society_id), exist_ok=True)
+    path = archive_path(society_id, year)
+    tmp_path = path + ".tmp"
+    index = {}
+    count = 0
+    with open(tmp_path, "wb") as f:
+        for flat_id, flat_records in itertools.groupby(records, key=lambda record: record.flat_id):
+            lines = [json.dumps(_to_row(record)) + "\n" for record in flat_records]
+            member = gzip.compress("".join(lines).encode("utf-8"))
+            index[str(flat_id)] = [f.tell(), len(member)]
+            f.write(member)
+            count += len(lines)
+        f.flush()
+        os.fsync(f.fileno())
+    with open(index_path(society_id, year) + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(index, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(index_path(society_id, year) + ".tmp", index_path(society_id, year))
+    os.replace(tmp_path, path)
+
+    year_ids = select(models.Maintenance.id).where(year_records)
+    try:
+        # Sent and pending reminders outlive the bills they were about
+        db.execute(update(models.Notification).where(
+            models.Notification.maintenance_id.in_(year_ids)
+        ).values(maintenance_id=None).execution_options(synchronize_session=False))
+        db.execute(delete(models.Maintenance).where(year_records))
+        db.commit()
+    except Exception:
+        db.rollback()
+        os.remove(path)
+        os.remove(index_path(society_id, year))
+        raise
+    return count
+
+@lru_cache(maxsize=256)
+def _load_index(path: str, modified_ns: int):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def _flat_rows(society_id: int, year: int, flat_id: int):
+    """One flat's rows through the index, or None for an archive written without one"""
+    path = index_path(society_id, year)
+    try:
+        index = _load_index(path, os.stat(path).st_mtime_ns)
+    except FileNotFoundError:
+        return None
+    if str(flat_id) not in index:
+        return []
+    offset, length = index[str(flat_id)]
+    with open(archive_path(society_id, year), "rb") as f:
+        f.seek(offset)
+        member = f.read(length)
+    return [json.loads(line) for line in gzip.decompress(member).decode("utf-8").splitlines()]
+
+def read_archived_maintenance(society_id: int, year: int, flat_id: Optional[int] = None, month: Optional[int] = None) -> List[models.Maintenance]:
+    """Read a society's archived records for a year, optionally filtered by flat and month"""
+    if not is_archived(society_id, year):
+        return []
+    rows = _flat_rows(society_id, year, flat_id) if flat_id is not None else None
+    if rows is None:
+        with gzip.open(archive_path(society_id, year), "rt", encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f]
+    records = []
+    for row in rows:
+        if flat_id is not None and row["flat_id"] != flat_id:
+            continue
+        if month is not None and row["month"] != month:
+            continue
+        records.append(_from_row(row))
+    return records
+
+def get_archived_maintenance_by_flat(society_id: int, flat_id: int):
+    """All archived records for a flat, newest first"""
+    records = []
+    for year in archived_years(society_id):
+        records.extend(sorted(
+            read_archived_maintenance(society_id, year, flat_id=flat_id),
+            key=lambda record: record.month,
+            reverse=True
+        ))
+    return records
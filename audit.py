@@ -0,0 +1,250 @@
+"""
+Audit log of changes to flats, tenants, residents, maintenance and vendors
+
+Session events capture a before/after diff of every audited row an ORM flush creates,
+updates or deletes, tagged with the user auth.get_current_user put in session.info.
+crud.py's single-statement writes (INSERT/UPDATE/DELETE ... RETURNING) report their
+rows through track() instead.
+Entries are queued in memory when the transaction commits and a background task writes
+them to audit_log in batches, so requests never wait on an audit INSERT.
+
+The queue is bounded by AUDIT_QUEUE_SIZE. When it is full, or a batch cannot be written,
+entries are appended to JSON lines files in AUDIT_SPILL_DIR and replayed into the
+database once writes succeed again. Set-based UPDATEs run by jobs (such as interest
+application) do not go through the ORM unit of work and are recorded in job_runs instead.
+"""
+import asyncio
+import enum
+import json
+import os
+import queue
+import time
+import traceback
+from datetime import date, datetime
+from decimal import Decimal
+
+from sqlalchemy import event, insert, inspect
+from sqlalchemy.orm import Session
+
+import models
+from database import get_engine, is_routed
+
+AUDITED_MODELS = (models.Flat, models.TenantHistory, models.FlatResident, models.Maintenance, models.Vendor)
+# Bookkeeping columns that do not make a change worth recording on their own
+IGNORED_FIELDS = {"updated_at"}
+
+AUDIT_QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", "10000"))
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "500"))
+AUDIT_FLUSH_SECONDS = float(os.getenv("AUDIT_FLUSH_SECONDS", "1"))
+AUDIT_SPILL_DIR = os.getenv("AUDIT_SPILL_DIR", "audit_spill")
+
+_queue = queue.Queue(maxsize=AUDIT_QUEUE_SIZE)
+
+def _json_value(value):
+    if isinstance(value, enum.Enum):
+        return value.value
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+def _columns(instance):
+    return [attr for attr in inspect(instance).mapper.column_attrs if attr.key not in ("id", "society_id")]
+
+def _diff(instance, action: str):
+    state = inspect(instance)
+    changes = {}
+    for attr in _columns(instance):
+        if action == "create":
+            value = getattr(instance, attr.key)
+            if value is not None:
+                changes[attr.key] = [None, _json_value(value)]
+        elif action == "delete":
+            if attr.key not in state.unloaded:
+                value = state.attrs[attr.key].loaded_value
+                if value is not None:
+                    changes[attr.key] = [_json_value(value), None]
+        else:
+            history = state.attrs[attr.key].history
+            if history.added or history.deleted:
+                before = history.deleted[0] if history.deleted else None
+                after = history.added[0] if history.added else None
+                if before != after:
+                    changes[attr.key] = [_json_value(before), _json_value(after)]
+    return changes
+
+@event.listens_for(Session, "after_flush")
+def _capture(session, flush_context):
+    pending = session.info.setdefault("audit_pending", [])
+    for action, instances in (("create", session.new), ("update", session.dirty), ("delete", session.deleted)):
+        for instance in instances:
+            if not isinstance(instance, AUDITED_MODELS):
+                continue
+            changes = _diff(instance, action)
+            if action == "update" and not set(changes) - IGNORED_FIELDS:
+                continue
+            pending.append(_entry(session, instance.__tablename__, instance, action, changes))
+
+def _entry(session, entity_type: str, row, action: str, changes: dict):
+    return {
+        "society_id": row.society_id,
+        "entity_type": entity_type,
+        "entity_id": row.id,
+        "action": action,
+        "changes": changes,
+        "user_id": session.info.get("user_id"),
+        "username": session.info.get("username"),
+        "created_at": datetime.utcnow(),
+    }
+
+def track(session, model, action: str, row, before: dict = None):
+    """Audit a row written by INSERT/UPDATE/DELETE ... RETURNING, which skips the flush events
+
+    For updates, before holds the previous values of the columns that were set.
+    """
+    if model not in AUDITED_MODELS:
+        return
+    values = row._mapping
+    if action == "update":
+        changes = {
+            key: [_json_value(old), _json_value(values[key])]
+            for key, old in before.items() if old != values[key]
+        }
+        if not set(changes) - IGNORED_FIELDS:
+            return
+    else:
+        changes = {}
+        for column in model.__table__.columns:
+            value = values[column.key]
+            if column.key not in ("id", "society_id") and value is not None:
+                changes[column.key] = [None, _json_value(value)] if action == "create" else [_json_value(value), None]
+    session.info.setdefault("audit_pending", []).append(_entry(session, model.__tablename__, row, action, changes))
+
+@event.listens_for(Session, "after_commit")
+def _enqueue(session):
+    pending = session.info.pop("audit_pending", None)
+    if pending:
+        record(pending)
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard(session, previous_transaction):
+    session.info.pop("audit_pending", None)
+
+def record(entries: list):
+    """Queue entries for the flusher, spilling to disk when the queue is full"""
+    overflow = []
+    for entry in entries:
+        try:
+            _queue.put_nowait(entry)
+        except queue.Full:
+            overflow.append(entry)
+    if overflow:
+        spill(overflow)
+
+def spill(entries: list):
+    """Append entries to this process's spill file, synced to disk"""
+    os.makedirs(AUDIT_SPILL_DIR, exist_ok=True)
+    path = os.path.join(AUDIT_SPILL_DIR, f"audit-{os.getpid()}.jsonl")
+    with open(path, "a", encoding="utf-8") as f:
+        for entry in entries:
+            f.write(json.dumps({**entry, "created_at": entry["created_at"].isoformat()}) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    print(f"⚠️  Spilled {len(entries)} audit entries to {path}")
+
+def write_batch(entries: list):
+    """Insert entries, one executemany per society database"""
+    by_society = {}
+    for entry in entries:
+        society_id = entry["society_id"] if is_routed(entry["society_id"]) else None
+        by_society.setdefault(society_id, []).append(entry)
+    for society_id, society_entries in by_society.items():
+        with get_engine(society_id).begin() as connection:
+            connection.execute(insert(models.AuditLog), society_entries)
+
+def _drain(limit: int):
+    entries = []
+    while len(entries) < limit:
+        try:
+            entries.append(_queue.get_nowait())
+        except queue.Empty:
+            break
+    return entries
+
+def _replay_spilled():
+    """Move spilled entries back into the database; claims each file by renaming it"""
+    if not os.path.isdir(AUDIT_SPILL_DIR):
+        return 0
+    replayed = 0
+    for name in sorted(os.listdir(AUDIT_SPILL_DIR)):
+        if not name.endswith(".jsonl"):
+            continue
+        path = os.path.join(AUDIT_SPILL_DIR, name)
+        if time.time() - os.path.getmtime(path) < 5:
+            continue  # Still being appended to
+        claimed = f"{path}.replaying-{os.getpid()}"
+        try:
+            os.rename(path, claimed)
+        except OSError:
+            continue  # Another worker claimed it
+        try:
+            with open(claimed, encoding="utf-8") as f:
+                entries = [json.loads(line) for line in f if line.strip()]
+            for entry in entries:
+                entry["created_at"] = datetime.fromisoformat(entry["created_at"])
+            for i in range(0, len(entries), AUDIT_BATCH_SIZE):
+                write_batch(entries[i:i + AUDIT_BATCH_SIZE])
+        except Exception:
+            # Put the file back for the next attempt; rows already written may repeat
+            os.rename(claimed, path)
+            raise
+        os.remove(claimed)
+        replayed += len(entries)
+    return replayed
+
+def flush(limit: int = AUDIT_BATCH_SIZE):
+    """Write up to limit queued entries; on failure they are spilled. Blocking."""
+    entries = _drain(limit)
+    if not entries:
+        return 0
+    try:
+        write_batch(entries)
+    except Exception as e:
+        print(f"❌ Audit write failed, spilling {len(entries)} entries: {e}")
+        spill(entries)
+        return 0
+    return len(entries)
+
+async def run_flusher():
+    """Flush queued entries every AUDIT_FLUSH_SECONDS, or sooner once a batch is ready"""
+    last_replay = 0.0
+    while True:
+        started = time.monotonic()
+        while _queue.qsize() < AUDIT_BATCH_SIZE and time.monotonic() - started < AUDIT_FLUSH_SECONDS:
+            await asyncio.sleep(0.05)
+        try:
+            written = await asyncio.to_thread(flush)
+            while written == AUDIT_BATCH_SIZE:
+                written = await asyncio.to_thread(flush)
+            if time.monotonic() - last_replay > 60:
+                last_replay = time.monotonic()
+                replayed = await asyncio.to_thread(_replay_spilled)
+                if replayed:
+                    print(f"📝 Replayed {replayed} spilled audit entries")
+        except Exception:
+            traceback.print_exc()
+
+def start_flusher():
+    return asyncio.get_running_loop().create_task(run_flusher())
+
+async def stop_flusher(task):
+    """Cancel the flusher and write out whatever is still queued"""
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    # flush() spills what it cannot write, so this always empties the queue
+    while not _queue.empty():
+        await asyncio.to_thread(flush)
@@ -1,9 +1,14 @@
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from typing import Optional
+import hashlib
+import threading
+import time
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import bindparam, select
 from sqlalchemy.orm import Session
 from database import get_db
 import models
@@ -12,10 +17,18 @@ import schemas
 SECRET_KEY = "your-secret-key-change-this-in-production"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+REFRESH_TOKEN_EXPIRE_DAYS = 7
+# Verified access tokens kept in memory, so repeat requests skip signature checks
+TOKEN_CACHE_SIZE = 10000
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
+# Runs on every authenticated request; built once so only the parameter changes
+USER_BY_USERNAME = select(models.User).where(
+    models.User.username == bindparam("username")
+).limit(1).execution_options(reuse_scoped=True)
+
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
@@ -32,6 +45,53 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def _password_fingerprint(user: models.User):
+    # Changing the password invalidates refresh tokens issued before the change
+    return hashlib.sha256(user.hashed_password.encode()).hexdigest()[:16]
+
+def create_refresh_token(user: models.User):
+    expire = datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    claims = {"sub": user.username, "sid": user.society_id, "typ": "refresh",
+              "pwd": _password_fingerprint(user), "exp": expire}
+    return jwt.encode(claims, SECRET_KEY, algorithm=ALGORITHM)
+
+def verify_refresh_token(token: str, db: Session):
+    """User a refresh token was issued to, or None if it is invalid, expired or revoked"""
+    try:
+        claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    if claims.get("typ") != "refresh":
+        return None
+    user = db.query(models.User).filter(models.User.username == claims.get("sub")).first()
+    if user is None or not user.is_active or user.society_id != claims.get("sid") \
+            or claims.get("pwd") != _password_fingerprint(user):
+        return None
+    return user
+
+_token_cache = OrderedDict()
+_token_cache_lock = threading.Lock()
+
+def decode_token(token: str):
+    """Verified access token claims, cached by token digest until the token expires"""
+    key = hashlib.sha256(token.encode()).digest()
+    now = time.time()
+    with _token_cache_lock:
+        cached = _token_cache.get(key)
+        if cached is not None:
+            if cached.get("exp", 0) > now:
+                _token_cache.move_to_end(key)
+                return cached
+            del _token_cache[key]
+    claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    if claims.get("typ") == "refresh":
+        raise JWTError("Refresh tokens cannot be used for API access")
+    with _token_cache_lock:
+        _token_cache[key] = claims
+        if len(_token_cache) > TOKEN_CACHE_SIZE:
+            _token_cache.popitem(last=False)
+    return claims
+
 def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -39,17 +99,20 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(token)
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
-        token_data = schemas.TokenData(username=username)
+        token_data = schemas.TokenData(username=username, society_id=payload.get("sid"))
     except JWTError:
         raise credentials_exception
     
-    user = db.query(models.User).filter(models.User.username == token_data.username).first()
-    if user is None:
+    user = db.execute(USER_BY_USERNAME, {"username": token_data.username}).scalars().first()
+    if user is None or user.society_id != token_data.society_id:
         raise credentials_exception
+    # The route shares this session, so its changes are audited as this user
+    db.info["user_id"] = user.id
+    db.info["username"] = user.username
     return user
 
 def get_current_active_user(current_user: models.User = Depends(get_current_user)):
@@ -0,0 +1,106 @@
+"""
+Micro-benchmark of the cached statements behind the hot crud.py lookups
+
+Runs each lookup the old way (a new ORM Query per call) and through crud.py's cached
+statements, in a society-scoped session like a request gets, and prints the time per
+call split into Python overhead (everything outside the driver's execute) and driver
+time. Results are compared so the two ways are known to return the same rows.
+
+Usage:
+    DATABASE_URL=... python benchmark_statements.py
+
+DATABASE_URL only has to be importable; rows go to BENCHMARK_DATABASE_URL, an
+in-memory SQLite database unless set. That database is recreated from models.py, so
+never point it at a database holding real data.
+"""
+import os
+import sys
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import models
+import crud
+from check_query_plans import seed
+from database import DEFAULT_SOCIETY_ID, make_engine
+
+BENCHMARK_DATABASE_URL = os.getenv("BENCHMARK_DATABASE_URL", "sqlite://")
+BENCHMARK_CALLS = int(os.getenv("BENCHMARK_CALLS", "2000"))
+
+# (name, old Query-per-call version, cached statement version)
+LOOKUPS = [
+    ("get_user_by_username / auth.get_current_user",
+     lambda db: db.query(models.User).filter(models.User.username == "owner42").first(),
+     lambda db: crud.get_user_by_username(db, "owner42")),
+    ("get_flat",
+     lambda db: db.query(models.Flat).filter(models.Flat.id == 42).first(),
+     lambda db: crud.get_flat(db, 42)),
+    ("get_maintenance",
+     lambda db: db.query(models.Maintenance).filter(models.Maintenance.id == 42).first(),
+     lambda db: crud.get_maintenance(db, 42)),
+    ("get_maintenance_by_flat",
+     lambda db: db.query(models.Maintenance).filter(models.Maintenance.flat_id == 42).order_by(
+         models.Maintenance.year.desc(), models.Maintenance.month.desc()).offset(0).limit(100).all(),
+     lambda db: crud.get_maintenance_by_flat(db, 42)),
+]
+
+class DriverTimer:
+    """Total time spent inside cursor.execute on an engine"""
+
+    def __init__(self, engine):
+        self.seconds = 0.0
+        self.started = 0.0
+        event.listen(engine, "before_cursor_execute", self.before)
+        event.listen(engine, "after_cursor_execute", self.after)
+
+    def before(self, *args):
+        self.started = time.perf_counter()
+
+    def after(self, *args):
+        self.seconds += time.perf_counter() - self.started
+
+def measure(db: Session, timer: DriverTimer, call):
+    """(microseconds per call, of which in the driver) after a warm-up round"""
+    for _ in range(50):
+        call(db)
+    db.expunge_all()
+    timer.seconds = 0.0
+    started = time.perf_counter()
+    for _ in range(BENCHMARK_CALLS):
+        call(db)
+    total = time.perf_counter() - started
+    db.expunge_all()
+    return total / BENCHMARK_CALLS * 1e6, timer.seconds / BENCHMARK_CALLS * 1e6
+
+def _identity(result):
+    rows = result if isinstance(result, list) else [result]
+    return [row.id for row in rows]
+
+def main():
+    engine = make_engine(BENCHMARK_DATABASE_URL)
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    with Session(engine) as db:
+        seed(db)
+
+    timer = DriverTimer(engine)
+    failures = 0
+    print(f"{'lookup':<46} {'query/call':>12} {'cached/call':>12} {'python saved':>13}")
+    with Session(engine, info={"society_id": DEFAULT_SOCIETY_ID}) as db:
+        for name, old, cached in LOOKUPS:
+            if _identity(old(db)) != _identity(cached(db)):
+                failures += 1
+                print(f"❌ {name}: cached statement returns different rows")
+                continue
+            old_total, old_driver = measure(db, timer, old)
+            new_total, new_driver = measure(db, timer, cached)
+            saved = (old_total - old_driver) - (new_total - new_driver)
+            print(f"{name:<46} {old_total:>9.1f} µs {new_total:>9.1f} µs {saved:>10.1f} µs")
+    models.Base.metadata.drop_all(bind=engine)
+    engine.dispose()
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
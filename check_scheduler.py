@@ -0,0 +1,83 @@
+"""
+End-to-end check of one scheduler tick
+
+Drives jobs.scheduler_tick for a slot at which several jobs are due (03:00 matches
+rollup_balances and send_notifications, plus two jobs registered here, one of which
+fails) and checks that every due job was claimed, started on the event loop and
+finished with the expected status, and that a second tick for the same slot claims
+nothing.
+
+Usage:
+    python check_scheduler.py
+
+Runs against SCHEDULER_CHECK_DATABASE_URL, a SQLite file in the working directory
+unless set. That database is recreated from models.py, so never point it at a
+database holding real data.
+"""
+import asyncio
+import os
+import sys
+from datetime import datetime
+
+SCHEDULER_CHECK_DATABASE_URL = os.getenv("SCHEDULER_CHECK_DATABASE_URL", "sqlite:///scheduler_check.db")
+# jobs.py works on database.engine, so point it at the scratch database before import
+os.environ["DATABASE_URL"] = SCHEDULER_CHECK_DATABASE_URL
+
+import models
+import crud
+import database
+import jobs
+
+def _count(db, progress=None):
+    return 3
+
+def _fail(db, progress=None):
+    raise RuntimeError("expected failure")
+
+async def tick(slot: datetime):
+    tasks = await jobs.scheduler_tick(slot)
+    await asyncio.gather(*tasks)
+    return len(tasks)
+
+def main():
+    models.Base.metadata.drop_all(bind=database.engine)
+    models.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+    crud.ensure_default_society(db)
+    db.close()
+    jobs.register_job("check_count", "0 3 * * *", _count)
+    jobs.register_job("check_fail", "0 3 * * *", _fail)
+
+    slot = datetime.now().replace(hour=3, minute=0, second=0, microsecond=0)
+    due = sorted(job.name for job in jobs.JOBS.values() if job.schedule.matches(slot))
+    started = asyncio.run(tick(slot))
+    again = asyncio.run(tick(slot))
+
+    db = database.SessionLocal()
+    runs = {run.job_name: run for run in db.query(models.JobRun).filter(models.JobRun.scheduled_for == slot)}
+    db.close()
+    expected = {name: models.JobStatus.SUCCEEDED for name in due}
+    expected["check_fail"] = models.JobStatus.FAILED
+
+    failures = 0
+    for name in due:
+        run = runs.get(name)
+        status = run.status if run else None
+        ok = status == expected[name]
+        failures += not ok
+        print(f"{'✓' if ok else '❌'} {name}: {status.value if status else 'not claimed'}")
+    if started != len(due) or again:
+        failures += 1
+        print(f"❌ Started {started} of {len(due)} due runs; second tick started {again}")
+    models.Base.metadata.drop_all(bind=database.engine)
+    database.engine.dispose()
+    if database.engine.dialect.name == "sqlite" and database.engine.url.database:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(database.engine.url.database + suffix):
+                os.remove(database.engine.url.database + suffix)
+    if failures:
+        sys.exit(1)
+    print("\n✓ One tick claims, starts and finishes every due job once")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Output parity check for the fast list serialization in serializers.py
+
+Seeds a scratch database, then serializes each fast-path list query both ways: ORM
+objects validated through the schemas.*Response model (what FastAPI does with
+response_model), and column rows through serializers.json_response. Fails if the JSON
+differs in any value or type, and prints the best timing of both paths.
+
+Usage:
+    DATABASE_URL=... python check_serialization.py
+
+DATABASE_URL only has to be importable; rows go to SERIALIZATION_CHECK_DATABASE_URL,
+an in-memory SQLite database unless set. That database is recreated from models.py,
+so never point it at a database holding real data.
+"""
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from typing import List
+
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
+
+import models
+import schemas
+import crud
+import serializers
+
+CHECK_DATABASE_URL = os.getenv("SERIALIZATION_CHECK_DATABASE_URL", "sqlite://")
+SEED_FLATS = 1000
+SEED_MONTHS = 12
+TIMING_ROUNDS = 5
+
+def seed(db: Session):
+    now = datetime.utcnow()
+    crud.ensure_default_society(db)
+    db.execute(insert(models.User), [
+        {"id": i, "username": f"owner{i}", "email": f"owner{i}@example.com", "hashed_password": "x",
+         "full_name": f"Owner {i}", "role": models.UserRole.FLAT_OWNER}
+        for i in range(1, SEED_FLATS + 1)
+    ])
+    db.execute(insert(models.Flat), [
+        {"id": i, "flat_number": f"{chr(65 + i % 6)}-{i:04d}", "owner_id": i, "owner_name": f"Owner \"{i}\" é",
+         "owner_email": f"owner{i}@example.com", "owner_phone": "9000000000",
+         "flat_sq_size": 650.0 + (i % 5) * 150.25,
+         "flat_type": models.FlatType.TENANT if i % 3 == 0 else models.FlatType.RESIDENT,
+         "created_at": now, "updated_at": now.replace(microsecond=0)}
+        for i in range(1, SEED_FLATS + 1)
+    ])
+    db.execute(insert(models.Maintenance), [
+        {"flat_id": flat_id, "year": 2025, "month": month, "base_amount": 2500.0 + flat_id % 7,
+         "interest": 250.5 if month % 4 == 0 else 0.0, "total_amount": 2750.5, "amount_paid": 2750.5 if month % 2 else 0.0,
+         "payment_status": models.PaymentStatus.PAID if month % 2 else models.PaymentStatus.OVERDUE,
+         "due_date": datetime(2025, month, 10), "paid_date": datetime(2025, month, 8, 9, 30, 1, 5) if month % 2 else None,
+         "invoice_number": f"INV-{flat_id}-2025{month:02d}",
+         "receipt_number": f"RCP-{flat_id}-2025{month:02d}" if month % 2 else None, "created_at": now}
+        for flat_id in range(1, SEED_FLATS + 1) for month in range(1, SEED_MONTHS + 1)
+    ])
+    db.execute(insert(models.Vendor), [
+        {"vendor_name": f"Vendor {i}", "vendor_work": "plumbing", "phone_number": "9100000000",
+         "email": f"vendor{i}@example.com" if i % 2 else None, "business_details": None,
+         "status": models.VendorStatus.ACTIVE, "total_charges": 1000.0 * i, "amount_paid": 0.0,
+         "amount_remaining": 1000.0 * i, "created_at": now, "updated_at": now}
+        for i in range(1, 501)
+    ])
+    db.commit()
+
+# (label, model, response schema, query taking columns=None for ORM objects)
+CASES = [
+    ("GET /flats/", models.Flat, schemas.FlatResponse,
+     lambda db, columns: crud.get_flats(db, skip=0, limit=SEED_FLATS, columns=columns)),
+    ("GET /maintenance/flat/{flat_id}", models.Maintenance, schemas.MaintenanceResponse,
+     lambda db, columns: crud.get_maintenance_by_flat(db, flat_id=7, columns=columns)),
+    ("GET /maintenance/month/{year}/{month}", models.Maintenance, schemas.MaintenanceResponse,
+     lambda db, columns: crud.get_maintenance_by_month_year(db, month=3, year=2025, columns=columns)),
+    ("GET /vendors/", models.Vendor, schemas.VendorResponse,
+     lambda db, columns: crud.get_vendors(db, skip=0, limit=500, columns=columns)),
+]
+
+def _typed(value):
+    """JSON value with int/float kept distinct, so 1 and 1.0 do not compare equal"""
+    if isinstance(value, dict):
+        return {key: _typed(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_typed(item) for item in value]
+    return (type(value).__name__, value)
+
+def _timed(func):
+    """Result of func and its best time over TIMING_ROUNDS calls"""
+    best = float("inf")
+    for _ in range(TIMING_ROUNDS):
+        started = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - started)
+    return result, best
+
+def check(db: Session):
+    failures = 0
+    for label, model, schema, query in CASES:
+        adapter = TypeAdapter(List[schema])
+
+        def schema_path():
+            db.expunge_all()
+            return adapter.dump_json(adapter.validate_python(query(db, None), from_attributes=True))
+
+        def fast_path():
+            return serializers.json_response(query(db, serializers.columns(model, schema)), schema).body
+
+        slow, slow_seconds = _timed(schema_path)
+        fast, fast_seconds = _timed(fast_path)
+
+        slow_data, fast_data = json.loads(slow), json.loads(fast)
+        if _typed(slow_data) != _typed(fast_data):
+            failures += 1
+            mismatch = next((i for i, (a, b) in enumerate(zip(slow_data, fast_data)) if _typed(a) != _typed(b)), None)
+            print(f"❌ {label}: outputs differ ({len(slow_data)} vs {len(fast_data)} rows)")
+            if mismatch is not None:
+                print(f"   schema: {slow_data[mismatch]}\n   fast:   {fast_data[mismatch]}")
+        else:
+            print(f"✓ {label}: {len(fast_data)} rows identical, "
+                  f"{slow_seconds * 1000:.1f} ms -> {fast_seconds * 1000:.1f} ms")
+    return failures
+
+def main():
+    engine = create_engine(CHECK_DATABASE_URL)
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    with Session(engine) as db:
+        seed(db)
+        failures = check(db)
+    if failures:
+        print(f"\n{failures} response(s) differ between the schema and fast serialization paths")
+        sys.exit(1)
+    print("\nFast serialization matches the response schemas")
+
+if __name__ == "__main__":
+    main()
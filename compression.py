@@ -0,0 +1,150 @@
+"""
+Negotiated response compression
+
+Compresses complete responses of at least COMPRESSION_MIN_BYTES with brotli when the
+client accepts it and the brotli package is installed, otherwise with gzip. Streamed
+bodies (file downloads), partial content and already-encoded responses pass through.
+
+A compressed body is a different representation: its ETag gets the encoding as a
+suffix (so a cache never matches it against the identity bytes) and range support is
+no longer advertised, since byte offsets would not apply to it. Handlers compare
+If-None-Match with etag_matches, which accepts those suffixed ETags as well, and a 304
+for a compressed representation is sent with the ETag the client holds.
+"""
+import gzip
+import os
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # Optional: pip install brotli to offer br
+    brotli = None
+
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+GZIP_LEVEL = 6
+# Dynamic responses favour speed; quality 4 already beats gzip -6 on JSON
+BROTLI_QUALITY = 4
+
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript", "image/svg+xml")
+# In order of preference when the client rates them equally
+CODINGS = ("br", "gzip")
+
+def negotiate(accept_encoding: str):
+    """Preferred supported encoding from an Accept-Encoding header, or None"""
+    offered = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if coding:
+            offered[coding.strip().lower()] = quality
+    best, best_quality = None, 0.0
+    for coding in CODINGS:
+        if coding == "br" and brotli is None:
+            continue
+        quality = offered.get(coding, offered.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+def _opaque_tag(etag: str):
+    etag = etag.strip()
+    return (etag[2:] if etag.startswith("W/") else etag).strip('"')
+
+def encoded_etag(etag: str, coding: str):
+    """Weak ETag of the coding's representation (W/"abc-gzip" for "abc")"""
+    return f'W/"{_opaque_tag(etag)}-{coding}"'
+
+def matching_coding(if_none_match: str, etag: str):
+    """The representation of etag an If-None-Match header names: "" for the identity
+    bytes, a coding for a compressed one, None if it names neither. Compared weakly."""
+    if not if_none_match:
+        return None
+    if if_none_match.strip() == "*":
+        return ""
+    opaque = _opaque_tag(etag)
+    for candidate in if_none_match.split(","):
+        candidate = _opaque_tag(candidate)
+        if candidate == opaque:
+            return ""
+        for coding in CODINGS:
+            if candidate == f"{opaque}-{coding}":
+                return coding
+    return None
+
+def etag_matches(if_none_match: str, etag: str):
+    """Whether If-None-Match names etag or one of its compressed representations"""
+    return matching_coding(if_none_match, etag) is not None
+
+def compress(body: bytes, coding: str):
+    if coding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request_headers = Headers(scope=scope)
+        coding = negotiate(request_headers.get("accept-encoding", ""))
+        if coding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start_message, passthrough
+            if message["type"] == "http.response.start":
+                start_message = message
+                headers = Headers(raw=message["headers"])
+                content_type = headers.get("content-type", "")
+                passthrough = (
+                    message["status"] in (204, 206, 304)
+                    or "content-encoding" in headers
+                    or not content_type.startswith(COMPRESSIBLE_TYPES)
+                )
+                if passthrough:
+                    if message["status"] == 304 and "etag" in headers:
+                        # Revalidated a compressed copy: answer with the ETag it was sent with
+                        held = matching_coding(request_headers.get("if-none-match", ""), headers["etag"])
+                        if held:
+                            MutableHeaders(raw=message["headers"])["ETag"] = encoded_etag(headers["etag"], held)
+                        MutableHeaders(raw=message["headers"]).add_vary_header("Accept-Encoding")
+                    await send(message)
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            if start_message is not None:
+                headers = MutableHeaders(raw=start_message["headers"])
+                # Only whole bodies are compressed; streams go out as they are
+                if not message.get("more_body", False) and len(body) >= self.minimum_size:
+                    body = compress(body, coding)
+                    headers["Content-Encoding"] = coding
+                    headers["Content-Length"] = str(len(body))
+                    if "etag" in headers:
+                        headers["ETag"] = encoded_etag(headers["etag"], coding)
+                    for name in ("accept-ranges", "content-range"):
+                        if name in headers:
+                            del headers[name]
+                headers.add_vary_header("Accept-Encoding")
+                await send(start_message)
+                start_message = None
+            await send({**message, "body": body})
+
+        await self.app(scope, receive, send_compressed)
@@ -3,11 +3,14 @@ Script to create or reset admin user
 """
 from database import SessionLocal
 import models
+import crud
 from auth import get_password_hash, verify_password
 
 def create_admin():
     db = SessionLocal()
     try:
+        crud.ensure_default_society(db)
+        
         # Check if admin exists
         admin = db.query(models.User).filter(models.User.username == "admin").first()
         
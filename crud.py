@@ -1,17 +1,165 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import and_
+from sqlalchemy import String, and_, bindparam, case, cast, delete, func, insert, literal, or_, select, true, update
+from sqlalchemy.exc import IntegrityError
 import models
 import schemas
-from auth import get_password_hash
+import archive
+import audit
+from auth import USER_BY_USERNAME, get_password_hash
+from database import DEFAULT_SOCIETY_ID
 from datetime import datetime, timedelta
+from functools import lru_cache
 from typing import List, Optional
 
+# Interest charged on maintenance that is still pending after its due date
+INTEREST_RATE = 0.10
+
+# The hottest lookups are statements built once with bound parameters rather than a new
+# Query per call, so each call skips statement construction and SQLAlchemy finds the
+# compiled SQL in its cache from the statement's memoized cache key; reuse_scoped keeps
+# that true under society scoping. Sparse fieldset variants are built once per set of
+# columns.
+def _entities(model, keys: tuple):
+    return [getattr(model, key) for key in keys] if keys else [model]
+
+@lru_cache(maxsize=256)
+def _by_id(model, keys: tuple = ()):
+    return select(*_entities(model, keys)).where(model.id == bindparam("id")).limit(1).execution_options(
+        reuse_scoped=True
+    )
+
+@lru_cache(maxsize=256)
+def _maintenance_by_flat(keys: tuple = ()):
+    maintenance = models.Maintenance
+    return select(*_entities(maintenance, keys)).where(
+        maintenance.flat_id == bindparam("flat_id")
+    ).order_by(maintenance.year.desc(), maintenance.month.desc()).offset(bindparam("skip")).limit(
+        bindparam("limit")
+    ).execution_options(reuse_scoped=True)
+
+def _keys(columns):
+    return tuple(column.key for column in columns) if columns else ()
+
+def _fetch(db: Session, statement, params: dict, columns=None):
+    """Result of a cached statement: rows for a column list, else ORM objects"""
+    result = db.execute(statement, params)
+    return result if columns else result.scalars()
+
+# Society CRUD
+def current_society_id(db: Session):
+    """Society the session is scoped to; unscoped sessions act for the default society"""
+    return db.info.get("society_id") or DEFAULT_SOCIETY_ID
+
+# Writes are single INSERT/UPDATE/DELETE ... RETURNING statements: the row comes back in
+# the same round trip, so nothing is read before the write or refreshed after the commit,
+# and the unique and foreign key constraints detect conflicts.
+def _commit_rows(db: Session, model, action: str, statement, before=None, conflicts: dict = None):
+    """Run statement, audit and commit; conflicts maps error text to a ValueError message
+
+    before(row) gives an update's previous values for the audit log.
+    """
+    try:
+        rows = db.execute(statement).all()
+        for row in rows:
+            audit.track(db, model, action, row, before(row) if before else None)
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        error = str(e.orig).lower()
+        for marker, message in (conflicts or {}).items():
+            if marker in error:
+                raise ValueError(message) from e
+        raise
+    return rows
+
+def _insert(db: Session, model, values: dict, conflicts: dict = None):
+    if issubclass(model, models.SocietyScoped):
+        values.setdefault("society_id", current_society_id(db))
+    statement = insert(model).values(**values).returning(*model.__table__.columns)
+    return _commit_rows(db, model, "create", statement, conflicts=conflicts)[0]
+
+def _update_many(db: Session, model, ids: list, values: dict, conflicts: dict = None):
+    """Apply values to the rows with these ids in one statement; returns the updated rows"""
+    columns = model.__table__.columns
+    keys = list(values)
+    before = None
+    if model not in audit.AUDITED_MODELS:
+        statement = update(model).where(model.id.in_(ids)).returning(*columns)
+    elif db.get_bind().dialect.name == "postgresql":
+        # Join the locked pre-update rows so old and new values come back together
+        old = select(model).where(model.id.in_(ids)).with_for_update().subquery("old")
+        statement = update(model).where(model.id == old.c.id).returning(
+            *columns, *(old.c[key].label(f"old_{key}") for key in keys)
+        )
+        before = lambda row: {key: row._mapping[f"old_{key}"] for key in keys}
+    else:
+        # Other databases cannot return columns of an UPDATE's FROM clause; read them first
+        previous = {
+            row.id: {key: row._mapping[key] for key in keys}
+            for row in db.execute(select(model.id, *(getattr(model, key) for key in keys)).where(model.id.in_(ids)))
+        }
+        if not previous:
+            return []
+        statement = update(model).where(model.id.in_(previous)).returning(*columns)
+        before = lambda row: previous[row.id]
+    statement = statement.values(**values).execution_options(synchronize_session=False)
+    return _commit_rows(db, model, "update", statement, before, conflicts)
+
+def _update(db: Session, model, entity_id: int, values: dict, conflicts: dict = None):
+    """Updated row, or None if there is no such row"""
+    rows = _update_many(db, model, [entity_id], values, conflicts)
+    return rows[0] if rows else None
+
+def _delete(db: Session, model, entity_id: int, conflicts: dict = None):
+    """Deleted row, or None if there is no such row
+
+    A row still referenced through a RESTRICT foreign key is left in place; map the
+    violation to a message with conflicts={"foreign key": ...}.
+    """
+    statement = delete(model).where(model.id == entity_id).returning(*model.__table__.columns)
+    rows = _commit_rows(db, model, "delete", statement.execution_options(synchronize_session=False), conflicts=conflicts)
+    return rows[0] if rows else None
+
+def _per_item(model, items: list, key: str):
+    """CASE id WHEN ... THEN value ... END for the items that set key, else the current value"""
+    column = getattr(model, key)
+    whens = {item["id"]: literal(item[key], column.type) for item in items if key in item}
+    return case(whens, value=model.id, else_=column)
+
+def get_society(db: Session, society_id: int):
+    return db.query(models.Society).filter(models.Society.id == society_id).first()
+
+def get_society_by_code(db: Session, code: str):
+    return db.query(models.Society).filter(models.Society.code == code).first()
+
+def get_societies(db: Session, skip: int = 0, limit: int = 100):
+    return db.query(models.Society).offset(skip).limit(limit).all()
+
+def create_society(db: Session, society: schemas.SocietyCreate):
+    db_society = models.Society(name=society.name, code=society.code)
+    db.add(db_society)
+    db.commit()
+    db.refresh(db_society)
+    return db_society
+
+def ensure_society(db: Session, society_id: int, name: str, code: str):
+    """Create the society row if missing; routed databases need their own copy for FKs"""
+    db_society = get_society(db, society_id)
+    if not db_society:
+        db_society = models.Society(id=society_id, name=name, code=code)
+        db.add(db_society)
+        db.commit()
+    return db_society
+
+def ensure_default_society(db: Session):
+    return ensure_society(db, DEFAULT_SOCIETY_ID, "Default Society", "default")
+
 # User CRUD
 def get_user(db: Session, user_id: int):
     return db.query(models.User).filter(models.User.id == user_id).first()
 
 def get_user_by_username(db: Session, username: str):
-    return db.query(models.User).filter(models.User.username == username).first()
+    return db.execute(USER_BY_USERNAME, {"username": username}).scalars().first()
 
 def get_user_by_email(db: Session, email: str):
     return db.query(models.User).filter(models.User.email == email).first()
@@ -19,9 +167,11 @@ def get_user_by_email(db: Session, email: str):
 def get_users(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.User).offset(skip).limit(limit).all()
 
-def create_user(db: Session, user: schemas.UserCreate):
+USER_CONFLICTS = {"username": "Username already registered", "email": "Email already registered"}
+
+def create_user(db: Session, user: schemas.UserCreate, society_id: Optional[int] = None):
     hashed_password = get_password_hash(user.password)
-    db_user = models.User(
+    values = dict(
         username=user.username,
         email=user.email,
         hashed_password=hashed_password,
@@ -29,61 +179,39 @@ def create_user(db: Session, user: schemas.UserCreate):
         phone_number=user.phone_number,
         role=user.role
     )
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    return db_user
+    if society_id is not None:
+        values["society_id"] = society_id
+    return _insert(db, models.User, values, conflicts=USER_CONFLICTS)
 
 def update_user(db: Session, user_id: int, user: schemas.UserUpdate):
-    db_user = get_user(db, user_id)
-    if db_user:
-        for key, value in user.dict(exclude_unset=True).items():
-            setattr(db_user, key, value)
-        db_user.updated_at = datetime.utcnow()
-        db.commit()
-        db.refresh(db_user)
-    return db_user
+    values = {**user.dict(exclude_unset=True), "updated_at": datetime.utcnow()}
+    return _update(db, models.User, user_id, values, conflicts=USER_CONFLICTS)
 
 def delete_user(db: Session, user_id: int):
-    db_user = get_user(db, user_id)
-    if db_user:
-        db.delete(db_user)
-        db.commit()
-    return db_user
+    return _delete(db, models.User, user_id, conflicts={"foreign key": "User still owns flats"})
 
 # Flat CRUD
-def get_flat(db: Session, flat_id: int):
-    return db.query(models.Flat).filter(models.Flat.id == flat_id).first()
+def get_flat(db: Session, flat_id: int, columns=None):
+    return _fetch(db, _by_id(models.Flat, _keys(columns)), {"id": flat_id}, columns).first()
 
 def get_flat_by_number(db: Session, flat_number: str):
     return db.query(models.Flat).filter(models.Flat.flat_number == flat_number).first()
 
-def get_flats(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Flat).offset(skip).limit(limit).all()
+def get_flats(db: Session, skip: int = 0, limit: int = 100, columns=None):
+    """Flats as ORM objects, or as lightweight rows of just the given columns"""
+    return db.query(*(columns or [models.Flat])).offset(skip).limit(limit).all()
 
 def create_flat(db: Session, flat: schemas.FlatCreate):
-    db_flat = models.Flat(**flat.dict())
-    db.add(db_flat)
-    db.commit()
-    db.refresh(db_flat)
-    return db_flat
+    return _insert(db, models.Flat, flat.dict(), conflicts={"flat_number": "Flat number already exists"})
 
 def update_flat(db: Session, flat_id: int, flat: schemas.FlatUpdate):
-    db_flat = get_flat(db, flat_id)
-    if db_flat:
-        for key, value in flat.dict(exclude_unset=True).items():
-            setattr(db_flat, key, value)
-        db_flat.updated_at = datetime.utcnow()
-        db.commit()
-        db.refresh(db_flat)
-    return db_flat
+    values = {**flat.dict(exclude_unset=True), "updated_at": datetime.utcnow()}
+    return _update(db, models.Flat, flat_id, values)
 
 def delete_flat(db: Session, flat_id: int):
-    db_flat = get_flat(db, flat_id)
-    if db_flat:
-        db.delete(db_flat)
-        db.commit()
-    return db_flat
+    return _delete(db, models.Flat, flat_id, conflicts={
+        "foreign key": "Flat still has tenant, resident or maintenance records"
+    })
 
 # Tenant History CRUD
 def get_tenant_history(db: Session, tenant_id: int):
@@ -95,45 +223,80 @@ def get_tenant_histories_by_flat(db: Session, flat_id: int):
     ).order_by(models.TenantHistory.agreement_start_date.desc()).all()
 
 def get_current_tenant(db: Session, flat_id: int):
+    # Single probe of the partial unique index on current tenancies
     return db.query(models.TenantHistory).filter(
         and_(models.TenantHistory.flat_id == flat_id, models.TenantHistory.is_current == True)
     ).first()
 
+def get_current_occupants(db: Session, skip: int = 0, limit: int = 100):
+    """Flats with their current tenant (or None), in one query"""
+    return db.query(models.Flat, models.TenantHistory).outerjoin(
+        models.TenantHistory,
+        and_(models.TenantHistory.flat_id == models.Flat.id, models.TenantHistory.is_current == True)
+    ).order_by(models.Flat.flat_number).offset(skip).limit(limit).all()
+
+def get_expiring_tenancies(db: Session, days: int = 30):
+    """Current tenancies whose agreement ends within days, including already lapsed ones"""
+    cutoff = datetime.utcnow() + timedelta(days=days)
+    return db.query(models.TenantHistory).filter(
+        models.TenantHistory.is_current == True,
+        models.TenantHistory.agreement_end_date <= cutoff
+    ).order_by(models.TenantHistory.agreement_end_date).all()
+
+def get_occupancy(db: Session, start: datetime, end: datetime, flat_id: Optional[int] = None):
+    """Tenancies whose agreement period overlaps [start, end), by flat and start date"""
+    tenancy = models.TenantHistory
+    if db.get_bind().dialect.name == "postgresql":
+        overlaps = models.period_range(tenancy.agreement_start_date, tenancy.agreement_end_date).op("&&")(
+            models.period_range(start, end)
+        )
+    else:
+        overlaps = and_(
+            tenancy.agreement_start_date < end,
+            or_(tenancy.agreement_end_date.is_(None), tenancy.agreement_end_date > start)
+        )
+    query = db.query(tenancy).filter(overlaps)
+    if flat_id is not None:
+        query = query.filter(tenancy.flat_id == flat_id)
+    return query.order_by(tenancy.flat_id, tenancy.agreement_start_date).all()
+
+def _end_current_tenancy(db: Session, flat_id: int, keep_id: Optional[int] = None):
+    """Clear is_current on the flat's current tenancy (at most one row)"""
+    # Lock the flat so concurrent changeovers of the same flat run one at a time
+    db.query(models.Flat.id).filter(models.Flat.id == flat_id).with_for_update().first()
+    query = db.query(models.TenantHistory).filter(
+        models.TenantHistory.flat_id == flat_id, models.TenantHistory.is_current == True
+    )
+    if keep_id is not None:
+        query = query.filter(models.TenantHistory.id != keep_id)
+    query.update({"is_current": False, "updated_at": datetime.utcnow()}, synchronize_session=False)
+    # Flush before the new current row so the unique index never sees two
+    db.flush()
+
 def create_tenant_history(db: Session, tenant: schemas.TenantHistoryCreate):
-    # Mark all previous tenants as not current
-    db.query(models.TenantHistory).filter(
-        models.TenantHistory.flat_id == tenant.flat_id
-    ).update({"is_current": False})
+    _end_current_tenancy(db, tenant.flat_id)
     
     # Calculate end date
     end_date = tenant.agreement_start_date + timedelta(days=30 * tenant.agreement_duration)
     
-    db_tenant = models.TenantHistory(
+    values = dict(
         **tenant.dict(),
         agreement_end_date=end_date,
         is_current=True
     )
-    db.add(db_tenant)
-    db.commit()
-    db.refresh(db_tenant)
-    return db_tenant
+    return _insert(db, models.TenantHistory, values)
 
 def update_tenant_history(db: Session, tenant_id: int, tenant: schemas.TenantHistoryUpdate):
-    db_tenant = get_tenant_history(db, tenant_id)
-    if db_tenant:
-        for key, value in tenant.dict(exclude_unset=True).items():
-            setattr(db_tenant, key, value)
-        db_tenant.updated_at = datetime.utcnow()
-        db.commit()
-        db.refresh(db_tenant)
-    return db_tenant
+    if tenant.is_current:
+        flat_id = db.query(models.TenantHistory.flat_id).filter(models.TenantHistory.id == tenant_id).scalar()
+        if flat_id is None:
+            return None
+        _end_current_tenancy(db, flat_id, keep_id=tenant_id)
+    values = {**tenant.dict(exclude_unset=True), "updated_at": datetime.utcnow()}
+    return _update(db, models.TenantHistory, tenant_id, values)
 
 def delete_tenant_history(db: Session, tenant_id: int):
-    db_tenant = get_tenant_history(db, tenant_id)
-    if db_tenant:
-        db.delete(db_tenant)
-        db.commit()
-    return db_tenant
+    return _delete(db, models.TenantHistory, tenant_id)
 
 # Flat Resident CRUD
 def get_flat_resident(db: Session, resident_id: int):
@@ -143,40 +306,38 @@ def get_flat_residents_by_flat(db: Session, flat_id: int):
     return db.query(models.FlatResident).filter(models.FlatResident.flat_id == flat_id).all()
 
 def create_flat_resident(db: Session, resident: schemas.FlatResidentCreate):
-    db_resident = models.FlatResident(**resident.dict())
-    db.add(db_resident)
-    db.commit()
-    db.refresh(db_resident)
-    return db_resident
+    return _insert(db, models.FlatResident, resident.dict())
 
 def update_flat_resident(db: Session, resident_id: int, resident: schemas.FlatResidentUpdate):
-    db_resident = get_flat_resident(db, resident_id)
-    if db_resident:
-        for key, value in resident.dict(exclude_unset=True).items():
-            setattr(db_resident, key, value)
-        db_resident.updated_at = datetime.utcnow()
-        db.commit()
-        db.refresh(db_resident)
-    return db_resident
+    values = {**resident.dict(exclude_unset=True), "updated_at": datetime.utcnow()}
+    return _update(db, models.FlatResident, resident_id, values)
 
 def delete_flat_resident(db: Session, resident_id: int):
-    db_resident = get_flat_resident(db, resident_id)
-    if db_resident:
-        db.delete(db_resident)
-        db.commit()
-    return db_resident
+    return _delete(db, models.FlatResident, resident_id)
 
 # Maintenance CRUD
-def get_maintenance(db: Session, maintenance_id: int):
-    return db.query(models.Maintenance).filter(models.Maintenance.id == maintenance_id).first()
+def get_maintenance(db: Session, maintenance_id: int, columns=None):
+    return _fetch(db, _by_id(models.Maintenance, _keys(columns)), {"id": maintenance_id}, columns).first()
 
-def get_maintenance_by_flat(db: Session, flat_id: int, skip: int = 0, limit: int = 100):
-    return db.query(models.Maintenance).filter(
-        models.Maintenance.flat_id == flat_id
-    ).order_by(models.Maintenance.year.desc(), models.Maintenance.month.desc()).offset(skip).limit(limit).all()
+def get_maintenance_by_flat(db: Session, flat_id: int, skip: int = 0, limit: int = 100, include_archived: bool = False, columns=None):
+    records = _fetch(
+        db, _maintenance_by_flat(_keys(columns)), {"flat_id": flat_id, "skip": skip, "limit": limit}, columns
+    ).all()
+    if not include_archived or len(records) == limit:
+        return records
 
-def get_maintenance_by_month_year(db: Session, month: int, year: int):
-    return db.query(models.Maintenance).filter(
+    # Page continues past the hot rows into archived years
+    hot_count = db.query(func.count(models.Maintenance.id)).filter(
+        models.Maintenance.flat_id == flat_id
+    ).scalar()
+    archive_skip = max(0, skip - hot_count)
+    archived = archive.get_archived_maintenance_by_flat(current_society_id(db), flat_id)
+    return records + archived[archive_skip:archive_skip + limit - len(records)]
+
+def get_maintenance_by_month_year(db: Session, month: int, year: int, columns=None):
+    if archive.is_archived(current_society_id(db), year):
+        return archive.read_archived_maintenance(current_society_id(db), year, month=month)
+    return db.query(*(columns or [models.Maintenance])).filter(
         and_(models.Maintenance.month == month, models.Maintenance.year == year)
     ).all()
 
@@ -187,86 +348,255 @@ def create_maintenance(db: Session, maintenance: schemas.MaintenanceCreate):
     # Calculate due date (10th of the month)
     due_date = datetime(maintenance.year, maintenance.month, 10)
     
-    db_maintenance = models.Maintenance(
+    values = dict(
         **maintenance.dict(),
         total_amount=maintenance.base_amount,
         invoice_number=invoice_number,
         due_date=due_date
     )
-    db.add(db_maintenance)
-    db.commit()
-    db.refresh(db_maintenance)
-    return db_maintenance
+    return _insert(db, models.Maintenance, values, conflicts={
+        "month": "Maintenance for this flat and month already exists"
+    })
+
+def _receipt_values(record, paid):
+    """Receipt number and paid date for rows matching paid that have no receipt yet"""
+    unreceipted = and_(paid, or_(record.receipt_number.is_(None), record.receipt_number == ""))
+    receipt_number = (
+        literal("REC-") + cast(record.flat_id, String) + "-" + cast(record.year, String)
+        + case((record.month < 10, "0"), else_="") + cast(record.month, String)
+    )
+    return {
+        "receipt_number": case((unreceipted, receipt_number), else_=record.receipt_number),
+        "paid_date": case((unreceipted, datetime.utcnow()), else_=record.paid_date),
+    }
 
 def update_maintenance(db: Session, maintenance_id: int, maintenance: schemas.MaintenanceUpdate):
-    db_maintenance = get_maintenance(db, maintenance_id)
-    if db_maintenance:
-        for key, value in maintenance.dict(exclude_unset=True).items():
-            setattr(db_maintenance, key, value)
-        
-        # Generate receipt if paid
-        if maintenance.payment_status == models.PaymentStatus.PAID and not db_maintenance.receipt_number:
-            db_maintenance.receipt_number = f"REC-{db_maintenance.flat_id}-{db_maintenance.year}{db_maintenance.month:02d}"
-            db_maintenance.paid_date = datetime.utcnow()
-        
-        db_maintenance.updated_at = datetime.utcnow()
-        db.commit()
-        db.refresh(db_maintenance)
-    return db_maintenance
+    record = models.Maintenance
+    values = maintenance.dict(exclude_unset=True)
+    
+    # Generate receipt if paid, computed in the UPDATE from the row's own flat and period
+    if maintenance.payment_status == models.PaymentStatus.PAID:
+        values.update(_receipt_values(record, true()))
+    
+    values["updated_at"] = datetime.utcnow()
+    return _update(db, record, maintenance_id, values)
+
+def update_maintenance_bulk(db: Session, items: List[schemas.MaintenanceBulkItem]):
+    """Apply each item's changes in one UPDATE and transaction; returns the updated rows"""
+    record = models.Maintenance
+    changes = [item.dict(exclude_unset=True) for item in items]
+    keys = sorted({key for change in changes for key in change} - {"id"})
+    values = {key: _per_item(record, changes, key) for key in keys}
+    
+    paid_ids = [item.id for item in items if item.payment_status == models.PaymentStatus.PAID]
+    if paid_ids:
+        values.update(_receipt_values(record, record.id.in_(paid_ids)))
+    
+    values["updated_at"] = datetime.utcnow()
+    return _update_many(db, record, [item.id for item in items], values)
 
-def apply_interest_to_overdue(db: Session):
-    """Apply 10% interest to overdue maintenance"""
+def apply_interest_to_overdue(db: Session, progress=None, batch_size: int = 1000):
+    """Apply 10% interest to overdue maintenance, committing in batches"""
     current_date = datetime.utcnow()
-    overdue_records = db.query(models.Maintenance).filter(
-        and_(
-            models.Maintenance.payment_status == models.PaymentStatus.PENDING,
-            models.Maintenance.due_date < current_date
-        )
-    ).all()
+    overdue = and_(
+        models.Maintenance.payment_status == models.PaymentStatus.PENDING,
+        models.Maintenance.due_date < current_date
+    )
+    total = db.query(func.count(models.Maintenance.id)).filter(overdue).scalar()
+    processed = 0
     
-    for record in overdue_records:
-        record.interest = record.base_amount * 0.10
-        record.total_amount = record.base_amount + record.interest
-        record.payment_status = models.PaymentStatus.OVERDUE
+    while True:
+        ids = [row.id for row in db.query(models.Maintenance.id).filter(overdue).limit(batch_size)]
+        if not ids:
+            break
+        # Money columns hold whole paise, so interest is rounded to the paisa in SQL
+        interest = func.round(models.Maintenance.base_amount * INTEREST_RATE)
+        db.query(models.Maintenance).filter(models.Maintenance.id.in_(ids)).update({
+            models.Maintenance.interest: interest,
+            models.Maintenance.total_amount: models.Maintenance.base_amount + interest,
+            models.Maintenance.payment_status: models.PaymentStatus.OVERDUE,
+            models.Maintenance.updated_at: current_date
+        }, synchronize_session=False)
+        db.commit()
+        processed += len(ids)
+        if progress:
+            progress(processed, total)
+    return processed
+
+def rollup_maintenance_balances(db: Session, progress=None):
+    """Recompute per-society monthly billing totals into maintenance_rollups"""
+    rows = db.query(
+        models.Maintenance.society_id,
+        models.Maintenance.year,
+        models.Maintenance.month,
+        func.count(models.Maintenance.id),
+        func.coalesce(func.sum(models.Maintenance.total_amount), 0),
+        func.coalesce(func.sum(models.Maintenance.amount_paid), 0),
+        func.coalesce(func.sum(models.Maintenance.total_amount - models.Maintenance.amount_paid), 0),
+        func.sum(case((models.Maintenance.payment_status == models.PaymentStatus.OVERDUE, 1), else_=0))
+    ).group_by(
+        models.Maintenance.society_id, models.Maintenance.year, models.Maintenance.month
+    ).all()
     
+    # Replace the rollups in one transaction so readers never see a partial set
+    society_ids = {row[0] for row in rows}
+    if society_ids:
+        db.query(models.MaintenanceRollup).filter(
+            models.MaintenanceRollup.society_id.in_(society_ids)
+        ).delete(synchronize_session=False)
+    now = datetime.utcnow()
+    db.add_all([
+        models.MaintenanceRollup(
+            society_id=society_id,
+            year=year,
+            month=month,
+            flats_billed=flats_billed,
+            total_billed=total_billed,
+            total_paid=total_paid,
+            outstanding=outstanding,
+            overdue_count=overdue_count or 0,
+            updated_at=now
+        )
+        for society_id, year, month, flats_billed, total_billed, total_paid, outstanding, overdue_count in rows
+    ])
     db.commit()
-    return len(overdue_records)
+    if progress:
+        progress(len(rows), len(rows))
+    return len(rows)
+
+def get_maintenance_rollups(db: Session, year: Optional[int] = None):
+    query = db.query(models.MaintenanceRollup)
+    if year is not None:
+        query = query.filter(models.MaintenanceRollup.year == year)
+    return query.order_by(models.MaintenanceRollup.year.desc(), models.MaintenanceRollup.month.desc()).all()
+
+GRID_MAX_MONTHS = 24
+GRID_MAX_FLATS = 2000
+
+def get_maintenance_grid(db: Session, year: int, month: int, months: int = 12,
+                         after: Optional[str] = None, limit: int = 500):
+    """Flats against the months ending at year/month, pivoted in one query into column arrays
+
+    Flats are ordered by flat number and paged by range: the next page starts after
+    next_after. Cells without a bill are None.
+    """
+    if not 1 <= month <= 12:
+        raise ValueError("month must be between 1 and 12")
+    if not 1 <= months <= GRID_MAX_MONTHS:
+        raise ValueError(f"months must be between 1 and {GRID_MAX_MONTHS}")
+    if not 1 <= limit <= GRID_MAX_FLATS:
+        raise ValueError(f"limit must be between 1 and {GRID_MAX_FLATS}")
+    last = year * 12 + month - 1
+    periods = [divmod(index, 12) for index in range(last - months + 1, last + 1)]
+
+    flats = db.query(models.Flat.id, models.Flat.flat_number, models.Flat.owner_name)
+    if after is not None:
+        flats = flats.filter(models.Flat.flat_number > after)
+    page = flats.order_by(models.Flat.flat_number).limit(limit).subquery()
+
+    # One column per month and field: max() picks the month's single bill or NULL
+    maintenance = models.Maintenance
+    cells = []
+    for period_year, period_month in periods:
+        in_month = and_(maintenance.year == period_year, maintenance.month == period_month + 1)
+        cells += [
+            func.max(case((in_month, maintenance.payment_status))),
+            func.max(case((in_month, maintenance.total_amount))),
+            func.max(case((in_month, maintenance.amount_paid))),
+        ]
+    first_year, first_month = periods[0]
+    rows = db.query(page.c.id, page.c.flat_number, page.c.owner_name, *cells).outerjoin(
+        maintenance,
+        and_(
+            maintenance.flat_id == page.c.id,
+            maintenance.year.between(first_year, year),
+            maintenance.year * 12 + maintenance.month - 1 >= first_year * 12 + first_month,
+            maintenance.year * 12 + maintenance.month - 1 <= last,
+        )
+    ).group_by(page.c.id, page.c.flat_number, page.c.owner_name).order_by(page.c.flat_number).all()
+
+    statuses, amounts, paid = [], [], []
+    for row in rows:
+        values = row[3:]
+        statuses.append([status.value if status is not None else None for status in values[0::3]])
+        # Sent as plain JSON numbers, as schemas.Money serializes them
+        amounts.append([float(value) if value is not None else None for value in values[1::3]])
+        paid.append([float(value) if value is not None else None for value in values[2::3]])
+    return {
+        "months": [f"{period_year}-{period_month + 1:02d}" for period_year, period_month in periods],
+        "flat_id": [row[0] for row in rows],
+        "flat_number": [row[1] for row in rows],
+        "owner_name": [row[2] for row in rows],
+        "status": statuses,
+        "amount": amounts,
+        "paid": paid,
+        "next_after": rows[-1][1] if len(rows) == limit else None,
+    }
 
 # Vendor CRUD
-def get_vendor(db: Session, vendor_id: int):
-    return db.query(models.Vendor).filter(models.Vendor.id == vendor_id).first()
+def get_vendor(db: Session, vendor_id: int, columns=None):
+    return db.query(*(columns or [models.Vendor])).filter(models.Vendor.id == vendor_id).first()
 
-def get_vendors(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Vendor).offset(skip).limit(limit).all()
+def get_vendors(db: Session, skip: int = 0, limit: int = 100, columns=None):
+    return db.query(*(columns or [models.Vendor])).offset(skip).limit(limit).all()
 
 def get_vendors_by_status(db: Session, status: models.VendorStatus):
     return db.query(models.Vendor).filter(models.Vendor.status == status).all()
 
 def create_vendor(db: Session, vendor: schemas.VendorCreate):
-    db_vendor = models.Vendor(**vendor.dict())
-    db.add(db_vendor)
-    db.commit()
-    db.refresh(db_vendor)
-    return db_vendor
+    return _insert(db, models.Vendor, vendor.dict())
+
+def _amount_remaining(change: dict):
+    # SET expressions read the row's values before the update
+    vendor = models.Vendor
+    total_charges = vendor.total_charges if change.get("total_charges") is None \
+        else literal(change["total_charges"], vendor.total_charges.type)
+    amount_paid = vendor.amount_paid if change.get("amount_paid") is None \
+        else literal(change["amount_paid"], vendor.amount_paid.type)
+    return total_charges - amount_paid
 
 def update_vendor(db: Session, vendor_id: int, vendor: schemas.VendorUpdate):
-    db_vendor = get_vendor(db, vendor_id)
-    if db_vendor:
-        for key, value in vendor.dict(exclude_unset=True).items():
-            setattr(db_vendor, key, value)
-        
-        # Calculate remaining amount
-        if vendor.total_charges is not None or vendor.amount_paid is not None:
-            db_vendor.amount_remaining = db_vendor.total_charges - db_vendor.amount_paid
-        
-        db_vendor.updated_at = datetime.utcnow()
-        db.commit()
-        db.refresh(db_vendor)
-    return db_vendor
+    values = vendor.dict(exclude_unset=True)
+    
+    # Calculate remaining amount
+    if vendor.total_charges is not None or vendor.amount_paid is not None:
+        values["amount_remaining"] = _amount_remaining(values)
+    
+    values["updated_at"] = datetime.utcnow()
+    return _update(db, models.Vendor, vendor_id, values)
+
+def update_vendors_bulk(db: Session, items: List[schemas.VendorBulkItem]):
+    """Apply each item's changes in one UPDATE and transaction; returns the updated rows"""
+    vendor = models.Vendor
+    changes = [item.dict(exclude_unset=True) for item in items]
+    keys = sorted({key for change in changes for key in change} - {"id"})
+    values = {key: _per_item(vendor, changes, key) for key in keys}
+    
+    # Calculate remaining amount for the items that change charges or payments
+    remaining = {
+        change["id"]: _amount_remaining(change) for change in changes
+        if change.get("total_charges") is not None or change.get("amount_paid") is not None
+    }
+    if remaining:
+        values["amount_remaining"] = case(remaining, value=vendor.id, else_=vendor.amount_remaining)
+    
+    values["updated_at"] = datetime.utcnow()
+    return _update_many(db, vendor, [item.id for item in items], values)
 
 def delete_vendor(db: Session, vendor_id: int):
-    db_vendor = get_vendor(db, vendor_id)
-    if db_vendor:
-        db.delete(db_vendor)
-        db.commit()
-    return db_vendor
+    return _delete(db, models.Vendor, vendor_id)
+
+# Audit Log
+def get_audit_log(db: Session, entity_type: Optional[str] = None, entity_id: Optional[int] = None,
+                  since: Optional[datetime] = None, until: Optional[datetime] = None,
+                  skip: int = 0, limit: int = 100):
+    query = db.query(models.AuditLog)
+    if entity_type is not None:
+        query = query.filter(models.AuditLog.entity_type == entity_type)
+    if entity_id is not None:
+        query = query.filter(models.AuditLog.entity_id == entity_id)
+    if since is not None:
+        query = query.filter(models.AuditLog.created_at >= since)
+    if until is not None:
+        query = query.filter(models.AuditLog.created_at < until)
+    return query.order_by(models.AuditLog.created_at.desc(), models.AuditLog.id.desc()).offset(skip).limit(limit).all()
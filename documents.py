@@ -0,0 +1,199 @@
+"""
+Invoice and receipt rendering
+
+Maintenance rows are rendered to HTML from templates/ into INVOICE_DIR and RECEIPT_DIR,
+laid out as <dir>/<society_id>/<year>-<month>/<number>.html. Each month directory keeps
+a manifest of content hashes so unchanged documents are not rewritten, and large
+batches are spread over a process pool.
+"""
+import hashlib
+import html
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import lru_cache
+from string import Template
+from typing import Optional
+
+from sqlalchemy import and_
+from sqlalchemy.orm import Session
+
+import models
+
+INVOICE_DIR = os.getenv("INVOICE_DIR", "invoices")
+RECEIPT_DIR = os.getenv("RECEIPT_DIR", "receipts")
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", str(os.cpu_count() or 1)))
+# Below this many documents a process pool costs more than it saves
+POOL_THRESHOLD = 200
+CHUNK_SIZE = 250
+
+KINDS = {
+    "invoice": {"dir": INVOICE_DIR, "number": "invoice_number"},
+    "receipt": {"dir": RECEIPT_DIR, "number": "receipt_number"},
+}
+
+@lru_cache(maxsize=None)
+def _load_template(kind: str, mtime: float):
+    with open(os.path.join(TEMPLATE_DIR, f"{kind}.html"), encoding="utf-8") as f:
+        source = f.read()
+    return Template(source), hashlib.sha256(source.encode()).hexdigest()
+
+def get_template(kind: str):
+    """Parsed template and its hash; re-read only when the file changes"""
+    return _load_template(kind, os.path.getmtime(os.path.join(TEMPLATE_DIR, f"{kind}.html")))
+
+def _money(value):
+    return f"{value or 0:,.2f}"
+
+def _date(value):
+    return value.strftime("%d %b %Y") if value else ""
+
+def _context(row: dict):
+    values = {
+        "society_name": row["society_name"],
+        "flat_number": row["flat_number"],
+        "owner_name": row["owner_name"],
+        "owner_email": row["owner_email"],
+        "period": datetime(row["year"], row["month"], 1).strftime("%B %Y"),
+        "invoice_number": row["invoice_number"] or "",
+        "receipt_number": row["receipt_number"] or "",
+        "due_date": _date(row["due_date"]),
+        "paid_date": _date(row["paid_date"]),
+        "base_amount": _money(row["base_amount"]),
+        "interest": _money(row["interest"]),
+        "total_amount": _money(row["total_amount"]),
+        "amount_paid": _money(row["amount_paid"]),
+        "balance": _money((row["total_amount"] or 0) - (row["amount_paid"] or 0)),
+        "payment_status": row["payment_status"].capitalize(),
+    }
+    return {key: html.escape(str(value)) for key, value in values.items()}
+
+def document_path(kind: str, row: dict):
+    month_dir = os.path.join(KINDS[kind]["dir"], str(row["society_id"]), f"{row['year']}-{row['month']:02d}")
+    return os.path.join(month_dir, f"{row[KINDS[kind]['number']]}.html")
+
+def _write_atomic(path: str, content: bytes):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+def _render_chunk(kind: str, rows: list, known_hashes: dict):
+    """Render rows, writing only documents whose content changed; runs in pool workers"""
+    template, _ = get_template(kind)
+    hashes = {}
+    written = 0
+    for row in rows:
+        content = template.substitute(_context(row)).encode("utf-8")
+        digest = hashlib.sha256(content).hexdigest()
+        path = document_path(kind, row)
+        name = os.path.basename(path)
+        hashes[name] = digest
+        if known_hashes.get(name) == digest and os.path.exists(path):
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _write_atomic(path, content)
+        written += 1
+    return hashes, written
+
+def _manifest_path(month_dir: str):
+    return os.path.join(month_dir, "manifest.json")
+
+def _load_manifest(month_dir: str):
+    try:
+        with open(_manifest_path(month_dir)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_manifest(month_dir: str, manifest: dict):
+    os.makedirs(month_dir, exist_ok=True)
+    _write_atomic(_manifest_path(month_dir), json.dumps(manifest, sort_keys=True).encode())
+
+def _rows_query(db: Session):
+    return db.query(
+        models.Maintenance.society_id,
+        models.Maintenance.year,
+        models.Maintenance.month,
+        models.Maintenance.base_amount,
+        models.Maintenance.interest,
+        models.Maintenance.total_amount,
+        models.Maintenance.amount_paid,
+        models.Maintenance.payment_status,
+        models.Maintenance.due_date,
+        models.Maintenance.paid_date,
+        models.Maintenance.invoice_number,
+        models.Maintenance.receipt_number,
+        models.Flat.flat_number,
+        models.Flat.owner_name,
+        models.Flat.owner_email,
+        models.Society.name.label("society_name"),
+    ).join(models.Flat, models.Flat.id == models.Maintenance.flat_id).join(
+        models.Society, models.Society.id == models.Maintenance.society_id
+    )
+
+def _as_dict(row):
+    values = dict(row._mapping)
+    values["payment_status"] = values["payment_status"].value
+    return values
+
+def render_month(db: Session, year: int, month: int, kinds=("invoice", "receipt")):
+    """Render all invoices (and receipts of paid records) for a month; returns counts"""
+    rows = [_as_dict(row) for row in _rows_query(db).filter(
+        and_(models.Maintenance.year == year, models.Maintenance.month == month)
+    )]
+    summary = {}
+    for kind in kinds:
+        number_field = KINDS[kind]["number"]
+        kind_rows = [row for row in rows if row[number_field]]
+        summary[kind] = _render_batch(kind, kind_rows)
+    return summary
+
+def _render_batch(kind: str, rows: list):
+    # Group by month directory so each manifest is loaded and saved once
+    by_dir = {}
+    for row in rows:
+        by_dir.setdefault(os.path.dirname(document_path(kind, row)), []).append(row)
+
+    written = 0
+    for month_dir, dir_rows in by_dir.items():
+        manifest = _load_manifest(month_dir)
+        chunks = [dir_rows[i:i + CHUNK_SIZE] for i in range(0, len(dir_rows), CHUNK_SIZE)]
+        if len(dir_rows) < POOL_THRESHOLD or RENDER_WORKERS <= 1:
+            results = [_render_chunk(kind, chunk, manifest) for chunk in chunks]
+        else:
+            with ProcessPoolExecutor(max_workers=RENDER_WORKERS) as pool:
+                results = list(pool.map(_render_chunk, [kind] * len(chunks), chunks, [manifest] * len(chunks)))
+        for hashes, chunk_written in results:
+            manifest.update(hashes)
+            written += chunk_written
+        _save_manifest(month_dir, manifest)
+    return {"documents": len(rows), "written": written, "unchanged": len(rows) - written}
+
+def render_document(db: Session, kind: str, maintenance_id: int) -> Optional[tuple]:
+    """Render one document if needed; returns (path, content hash) or None"""
+    row = _rows_query(db).filter(models.Maintenance.id == maintenance_id).first()
+    if row is None:
+        return None
+    row = _as_dict(row)
+    if not row[KINDS[kind]["number"]]:
+        return None
+    path = document_path(kind, row)
+    month_dir = os.path.dirname(path)
+    manifest = _load_manifest(month_dir)
+    hashes, written = _render_chunk(kind, [row], manifest)
+    if written:
+        manifest.update(hashes)
+        _save_manifest(month_dir, manifest)
+    return path, hashes[os.path.basename(path)]
+
+def render_current_month(db: Session, progress=None):
+    """Scheduled job: keep this month's invoices and receipts up to date"""
+    now = datetime.utcnow()
+    summary = render_month(db, now.year, now.month)
+    written = sum(counts["written"] for counts in summary.values())
+    if progress:
+        progress(written, written)
+    return written
@@ -0,0 +1,194 @@
+"""
+Idempotency-Key support for POST routes
+
+A client that sends `Idempotency-Key: <unique value>` with a POST can retry it safely:
+the first response (below 500) is stored in idempotency_keys for IDEMPOTENCY_TTL_HOURS,
+and a retry with the same key, route and body gets that response back after a single
+indexed lookup, without running the route again. Keys are per authenticated user.
+
+- Same key, different body: 422
+- Same key while the first request is still running: 409. The in-progress marker is
+  a lease of IDEMPOTENCY_LOCK_SECONDS, so a worker that dies mid-request only holds
+  the key that long; keep it above the slowest POST route.
+- First request failed with a 5xx: nothing is stored, so the retry runs normally
+"""
+import asyncio
+import hashlib
+import os
+from datetime import datetime, timedelta
+
+from jose import JWTError
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse, Response
+
+import models
+import database
+from auth import decode_token
+
+IDEMPOTENCY_HEADER = "idempotency-key"
+IDEMPOTENCY_TTL_HOURS = int(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+IDEMPOTENCY_LOCK_SECONDS = int(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "300"))
+MAX_KEY_LENGTH = 255
+# Larger responses are not stored; a retry then runs the route again
+MAX_STORED_BYTES = 256 * 1024
+# Login responses carry credentials and must never be stored
+EXCLUDED_PREFIXES = ("/auth/",)
+
+def _caller(headers: Headers):
+    """Verified user identity from the bearer token, or None"""
+    authorization = headers.get("authorization", "")
+    if not authorization.lower().startswith("bearer "):
+        return None
+    try:
+        claims = decode_token(authorization[7:])
+    except JWTError:
+        return None
+    return f"{claims.get('sid')}:{claims.get('sub')}"
+
+def _digest(*parts):
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+def _lookup(key_hash: str):
+    with database.engine.connect() as connection:
+        return connection.execute(
+            select(models.IdempotencyRecord).where(models.IdempotencyRecord.key_hash == key_hash)
+        ).first()
+
+def _claim(key_hash: str, request_hash: str):
+    """Insert the in-progress marker; False if another request holds the key"""
+    now = datetime.utcnow()
+    try:
+        with database.engine.begin() as connection:
+            # An expired record, or a marker whose lease lapsed, no longer reserves its key
+            connection.execute(delete(models.IdempotencyRecord).where(
+                models.IdempotencyRecord.key_hash == key_hash,
+                models.IdempotencyRecord.expires_at <= now
+            ))
+            connection.execute(insert(models.IdempotencyRecord).values(
+                key_hash=key_hash, request_hash=request_hash, created_at=now,
+                expires_at=now + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)
+            ))
+        return True
+    except IntegrityError:
+        return False
+
+def _store(key_hash: str, status_code: int, content_type: str, body: str):
+    with database.engine.begin() as connection:
+        connection.execute(update(models.IdempotencyRecord).where(
+            models.IdempotencyRecord.key_hash == key_hash
+        ).values(
+            status_code=status_code, content_type=content_type, response_body=body,
+            expires_at=datetime.utcnow() + timedelta(hours=IDEMPOTENCY_TTL_HOURS)
+        ))
+
+def _release(key_hash: str):
+    with database.engine.begin() as connection:
+        connection.execute(delete(models.IdempotencyRecord).where(models.IdempotencyRecord.key_hash == key_hash))
+
+def purge_expired(db, progress=None):
+    """Scheduled job: delete expired idempotency records"""
+    if db.info.get("society_id") is not None:
+        return 0  # Records live in the primary database only
+    deleted = db.query(models.IdempotencyRecord).filter(
+        models.IdempotencyRecord.expires_at <= datetime.utcnow()
+    ).delete(synchronize_session=False)
+    db.commit()
+    if progress:
+        progress(deleted, deleted)
+    return deleted
+
+def _replay(record):
+    return Response(
+        content=record.response_body,
+        status_code=record.status_code,
+        media_type=record.content_type,
+        headers={"Idempotent-Replayed": "true"},
+    )
+
+class IdempotencyMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"].startswith(EXCLUDED_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        key = headers.get(IDEMPOTENCY_HEADER)
+        caller = _caller(headers) if key else None
+        if caller is None:
+            await self.app(scope, receive, send)
+            return
+        if len(key) > MAX_KEY_LENGTH:
+            await JSONResponse({"detail": "Idempotency-Key is too long"}, status_code=400)(scope, receive, send)
+            return
+
+        # Buffer the body so it can be hashed and then handed to the route
+        chunks = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        body = b"".join(chunks)
+
+        key_hash = _digest(caller, scope["method"], scope["path"], key)
+        request_hash = hashlib.sha256(body).hexdigest()
+        record = await asyncio.to_thread(_lookup, key_hash)
+        if record is not None and record.expires_at > datetime.utcnow():
+            if record.request_hash != request_hash:
+                response = JSONResponse(
+                    {"detail": "Idempotency-Key was already used with a different request"}, status_code=422
+                )
+            elif record.status_code is None:
+                response = JSONResponse({"detail": "A request with this Idempotency-Key is in progress"}, status_code=409)
+            else:
+                response = _replay(record)
+            await response(scope, receive, send)
+            return
+        if not await asyncio.to_thread(_claim, key_hash, request_hash):
+            await JSONResponse(
+                {"detail": "A request with this Idempotency-Key is in progress"}, status_code=409
+            )(scope, receive, send)
+            return
+
+        body_sent = False
+
+        async def replay_body():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        response_start = None
+        response_body = []
+        storable = True
+
+        async def capture(message):
+            nonlocal response_start, storable
+            if message["type"] == "http.response.start":
+                response_start = message
+            elif message["type"] == "http.response.body":
+                response_body.append(message.get("body", b""))
+                storable = storable and sum(map(len, response_body)) <= MAX_STORED_BYTES
+            await send(message)
+
+        try:
+            await self.app(scope, replay_body, capture)
+        except BaseException:
+            await asyncio.to_thread(_release, key_hash)
+            raise
+        status_code = response_start["status"] if response_start else 500
+        if status_code >= 500 or not storable:
+            await asyncio.to_thread(_release, key_hash)
+            return
+        content_type = Headers(raw=response_start["headers"]).get("content-type", "application/json")
+        try:
+            text = b"".join(response_body).decode("utf-8")
+        except UnicodeDecodeError:
+            await asyncio.to_thread(_release, key_hash)
+            return
+        await asyncio.to_thread(_store, key_hash, status_code, content_type, text)
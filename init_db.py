@@ -5,6 +5,7 @@ Run this to create initial database tables and seed data
 
 from database import engine, SessionLocal
 import models
+import crud
 from auth import get_password_hash
 
 def init_db():
@@ -16,6 +17,8 @@ def init_db():
     # Create initial admin user
     db = SessionLocal()
     try:
+        crud.ensure_default_society(db)
+        
         # Check if admin already exists
         admin = db.query(models.User).filter(models.User.username == "admin").first()
         if not admin:
@@ -0,0 +1,320 @@
+"""
+Scheduled background jobs
+
+Jobs run off the request path on cron-like schedules. Every worker runs the scheduler,
+but a job only runs where it wins a PostgreSQL advisory lock and its cron slot has no
+run recorded yet, so each scheduled run happens exactly once across the fleet. Runs and
+their progress are recorded in the job_runs table.
+
+The scheduler starts in the API's lifespan unless ENABLE_SCHEDULER=false. To run it as a
+sidecar instead, disable it on the API workers and start `python jobs.py`.
+"""
+import asyncio
+import os
+import time
+import traceback
+import zlib
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional
+
+from sqlalchemy import and_, insert, select, text
+
+import models
+import crud
+import database
+import documents
+import idempotency
+import notifications
+import ratelimit
+from database import SessionLocal, get_session
+
+ENABLE_SCHEDULER = os.getenv("ENABLE_SCHEDULER", "true").lower() == "true"
+# Progress is written to job_runs at most this often
+PROGRESS_INTERVAL_SECONDS = 1.0
+
+class CronSchedule:
+    """Five-field cron expression: minute hour day-of-month month day-of-week (0 = Sunday)"""
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression needs 5 fields: {expression!r}")
+        self.expression = expression
+        self.minutes = self._parse(fields[0], 0, 59)
+        self.hours = self._parse(fields[1], 0, 23)
+        self.days = self._parse(fields[2], 1, 31)
+        self.months = self._parse(fields[3], 1, 12)
+        self.weekdays = {day % 7 for day in self._parse(fields[4], 0, 7)}
+        self.days_restricted = fields[2] != "*"
+        self.weekdays_restricted = fields[4] != "*"
+
+    @staticmethod
+    def _parse(field: str, low: int, high: int):
+        values = set()
+        for part in field.split(","):
+            step = 1
+            if "/" in part:
+                part, step = part.split("/")
+                step = int(step)
+            if part == "*":
+                start, end = low, high
+            elif "-" in part:
+                start, end = (int(value) for value in part.split("-"))
+            else:
+                start = end = int(part)
+            if start < low or end > high:
+                raise ValueError(f"Cron field {field!r} out of range {low}-{high}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def matches(self, moment: datetime):
+        if moment.minute not in self.minutes or moment.hour not in self.hours or moment.month not in self.months:
+            return False
+        day_match = moment.day in self.days
+        weekday_match = moment.isoweekday() % 7 in self.weekdays
+        # Like cron: when both day fields are restricted, either one may match
+        if self.days_restricted and self.weekdays_restricted:
+            return day_match or weekday_match
+        return day_match and weekday_match
+
+class Job:
+    def __init__(self, name: str, schedule: str, func: Callable, description: str = ""):
+        self.name = name
+        self.schedule = CronSchedule(schedule)
+        self.func = func
+        self.description = description
+
+JOBS: Dict[str, Job] = {}
+
+def register_job(name: str, schedule: str, func: Callable, description: str = ""):
+    """Register func(db, progress) to run on a cron schedule"""
+    JOBS[name] = Job(name, schedule, func, description)
+
+register_job(
+    "apply_interest", os.getenv("INTEREST_JOB_SCHEDULE", "30 2 * * *"),
+    crud.apply_interest_to_overdue, "Apply 10% interest to overdue maintenance"
+)
+register_job(
+    "render_documents", os.getenv("RENDER_JOB_SCHEDULE", "15 3 * * *"),
+    documents.render_current_month, "Render this month's invoices and receipts"
+)
+register_job(
+    "rollup_balances", os.getenv("ROLLUP_JOB_SCHEDULE", "0 3 * * *"),
+    crud.rollup_maintenance_balances, "Recompute monthly billing totals per society"
+)
+register_job(
+    "purge_idempotency_keys", os.getenv("IDEMPOTENCY_PURGE_SCHEDULE", "20 * * * *"),
+    idempotency.purge_expired, "Delete expired Idempotency-Key responses"
+)
+register_job(
+    "purge_rate_limits", os.getenv("RATE_LIMIT_PURGE_SCHEDULE", "40 * * * *"),
+    ratelimit.purge_buckets, "Delete refilled shared rate limit buckets"
+)
+register_job(
+    "queue_reminders", os.getenv("REMINDER_JOB_SCHEDULE", "0 9 * * *"),
+    notifications.queue_dues_reminders, "Queue reminders for due and overdue maintenance"
+)
+register_job(
+    "send_notifications", os.getenv("NOTIFICATION_JOB_SCHEDULE", "*/5 * * * *"),
+    notifications.send_pending_notifications, "Send pending notifications from the outbox"
+)
+
+class _Progress:
+    """Throttled progress reporter writing to the run's job_runs row"""
+
+    def __init__(self, run_id: int, offset: int = 0):
+        self.run_id = run_id
+        self.offset = offset
+        self.reported_at = 0.0
+
+    def __call__(self, processed: int, total: Optional[int] = None):
+        now = time.monotonic()
+        if now - self.reported_at < PROGRESS_INTERVAL_SECONDS and processed != total:
+            return
+        self.reported_at = now
+        _update_run(self.run_id, processed=self.offset + processed, total=total)
+
+def _update_run(run_id: int, **values):
+    db = SessionLocal()
+    try:
+        db.query(models.JobRun).filter(models.JobRun.id == run_id).update(values)
+        db.commit()
+    finally:
+        db.close()
+
+def _lock_key(job_name: str, scope):
+    # Advisory locks take a 64-bit key; crc32 keeps it in range
+    return zlib.crc32(f"{job_name}:{scope}".encode())
+
+# Session-level advisory locks outlive transactions, so commit right away rather than
+# leaving the lock connection idle in a transaction while the job runs
+def _try_lock(connection, key: int):
+    if connection.dialect.name != "postgresql":
+        return True  # SQLite: slots are claimed under its single write lock instead
+    locked = connection.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": key}).scalar()
+    connection.commit()
+    return locked
+
+def _lock(connection, key: int):
+    """Like _try_lock, but waits for the holder to release the key"""
+    if connection.dialect.name == "postgresql":
+        connection.execute(text("SELECT pg_advisory_lock(:key)"), {"key": key})
+        connection.commit()
+
+def _unlock(connection, key: int):
+    if connection.dialect.name == "postgresql":
+        connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": key})
+        connection.commit()
+
+def _targets(society_id: Optional[int]):
+    """Sessions a run covers: one society, or the primary plus every routed society"""
+    if society_id is not None:
+        return [society_id]
+    return [None] + sorted(set(database.SOCIETY_DATABASES) | set(database.SOCIETY_SCHEMAS))
+
+def _target_lock_key(job_name: str, target: Optional[int]):
+    """Key for the rows a target covers: a routed society's own database or schema, else
+    the primary, which the all-societies run covers for every society it holds"""
+    return _lock_key(job_name, f"target:{target if database.is_routed(target) else 'primary'}")
+
+def create_run(job_name: str, society_id: Optional[int] = None, scheduled_for: Optional[datetime] = None):
+    if job_name not in JOBS:
+        raise KeyError(job_name)
+    db = SessionLocal()
+    try:
+        run = models.JobRun(job_name=job_name, society_id=society_id, scheduled_for=scheduled_for)
+        db.add(run)
+        db.commit()
+        db.refresh(run)
+        return run
+    finally:
+        db.close()
+
+def execute_run(run_id: int):
+    """Run a queued job under its advisory lock; blocking, call from a worker thread"""
+    db = SessionLocal()
+    try:
+        run = db.query(models.JobRun).filter(models.JobRun.id == run_id).first()
+        job_name, society_id = run.job_name, run.society_id
+    finally:
+        db.close()
+
+    job = JOBS[job_name]
+    key = _lock_key(job_name, society_id)
+    with database.engine.connect() as lock_connection:
+        if not _try_lock(lock_connection, key):
+            _update_run(run_id, status=models.JobStatus.FAILED, finished_at=datetime.utcnow(),
+                        error="Another worker is already running this job")
+            return
+        try:
+            _update_run(run_id, status=models.JobStatus.RUNNING, started_at=datetime.utcnow())
+            processed = 0
+            for target in _targets(society_id):
+                # One-society and all-societies runs overlap on a target; the later one
+                # waits here so a job never works on the same rows twice at once
+                target_key = _target_lock_key(job_name, target)
+                target_db = get_session(target) if target is not None else SessionLocal()
+                try:
+                    _lock(lock_connection, target_key)
+                    processed += job.func(target_db, progress=_Progress(run_id, offset=processed)) or 0
+                finally:
+                    target_db.close()
+                    _unlock(lock_connection, target_key)
+            _update_run(run_id, status=models.JobStatus.SUCCEEDED, processed=processed,
+                        finished_at=datetime.utcnow(), message=f"Processed {processed} records")
+        except Exception as e:
+            traceback.print_exc()
+            _update_run(run_id, status=models.JobStatus.FAILED, finished_at=datetime.utcnow(), error=str(e))
+        finally:
+            _unlock(lock_connection, key)
+
+# asyncio tasks for runs in flight in this process
+_running = set()
+
+def start_run(run_id: int):
+    """Execute a run in a worker thread without blocking the event loop"""
+    task = asyncio.get_running_loop().create_task(asyncio.to_thread(execute_run, run_id))
+    _running.add(task)
+    task.add_done_callback(_running.discard)
+    return task
+
+async def wait_for_runs(timeout: float):
+    """Wait up to timeout seconds for this process's runs; returns how many are still going"""
+    if _running:
+        await asyncio.wait(set(_running), timeout=timeout)
+    return len(_running)
+
+def trigger(job_name: str, society_id: Optional[int] = None):
+    """Queue a manual run and start it in the background"""
+    run = create_run(job_name, society_id=society_id)
+    start_run(run.id)
+    return run
+
+def _claim_slot(job_name: str, slot: datetime):
+    """Record a run for a cron slot unless another worker already has"""
+    key = _lock_key(job_name, f"slot:{slot.isoformat()}")
+    with database.engine.connect() as connection:
+        if not _try_lock(connection, key):
+            return None
+        try:
+            # FOR UPDATE also makes SQLite take its write lock before the check
+            existing = connection.execute(select(models.JobRun.id).where(
+                and_(models.JobRun.job_name == job_name, models.JobRun.scheduled_for == slot)
+            ).with_for_update()).first()
+            if existing:
+                connection.rollback()
+                return None
+            run_id = connection.execute(
+                insert(models.JobRun).values(job_name=job_name, scheduled_for=slot)
+            ).inserted_primary_key[0]
+            # Commit before unlocking so the next worker sees the claimed slot
+            connection.commit()
+            return run_id
+        finally:
+            _unlock(connection, key)
+
+def _claim_due_jobs(slot: datetime):
+    """Claim the slot for every job due at it; returns [(job name, run id)] this worker won.
+    Blocking, so it runs in a worker thread; the runs are started back on the event loop."""
+    claimed = []
+    for job in JOBS.values():
+        if job.schedule.matches(slot):
+            try:
+                run_id = _claim_slot(job.name, slot)
+            except Exception as e:
+                print(f"❌ Scheduler could not claim {job.name}: {e}")
+                continue
+            if run_id is not None:
+                claimed.append((job.name, run_id))
+    return claimed
+
+async def scheduler_tick(slot: datetime):
+    """Claim and start the runs due at slot; returns their tasks"""
+    tasks = []
+    for job_name, run_id in await asyncio.to_thread(_claim_due_jobs, slot):
+        print(f"⏰ Starting scheduled job {job_name} (run {run_id})")
+        tasks.append(start_run(run_id))
+    return tasks
+
+async def run_scheduler():
+    """Check schedules once per minute (server local time) until cancelled"""
+    while True:
+        now = datetime.now()
+        slot = now.replace(second=0, microsecond=0)
+        try:
+            await scheduler_tick(slot)
+        except Exception as e:
+            print(f"❌ Scheduler error: {e}")
+        next_minute = slot + timedelta(minutes=1)
+        await asyncio.sleep(max(0.0, (next_minute - datetime.now()).total_seconds()))
+
+def start_scheduler():
+    return asyncio.get_running_loop().create_task(run_scheduler())
+
+async def _run_sidecar():
+    models.Base.metadata.create_all(bind=database.engine)
+    print(f"🗓️  Scheduler running jobs: {', '.join(JOBS)}")
+    await run_scheduler()
+
+if __name__ == "__main__":
+    asyncio.run(_run_sidecar())
@@ -0,0 +1,117 @@
+"""
+Worker warm-up on startup and graceful drain on shutdown
+
+Startup, before the worker accepts connections: every connection pool opens
+DB_POOL_WARM_CONNECTIONS connections and the per-request lookups run once, so their SQL
+is compiled and cached before the first real request instead of during it.
+
+Shutdown, on SIGTERM (a rolling deploy, gunicorn stopping a worker):
+1. The worker starts draining: GET /health answers 503 so the load balancer stops
+   routing to it, responses carry Connection: close so clients reconnect elsewhere, and
+   no new job runs are started. For SHUTDOWN_DELAY_SECONDS it keeps serving normally
+   while the load balancer notices (Kubernetes: instead of a preStop sleep).
+2. The server stops accepting connections and finishes the requests it has.
+3. Requests and job runs still in flight get until SHUTDOWN_DRAIN_SECONDS after step 2
+   began; queued audit entries are written and every connection pool is closed.
+Keep SHUTDOWN_DELAY_SECONDS + SHUTDOWN_DRAIN_SECONDS below gunicorn's --graceful-timeout.
+"""
+import asyncio
+import os
+import signal
+import threading
+import time
+
+from starlette.datastructures import MutableHeaders
+
+import crud
+import auth
+import audit
+import jobs
+import database
+
+SHUTDOWN_DELAY_SECONDS = float(os.getenv("SHUTDOWN_DELAY_SECONDS", "0"))
+SHUTDOWN_DRAIN_SECONDS = float(os.getenv("SHUTDOWN_DRAIN_SECONDS", "20"))
+
+_state = {"draining": False, "in_flight": 0}
+
+def is_draining():
+    return _state["draining"]
+
+def warm_up():
+    """Fill the connection pools and compile the hot lookups. Blocking."""
+    started = time.perf_counter()
+    engines = database.pooled_engines()
+    for target in engines:
+        database.warm_pool(target)
+    db = database.get_session(database.DEFAULT_SOCIETY_ID)
+    try:
+        db.execute(auth.USER_BY_USERNAME, {"username": ""}).first()
+        crud.get_user_by_username(db, "")
+        crud.get_flat(db, 0)
+        crud.get_maintenance(db, 0)
+        crud.get_maintenance_by_flat(db, 0)
+    finally:
+        db.close()
+    print(f"🔥 Warmed {len(engines)} connection pool(s) with {database.DB_POOL_WARM_CONNECTIONS} connections each "
+          f"in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+def install_signal_handler():
+    """Start draining on SIGTERM, then hand the signal to the server after SHUTDOWN_DELAY_SECONDS
+
+    Called from the lifespan hook, after the server has installed its own handler.
+    """
+    # Signal handlers can only be set from the main thread (not under TestClient)
+    if threading.current_thread() is not threading.main_thread():
+        return
+    loop = asyncio.get_running_loop()
+    server_handler = signal.getsignal(signal.SIGTERM)
+    if not callable(server_handler):
+        return
+
+    def handle_sigterm(signum, frame):
+        if _state["draining"]:
+            server_handler(signum, frame)
+            return
+        _state["draining"] = True
+        print(f"🚦 SIGTERM: draining, shutting down in {SHUTDOWN_DELAY_SECONDS:g}s")
+        loop.call_soon_threadsafe(loop.call_later, SHUTDOWN_DELAY_SECONDS, server_handler, signum, frame)
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
+async def shutdown(scheduler=None, audit_flusher=None):
+    """Drain requests and job runs within SHUTDOWN_DRAIN_SECONDS, flush the audit queue, close the pools"""
+    _state["draining"] = True
+    deadline = time.monotonic() + SHUTDOWN_DRAIN_SECONDS
+    if scheduler:
+        scheduler.cancel()
+    while _state["in_flight"] and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    unfinished_runs = await jobs.wait_for_runs(max(0.0, deadline - time.monotonic()))
+    if _state["in_flight"] or unfinished_runs:
+        print(f"⚠️  Drain deadline passed with {_state['in_flight']} requests and {unfinished_runs} job runs unfinished")
+    # After the job runs, so entries they queued are written too
+    if audit_flusher:
+        await audit.stop_flusher(audit_flusher)
+    await asyncio.to_thread(database.dispose_engines)
+
+class DrainMiddleware:
+    """Counts requests in flight and asks clients to reconnect elsewhere while draining"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and _state["draining"]:
+                MutableHeaders(scope=message)["Connection"] = "close"
+            await send(message)
+
+        _state["in_flight"] += 1
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _state["in_flight"] -= 1
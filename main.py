@@ -1,16 +1,32 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Request, Response, status
+from fastapi.responses import FileResponse, ORJSONResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
-from datetime import timedelta
-from typing import List
+from datetime import date, datetime, timedelta
+from typing import List, Optional
 from contextlib import asynccontextmanager
+import asyncio
+import os
 
 import models
 import schemas
 import crud
 import auth
-from database import engine, get_db, SessionLocal
+import archive
+import audit
+import documents
+import jobs
+import lifecycle
+import search
+import serializers
+import simulation
+import storage
+from compression import CompressionMiddleware, etag_matches
+from idempotency import IdempotencyMiddleware
+from lifecycle import DrainMiddleware
+from ratelimit import RateLimitMiddleware
+from database import engine, get_db, get_read_db, get_session, is_routed, SessionLocal, DEFAULT_SOCIETY_ID
 
 # Startup function to create admin
 def create_admin_on_startup():
@@ -25,6 +41,7 @@ def create_admin_on_startup():
     # Create admin user
     db = SessionLocal()
     try:
+        crud.ensure_default_society(db)
         admin = db.query(models.User).filter(models.User.username == "admin").first()
         
         if not admin:
@@ -68,9 +85,14 @@ def create_admin_on_startup():
 async def lifespan(app: FastAPI):
     # Startup
     create_admin_on_startup()
+    await asyncio.to_thread(lifecycle.warm_up)
+    scheduler = jobs.start_scheduler() if jobs.ENABLE_SCHEDULER else None
+    audit_flusher = audit.start_flusher()
+    lifecycle.install_signal_handler()
     yield
-    # Shutdown (cleanup if needed)
+    # Shutdown: drain in-flight work, then release connections
     print("👋 Shutting down...")
+    await lifecycle.shutdown(scheduler, audit_flusher)
 
 app = FastAPI(
     title="Society Management API",
@@ -79,6 +101,15 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# Replay stored responses for retried POSTs carrying an Idempotency-Key
+app.add_middleware(IdempotencyMiddleware)
+
+# Compress JSON and HTML responses for slow clients
+app.add_middleware(CompressionMiddleware)
+
+# Throttle logins and expensive routes before any work is done
+app.add_middleware(RateLimitMiddleware)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -88,6 +119,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Outermost, so every request counts towards the shutdown drain
+app.add_middleware(DrainMiddleware)
+
 # Authentication Routes
 @app.post("/auth/login", response_model=schemas.Token, tags=["Authentication"])
 async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
@@ -101,15 +135,78 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session =
         )
     access_token_expires = timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = auth.create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data={"sub": user.username, "sid": user.society_id}, expires_delta=access_token_expires
+    )
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": auth.create_refresh_token(user)}
+
+@app.post("/auth/refresh", response_model=schemas.Token, tags=["Authentication"])
+async def refresh_access_token(request: schemas.RefreshRequest, db: Session = Depends(get_db)):
+    """Exchange a refresh token for a new access token without re-entering the password"""
+    user = auth.verify_refresh_token(request.refresh_token, db)
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired refresh token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    access_token = auth.create_access_token(
+        data={"sub": user.username, "sid": user.society_id},
+        expires_delta=timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
     )
-    return {"access_token": access_token, "token_type": "bearer"}
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": auth.create_refresh_token(user)}
 
 @app.get("/auth/me", response_model=schemas.UserResponse, tags=["Authentication"])
 async def read_users_me(current_user: models.User = Depends(auth.get_current_active_user)):
     """Get current user details"""
     return current_user
 
+# Society Routes
+def check_platform_admin(current_user: models.User = Depends(auth.check_role([models.UserRole.ADMIN]))):
+    """Admins of the default society manage the other societies"""
+    if current_user.society_id != DEFAULT_SOCIETY_ID:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+    return current_user
+
+@app.post("/societies/", response_model=schemas.SocietyResponse, tags=["Societies"], status_code=status.HTTP_201_CREATED)
+async def create_society(
+    society: schemas.SocietyCreate,
+    current_user: models.User = Depends(check_platform_admin)
+):
+    """Create a society together with its first admin user (platform admin only)"""
+    db = SessionLocal()
+    try:
+        if crud.get_society_by_code(db, code=society.code):
+            raise HTTPException(status_code=400, detail="Society code already exists")
+        if crud.get_user_by_username(db, username=society.admin.username):
+            raise HTTPException(status_code=400, detail="Username already registered")
+        db_society = crud.create_society(db=db, society=society)
+    finally:
+        db.close()
+
+    # The admin user lives wherever the society's data is routed
+    society_db = get_session(db_society.id)
+    try:
+        if is_routed(db_society.id):
+            models.Base.metadata.create_all(bind=society_db.get_bind())
+            crud.ensure_society(society_db, db_society.id, db_society.name, db_society.code)
+        crud.create_user(db=society_db, user=society.admin, society_id=db_society.id)
+    finally:
+        society_db.close()
+    return db_society
+
+@app.get("/societies/", response_model=List[schemas.SocietyResponse], tags=["Societies"])
+async def read_societies(
+    skip: int = 0,
+    limit: int = 100,
+    current_user: models.User = Depends(check_platform_admin)
+):
+    """Get all societies (platform admin only)"""
+    db = SessionLocal()
+    try:
+        return crud.get_societies(db, skip=skip, limit=limit)
+    finally:
+        db.close()
+
 # User Routes
 @app.post("/users/", response_model=schemas.UserResponse, tags=["Users"], status_code=status.HTTP_201_CREATED)
 async def create_user(
@@ -118,19 +215,16 @@ async def create_user(
     current_user: models.User = Depends(auth.check_role([models.UserRole.ADMIN]))
 ):
     """Create a new user (Admin only)"""
-    db_user = crud.get_user_by_username(db, username=user.username)
-    if db_user:
-        raise HTTPException(status_code=400, detail="Username already registered")
-    db_user = crud.get_user_by_email(db, email=user.email)
-    if db_user:
-        raise HTTPException(status_code=400, detail="Email already registered")
-    return crud.create_user(db=db, user=user)
+    try:
+        return crud.create_user(db=db, user=user)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @app.get("/users/", response_model=List[schemas.UserResponse], tags=["Users"])
 async def read_users(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_user: models.User = Depends(auth.check_role([models.UserRole.ADMIN, models.UserRole.OPERATIONS]))
 ):
     """Get all users"""
@@ -157,7 +251,10 @@ async def update_user(
     current_user: models.User = Depends(auth.check_role([models.UserRole.ADMIN]))
 ):
     """Update user (Admin only)"""
-    db_user = crud.update_user(db, user_id=user_id, user=user)
+    try:
+        db_user = crud.update_user(db, user_id=user_id, user=user)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return db_user
@@ -169,7 +266,10 @@ async def delete_user(
     current_user: models.User = Depends(auth.check_role([models.UserRole.ADMIN]))
 ):
     """Delete user (Admin only)"""
-    db_user = crud.delete_user(db, user_id=user_id)
+    try:
+        db_user = crud.delete_user(db, user_id=user_id)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return {"message": "User deleted successfully"}
@@ -182,32 +282,42 @@ async def create_flat(
     current_user: models.User = Depends(auth.check_role([models.UserRole.ADMIN, models.UserRole.OPERATIONS]))
 ):
     """Create a new flat"""
-    db_flat = crud.get_flat_by_number(db, flat_number=flat.flat_number)
-    if db_flat:
-        raise HTTPException(status_code=400, detail="Flat number already exists")
-    return crud.create_flat(db=db, flat=flat)
+    if crud.get_user(db, user_id=flat.owner_id) is None:
+        raise HTTPException(status_code=404, detail="Owner not found")
+    try:
+        return crud.create_flat(db=db, flat=flat)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @app.get("/flats/", response_model=List[schemas.FlatResponse], tags=["Flats"])
 async def read_flats(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    fields: Optional[str] = None,
+    db: Session = Depends(get_read_db),
     current_user: models.User = Depends(auth.get_current_active_user)
 ):
-    """Get all flats"""
+    """Get all flats; fields=a,b,... returns only those fields"""
+    if fields or serializers.FAST_SERIALIZATION:
+        rows = crud.get_flats(db, skip=skip, limit=limit, columns=serializers.columns(models.Flat, schemas.FlatResponse, fields))
+        return serializers.json_response(rows, schemas.FlatResponse, fields)
     flats = crud.get_flats(db, skip=skip, limit=limit)
     return flats
 
 @app.get("/flats/{flat_id}", response_model=schemas.FlatResponse, tags=["Flats"])
 async def read_flat(
     flat_id: int,
-    db: Session = Depends(get_db),
+    fields: Optional[str] = None,
+    db: Session = Depends(get_read_db),
     current_user: models.User = Depends(auth.get_current_active_user)
 ):
-    """Get flat by ID"""
-    db_flat = crud.get_flat(db, flat_id=flat_id)
+    """Get flat by ID; fields=a,b,... returns only those fields"""
+    columns = serializers.columns(models.Flat, schemas.FlatResponse, fields) if fields else None
+    db_flat = crud.get_flat(db, flat_id=flat_id, columns=columns)
     if db_flat is None:
         raise HTTPException(status_code=404, detail="Flat not found")
+    if fields:
+        return serializers.json_object(db_flat, schemas.FlatResponse, fields)
     return db_flat
 
 @app.put("/flats/{flat_id}", response_model=schemas.FlatResponse, tags=["Flats"])
@@ -230,7 +340,10 @@ async def delete_flat(
     current_user: models.User = Depends(auth.check_role([models.UserRole.ADMIN]))
 ):
     """Delete flat (Admin only)"""
-    db_flat = crud.delete_flat(db, flat_id=flat_id)
+    try:
+        db_flat = crud.delete_flat(db, flat_id=flat_id)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     if db_flat is None:
         raise HTTPException(status_code=404, detail="Flat not found")
     return {"message": "Flat deleted successfully"}
@@ -243,17 +356,62 @@ async def create_tenant_history(
     current_user: models.User = Depends(auth.check_role([models.UserRole.ADMIN, models.UserRole.OPERATIONS]))
 ):
     """Create tenant history record"""
+    if crud.get_flat(db, flat_id=tenant.flat_id) is None:
+        raise HTTPException(status_code=404, detail="Flat not found")
     return crud.create_tenant_history(db=db, tenant=tenant)
 
 @app.get("/tenants/flat/{flat_id}", response_model=List[schemas.TenantHistoryResponse], tags=["Tenants"])
 async def read_tenant_histories(
     flat_id: int,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_user: models.User = Depends(auth.get_current_active_user)
 ):
     """Get all tenant histories for a flat"""
     return crud.get_tenant_histories_by_flat(db, flat_id=flat_id)
 
+@app.get("/tenants/current", response_model=List[schemas.CurrentOccupantResponse], tags=["Tenants"])
+async def read_current_occupants(
+    skip: int = 0,
+    limit: int = 100,
+    db: Session = Depends(get_read_db),
+    current_user: models.User = Depends(auth.get_current_active_user)
+):
+    """Get every flat with its current tenant, if any"""
+    return [
+        {"flat_id": flat.id, "flat_number": flat.flat_number, "flat_type": flat.flat_type,
+         "owner_name": flat.owner_name, "tenant": tenant}
+        for flat, tenant in crud.get_current_occupants(db, skip=skip, limit=limit)
+    ]
+
+@app.get("/tenants/expiring", response_model=List[schemas.TenantHistoryResponse], tags=["Tenants"])
+async def read_expiring_tenancies(
+    days: int = 30,
+    db: Session = Depends(get_read_db),
+    current_user: models.User = Depends(auth.check_role([models.UserRole.ADMIN, models.UserRole.OPERATIONS]))
+):
+    """Get current tenancies whose agreement ends within days, soonest first"""
+    return crud.get_expiring_tenancies(db, days=days)
+
+@app.get("/tenants/occupancy", response_model=List[schemas.TenantHistoryResponse], tags=["Tenants"])
+async def read_occupancy(
+    on: Optional[date] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    flat_id: Optional[int] = None,
+    db: Session = Depends(get_read_db),
+    current_user: models.User = Depends(auth.check_role([models.UserRole.ADMIN, models.UserRole.OPERATIONS]))
+):
+    """Get tenancies in effect on a date, or at any time between start and end (inclusive)"""
+    if on is not None:
+        start = end = on
+    if start is None or end is None:
+        raise HTTPException(status_code=400, detail="Pass on, or both start and end")
+    if end < start:
+        raise HTTPException(status_code=400, detail="end must not be before start")
+    period_start = datetime.combine(start, datetime.min.time())
+    period_end = datetime.combine(end, datetime.min.time()) + timedelta(days=1)
+    return crud.get_occupancy(db, period_start, period_end, flat_id=flat_id)
+
 @app.get("/tenants/{tenant_id}", response_model=schemas.TenantHistoryResponse, tags=["Tenants"])
 async def read_tenant_history(
     tenant_id: int,
@@ -291,6 +449,91 @@ async def delete_tenant_history(
         raise HTTPException(status_code=404, detail="Tenant history not found")
     return {"message": "Tenant history deleted successfully"}
 
+# Document Storage
+async def _store_upload(request: Request):
+    try:
+        digest, size, created = await storage.save_stream(request.stream())
+    except storage.UploadTooLarge as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    if size == 0:
+        raise HTTPException(status_code=400, detail="Empty upload")
+    return digest, size, created
+
+def _stored_file_response(request: Request, reference: str, name: str):
+    digest = storage.from_reference(reference)
+    if digest is None or not os.path.exists(storage.object_path(digest)):
+        raise HTTPException(status_code=404, detail="Document not found")
+    etag = f'"{digest}"'
+    if etag_matches(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"etag": etag})
+    media_type = storage.media_type(digest)
+    if storage.STORAGE_ACCEL_REDIRECT:
+        # nginx serves the file itself (sendfile, ranges) from the internal location
+        return Response(headers={
+            "X-Accel-Redirect": storage.STORAGE_ACCEL_REDIRECT + storage.object_relpath(digest),
+            "Content-Type": media_type,
+            "etag": etag,
+        })
+    return FileResponse(storage.object_path(digest), media_type=media_type, filename=name, headers={"etag": etag})
+
+@app.put("/tenants/{tenant_id}/agreement", response_model=schemas.StoredDocumentResponse, tags=["Tenants"])
+async def upload_tenant_agreement(
+    tenant_id: int,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.check_role([models.UserRole.ADMIN, models.UserRole.OPERATIONS]))
+):
+    """Upload the agreement document as the raw request body"""
+    db_tenant = crud.get_tenant_history(db, tenant_id=tenant_id)
+    if db_tenant is None:
+        raise HTTPException(status_code=404, detail="Tenant history not found")
+    digest, size, created = await _store_upload(request)
+    db_tenant.agreement_document = storage.to_reference(digest)
+    db.commit()
+    return {"reference": db_tenant.agreement_document, "size": size, "deduplicated": not created}
+
+@app.get("/tenants/{tenant_id}/agreement", tags=["Tenants"])
+async def download_tenant_agreement(
+    tenant_id: int,
+    request: Request,
+    db: Session = Depends(get_read_db),
+    current_user: models.User = Depends(auth.get_current_active_user)
+):
+    """Download the agreement document"""
+    db_tenant = crud.get_tenant_history(db, tenant_id=tenant_id)
+    if db_tenant is None:
+        raise HTTPException(status_code=404, detail="Tenant history not found")
+    return _stored_file_response(request, db_tenant.agreement_document, f"agreement-{tenant_id}")
+
+@app.put("/residents/{resident_id}/id-proof", response_model=schemas.StoredDocumentResponse, tags=["Residents"])
+async def upload_resident_id_proof(
+    resident_id: int,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.check_role([models.UserRole.ADMIN, models.UserRole.OPERATIONS, models.UserRole.FLAT_OWNER]))
+):
+    """Upload the resident's ID proof as the raw request body"""
+    db_resident = crud.get_flat_resident(db, resident_id=resident_id)
+    if db_resident is None:
+        raise HTTPException(status_code=404, detail="Resident not found")
+    digest, size, created = await _store_upload(request)
+    db_resident.id_proof = storage.to_reference(digest)
+    db.commit()
+    return {"reference": db_resident.id_proof, "size": size, "deduplicated": not created}
+
+@app.get("/residents/{resident_id}/id-proof", tags=["Residents"])
+async def download_resident_id_proof(
+    resident_id: int,
+    request: Request,
+    db: Session = Depends(get_read_db),
+    current_user: models.User = Depends(auth.get_current_active_user)
+):
+    """Download the resident's ID proof"""
+    db_resident = crud.get_flat_resident(db, resident_id=resident_id)
+    if db_resident is None:
+        raise HTTPException(status_code=404, detail="Resident not found")
+    return _stored_file_response(request, db_resident.id_proof, f"id-proof-{resident_id}")
+
 # Flat Residents Routes
 @app.post("/residents/", response_model=schemas.FlatResidentResponse, tags=["Residents"], status_code=status.HTTP_201_CREATED)
 async def create_flat_resident(
@@ -299,12 +542,14 @@ async def create_flat_resident(
     current_user: models.User = Depends(auth.check_role([models.UserRole.ADMIN, models.UserRole.OPERATIONS, models.UserRole.FLAT_OWNER]))
 ):
     """Create flat resident"""
+    if crud.get_flat(db, flat_id=resident.flat_id) is None:
+        raise HTTPException(status_code=404, detail="Flat not found")
     return crud.create_flat_resident(db=db, resident=resident)
 
 @app.get("/residents/flat/{flat_id}", response_model=List[schemas.FlatResidentResponse], tags=["Residents"])
 async def read_flat_residents(
     flat_id: int,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_user: models.User = Depends(auth.get_current_active_user)
 ):
     """Get all residents for a flat"""
@@ -355,31 +600,189 @@ async def create_maintenance(
     current_user: models.User = Depends(auth.check_role([models.UserRole.ADMIN, models.UserRole.ACCOUNTS]))
 ):
     """Create maintenance record"""
-    return crud.create_maintenance(db=db, maintenance=maintenance)
+    if crud.get_flat(db, flat_id=maintenance.flat_id) is None:
+        raise HTTPException(status_code=404, detail="Flat not found")
+    if archive.is_archived(current_user.society_id, maintenance.year):
+        raise HTTPException(status_code=400, detail=f"Maintenance for {maintenance.year} is archived")
+    try:
+        return crud.create_maintenance(db=db, maintenance=maintenance)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @app.get("/maintenance/flat/{flat_id}", response_model=List[schemas.MaintenanceResponse], tags=["Maintenance"])
 async def read_maintenance_by_flat(
     flat_id: int,
     skip: int = 0,
     limit: int = 100,
+    include_archived: bool = False,
+    fields: Optional[str] = None,
+    db: Session = Depends(get_read_db),
+    current_user: models.User = Depends(auth.get_current_active_user)
+):
+    """Get maintenance records for a flat, optionally continuing into archived years"""
+    if fields or serializers.FAST_SERIALIZATION:
+        rows = crud.get_maintenance_by_flat(
+            db, flat_id=flat_id, skip=skip, limit=limit, include_archived=include_archived,
+            columns=serializers.columns(models.Maintenance, schemas.MaintenanceResponse, fields)
+        )
+        return serializers.json_response(rows, schemas.MaintenanceResponse, fields)
+    return crud.get_maintenance_by_flat(db, flat_id=flat_id, skip=skip, limit=limit, include_archived=include_archived)
+
+@app.get("/maintenance/month/{year}/{month}", response_model=List[schemas.MaintenanceResponse], tags=["Maintenance"])
+async def read_maintenance_by_month(
+    year: int,
+    month: int,
+    fields: Optional[str] = None,
+    db: Session = Depends(get_read_db),
+    current_user: models.User = Depends(auth.check_role([models.UserRole.ADMIN, models.UserRole.ACCOUNTS]))
+):
+    """Get maintenance records of all flats for a month, including archived years"""
+    if fields or serializers.FAST_SERIALIZATION:
+        rows = crud.get_maintenance_by_month_year(
+            db, month=month, year=year, columns=serializers.columns(models.Maintenance, schemas.MaintenanceResponse, fields)
+        )
+        return serializers.json_response(rows, schemas.MaintenanceResponse, fields)
+    return crud.get_maintenance_by_month_year(db, month=month, year=year)
+
+@app.get("/maintenance/archive", tags=["Maintenance"])
+async def read_archived_years(
+    current_user: models.User = Depends(auth.check_role([models.UserRole.ADMIN, models.UserRole.ACCOUNTS]))
+):
+    """List years whose maintenance records have been archived"""
+    return {"archived_years": archive.archived_years(current_user.society_id)}
+
+@app.post("/maintenance/archive/{year}", tags=["Maintenance"])
+async def archive_maintenance_year(
+    year: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.check_role([models.UserRole.ADMIN]))
+):
+    """Move a fully settled year of maintenance records to archive storage (Admin only)"""
+    try:
+        count = await asyncio.to_thread(archive.archive_year, db, current_user.society_id, year)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"message": f"Archived {count} maintenance records for {year}"}
+
+@app.get("/maintenance/rollups", response_model=List[schemas.MaintenanceRollupResponse], tags=["Maintenance"])
+async def read_maintenance_rollups(
+    year: Optional[int] = None,
+    db: Session = Depends(get_read_db),
+    current_user: models.User = Depends(auth.check_role([models.UserRole.ADMIN, models.UserRole.ACCOUNTS]))
+):
+    """Get monthly billing totals, as of the last rollup_balances run"""
+    return crud.get_maintenance_rollups(db, year=year)
+
+@app.get("/maintenance/grid", response_model=schemas.MaintenanceGridResponse, tags=["Maintenance"])
+async def read_maintenance_grid(
+    year: Optional[int] = None,
+    month: Optional[int] = None,
+    months: int = 12,
+    after: Optional[str] = None,
+    limit: int = 500,
+    db: Session = Depends(get_read_db),
+    current_user: models.User = Depends(auth.check_role([models.UserRole.ADMIN, models.UserRole.ACCOUNTS]))
+):
+    """Payment status and amounts of every flat for the months ending at year/month (default: this month)"""
+    if (year is None) != (month is None):
+        raise HTTPException(status_code=400, detail="Pass both year and month, or neither")
+    if year is None:
+        year, month = datetime.utcnow().year, datetime.utcnow().month
+    try:
+        grid = crud.get_maintenance_grid(db, year, month, months=months, after=after, limit=limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return ORJSONResponse(grid)
+
+@app.post("/maintenance/simulate", response_model=schemas.SimulationResponse, tags=["Maintenance"])
+async def simulate_maintenance(
+    request: schemas.SimulationRequest,
+    db: Session = Depends(get_read_db),
+    current_user: models.User = Depends(auth.check_role([models.UserRole.ADMIN, models.UserRole.ACCOUNTS]))
+):
+    """Project billing, collections and arrears under what-if rate and interest scenarios"""
+    return await asyncio.to_thread(simulation.run, db, request.scenarios, request.months)
+
+@app.post("/maintenance/documents/render", tags=["Maintenance"])
+async def render_maintenance_documents(
+    year: int,
+    month: int,
     db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.check_role([models.UserRole.ADMIN, models.UserRole.ACCOUNTS]))
+):
+    """Render invoices and receipts for a month; unchanged documents are skipped"""
+    summary = await asyncio.to_thread(documents.render_month, db, year, month)
+    return {"year": year, "month": month, **summary}
+
+def _document_response(request: Request, db: Session, kind: str, maintenance_id: int):
+    rendered = documents.render_document(db, kind, maintenance_id)
+    if rendered is None:
+        raise HTTPException(status_code=404, detail=f"{kind.capitalize()} not found")
+    path, digest = rendered
+    etag = f'"{digest}"'
+    if etag_matches(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"etag": etag})
+    # FileResponse handles Range/If-Range requests
+    return FileResponse(path, media_type="text/html", filename=os.path.basename(path), headers={"etag": etag})
+
+@app.get("/maintenance/{maintenance_id}/invoice", tags=["Maintenance"])
+async def read_maintenance_invoice(
+    maintenance_id: int,
+    request: Request,
+    db: Session = Depends(get_read_db),
     current_user: models.User = Depends(auth.get_current_active_user)
 ):
-    """Get maintenance records for a flat"""
-    return crud.get_maintenance_by_flat(db, flat_id=flat_id, skip=skip, limit=limit)
+    """Download the invoice for a maintenance record"""
+    return _document_response(request, db, "invoice", maintenance_id)
+
+@app.get("/maintenance/{maintenance_id}/receipt", tags=["Maintenance"])
+async def read_maintenance_receipt(
+    maintenance_id: int,
+    request: Request,
+    db: Session = Depends(get_read_db),
+    current_user: models.User = Depends(auth.get_current_active_user)
+):
+    """Download the receipt for a paid maintenance record"""
+    return _document_response(request, db, "receipt", maintenance_id)
 
 @app.get("/maintenance/{maintenance_id}", response_model=schemas.MaintenanceResponse, tags=["Maintenance"])
 async def read_maintenance(
     maintenance_id: int,
+    fields: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(auth.get_current_active_user)
 ):
-    """Get maintenance by ID"""
-    db_maintenance = crud.get_maintenance(db, maintenance_id=maintenance_id)
+    """Get maintenance by ID; fields=a,b,... returns only those fields"""
+    columns = serializers.columns(models.Maintenance, schemas.MaintenanceResponse, fields) if fields else None
+    db_maintenance = crud.get_maintenance(db, maintenance_id=maintenance_id, columns=columns)
     if db_maintenance is None:
         raise HTTPException(status_code=404, detail="Maintenance record not found")
+    if fields:
+        return serializers.json_object(db_maintenance, schemas.MaintenanceResponse, fields)
     return db_maintenance
 
+def _bulk_results(items, rows):
+    """Per-item outcome of a bulk update, in request order"""
+    updated = {row.id: row for row in rows}
+    return {
+        "updated": len(updated),
+        "results": [
+            {"id": item.id, "status": "updated", "record": updated[item.id]} if item.id in updated
+            else {"id": item.id, "status": "not_found"}
+            for item in items
+        ],
+    }
+
+@app.patch("/maintenance/bulk", response_model=schemas.MaintenanceBulkResponse, tags=["Maintenance"])
+async def update_maintenance_bulk(
+    request: schemas.MaintenanceBulkUpdate,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.check_role([models.UserRole.ADMIN, models.UserRole.ACCOUNTS]))
+):
+    """Update many maintenance records in one transaction"""
+    rows = crud.update_maintenance_bulk(db, request.items)
+    return _bulk_results(request.items, rows)
+
 @app.put("/maintenance/{maintenance_id}", response_model=schemas.MaintenanceResponse, tags=["Maintenance"])
 async def update_maintenance(
     maintenance_id: int,
@@ -393,14 +796,61 @@ async def update_maintenance(
         raise HTTPException(status_code=404, detail="Maintenance record not found")
     return db_maintenance
 
-@app.post("/maintenance/apply-interest", tags=["Maintenance"])
+@app.post("/maintenance/apply-interest", response_model=schemas.JobRunResponse, tags=["Maintenance"], status_code=status.HTTP_202_ACCEPTED)
 async def apply_interest(
+    current_user: models.User = Depends(auth.check_role([models.UserRole.ADMIN, models.UserRole.ACCOUNTS]))
+):
+    """Start applying 10% interest to all overdue maintenance; poll /jobs/runs/{run_id} for progress"""
+    if lifecycle.is_draining():
+        raise HTTPException(status_code=503, detail="Server is shutting down, try again shortly")
+    return jobs.trigger("apply_interest", society_id=current_user.society_id)
+
+# Job Routes
+def _visible_run(run: models.JobRun, current_user: models.User):
+    return current_user.society_id == DEFAULT_SOCIETY_ID or run.society_id == current_user.society_id
+
+@app.get("/jobs/", response_model=List[schemas.JobResponse], tags=["Jobs"])
+async def read_jobs(
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(check_platform_admin)
+):
+    """List scheduled jobs with their last run (platform admin only)"""
+    result = []
+    for job in jobs.JOBS.values():
+        last_run = db.query(models.JobRun).filter(
+            models.JobRun.job_name == job.name
+        ).order_by(models.JobRun.id.desc()).first()
+        result.append({
+            "name": job.name,
+            "schedule": job.schedule.expression,
+            "description": job.description,
+            "last_run": last_run
+        })
+    return result
+
+@app.post("/jobs/{job_name}/run", response_model=schemas.JobRunResponse, tags=["Jobs"], status_code=status.HTTP_202_ACCEPTED)
+async def run_job(
+    job_name: str,
+    current_user: models.User = Depends(check_platform_admin)
+):
+    """Start a job now for all societies (platform admin only)"""
+    if job_name not in jobs.JOBS:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if lifecycle.is_draining():
+        raise HTTPException(status_code=503, detail="Server is shutting down, try again shortly")
+    return jobs.trigger(job_name)
+
+@app.get("/jobs/runs/{run_id}", response_model=schemas.JobRunResponse, tags=["Jobs"])
+async def read_job_run(
+    run_id: int,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(auth.check_role([models.UserRole.ADMIN, models.UserRole.ACCOUNTS]))
 ):
-    """Apply 10% interest to all overdue maintenance"""
-    count = crud.apply_interest_to_overdue(db)
-    return {"message": f"Interest applied to {count} overdue records"}
+    """Get status and progress of a job run"""
+    run = db.query(models.JobRun).filter(models.JobRun.id == run_id).first()
+    if run is None or not _visible_run(run, current_user):
+        raise HTTPException(status_code=404, detail="Job run not found")
+    return run
 
 # Vendor Routes
 @app.post("/vendors/", response_model=schemas.VendorResponse, tags=["Vendors"], status_code=status.HTTP_201_CREATED)
@@ -416,25 +866,43 @@ async def create_vendor(
 async def read_vendors(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    fields: Optional[str] = None,
+    db: Session = Depends(get_read_db),
     current_user: models.User = Depends(auth.get_current_active_user)
 ):
-    """Get all vendors"""
+    """Get all vendors; fields=a,b,... returns only those fields"""
+    if fields or serializers.FAST_SERIALIZATION:
+        rows = crud.get_vendors(db, skip=skip, limit=limit, columns=serializers.columns(models.Vendor, schemas.VendorResponse, fields))
+        return serializers.json_response(rows, schemas.VendorResponse, fields)
     vendors = crud.get_vendors(db, skip=skip, limit=limit)
     return vendors
 
 @app.get("/vendors/{vendor_id}", response_model=schemas.VendorResponse, tags=["Vendors"])
 async def read_vendor(
     vendor_id: int,
-    db: Session = Depends(get_db),
+    fields: Optional[str] = None,
+    db: Session = Depends(get_read_db),
     current_user: models.User = Depends(auth.get_current_active_user)
 ):
-    """Get vendor by ID"""
-    db_vendor = crud.get_vendor(db, vendor_id=vendor_id)
+    """Get vendor by ID; fields=a,b,... returns only those fields"""
+    columns = serializers.columns(models.Vendor, schemas.VendorResponse, fields) if fields else None
+    db_vendor = crud.get_vendor(db, vendor_id=vendor_id, columns=columns)
     if db_vendor is None:
         raise HTTPException(status_code=404, detail="Vendor not found")
+    if fields:
+        return serializers.json_object(db_vendor, schemas.VendorResponse, fields)
     return db_vendor
 
+@app.patch("/vendors/bulk", response_model=schemas.VendorBulkResponse, tags=["Vendors"])
+async def update_vendors_bulk(
+    request: schemas.VendorBulkUpdate,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.check_role([models.UserRole.ADMIN, models.UserRole.OPERATIONS, models.UserRole.ACCOUNTS]))
+):
+    """Update many vendors in one transaction"""
+    rows = crud.update_vendors_bulk(db, request.items)
+    return _bulk_results(request.items, rows)
+
 @app.put("/vendors/{vendor_id}", response_model=schemas.VendorResponse, tags=["Vendors"])
 async def update_vendor(
     vendor_id: int,
@@ -460,11 +928,52 @@ async def delete_vendor(
         raise HTTPException(status_code=404, detail="Vendor not found")
     return {"message": "Vendor deleted successfully"}
 
+# Audit Routes
+@app.get("/audit/", response_model=List[schemas.AuditLogResponse], tags=["Audit"])
+async def read_audit_log(
+    entity_type: Optional[str] = None,
+    entity_id: Optional[int] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    skip: int = 0,
+    limit: int = 100,
+    db: Session = Depends(get_read_db),
+    current_user: models.User = Depends(auth.check_role([models.UserRole.ADMIN]))
+):
+    """Changes to flats, tenants, residents, maintenance and vendors, newest first (Admin only)"""
+    if entity_type is not None and entity_type not in {model.__tablename__ for model in audit.AUDITED_MODELS}:
+        raise HTTPException(status_code=400, detail="Unknown entity type")
+    if entity_id is not None and entity_type is None:
+        raise HTTPException(status_code=400, detail="entity_id requires entity_type")
+    return crud.get_audit_log(db, entity_type=entity_type, entity_id=entity_id, since=since, until=until, skip=skip, limit=limit)
+
+# Search Routes
+@app.get("/search", tags=["Search"])
+async def search_directory(
+    q: str,
+    types: Optional[str] = None,
+    limit: int = 20,
+    db: Session = Depends(get_read_db),
+    current_user: models.User = Depends(auth.check_role([models.UserRole.ADMIN, models.UserRole.ACCOUNTS, models.UserRole.OPERATIONS]))
+):
+    """Search flats, residents, tenants and vendors; types is a comma-separated subset"""
+    kinds = [kind.strip() for kind in types.split(",")] if types else None
+    if kinds and any(kind not in search.SEARCH_TYPES for kind in kinds):
+        raise HTTPException(status_code=400, detail=f"types must be among: {', '.join(search.SEARCH_TYPES)}")
+    return {"results": search.search(db, q, types=kinds, limit=min(limit, 100))}
+
 @app.get("/", tags=["Root"])
 async def root():
     """Root endpoint"""
     return {"message": "Society Management API", "version": "1.0.0", "status": "running"}
 
+@app.get("/health", tags=["Root"])
+async def health():
+    """Readiness for load balancers: 503 once this worker is shutting down"""
+    if lifecycle.is_draining():
+        return ORJSONResponse({"status": "draining"}, status_code=503)
+    return {"status": "ok"}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,39 @@
+-- Migration 001: index set for the hot crud.py queries
+-- Brings an existing database in line with schema.sql and the __table_args__ in models.py.
+--
+-- CREATE/DROP INDEX CONCURRENTLY cannot run inside a transaction block, so apply with
+-- autocommit, e.g.:
+--   psql "$DATABASE_URL" -f migrations/001_hot_query_indexes.sql
+
+-- Maintenance: one bill per flat per month, listed per flat by year/month
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS uq_maintenance_flat_period ON maintenance(flat_id, year, month);
+ALTER TABLE maintenance DROP CONSTRAINT IF EXISTS maintenance_flat_id_month_year_key;
+DROP INDEX CONCURRENTLY IF EXISTS idx_maintenance_flat;
+
+-- Maintenance: whole-society billing for a month
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_maintenance_period ON maintenance(year, month);
+DROP INDEX CONCURRENTLY IF EXISTS idx_maintenance_month_year;
+
+-- Maintenance: interest job and overdue reminders
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_maintenance_status_due ON maintenance(payment_status, due_date);
+DROP INDEX CONCURRENTLY IF EXISTS idx_maintenance_status;
+
+-- Tenant history: per-flat history and current tenant lookup
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tenant_flat_start ON tenant_history(flat_id, agreement_start_date);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tenant_current_flat ON tenant_history(flat_id) WHERE is_current;
+DROP INDEX CONCURRENTLY IF EXISTS idx_tenant_flat;
+DROP INDEX CONCURRENTLY IF EXISTS idx_tenant_current;
+
+-- Residents, flats and vendors
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_resident_flat ON flat_residents(flat_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_flats_owner ON flats(owner_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_vendor_status ON vendors(status);
+
+-- Duplicates of unique constraints, and an index no query uses
+DROP INDEX CONCURRENTLY IF EXISTS idx_users_email;
+DROP INDEX CONCURRENTLY IF EXISTS idx_users_username;
+DROP INDEX CONCURRENTLY IF EXISTS idx_flats_number;
+DROP INDEX CONCURRENTLY IF EXISTS idx_users_role;
+
+ANALYZE maintenance;
+ANALYZE tenant_history;
@@ -0,0 +1,36 @@
+-- Migration 002: multi-society tenancy
+-- Adds the societies table and a society_id column to every data table. Existing rows
+-- belong to the default society (id 1). Flat numbers become unique per society.
+--
+-- Run inside a transaction:
+--   psql "$DATABASE_URL" -1 -f migrations/002_multi_society.sql
+
+CREATE TABLE IF NOT EXISTS societies (
+    id SERIAL PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    code VARCHAR(100) UNIQUE NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO societies (id, name, code) VALUES (1, 'Default Society', 'default')
+    ON CONFLICT (id) DO NOTHING;
+SELECT setval('societies_id_seq', GREATEST((SELECT max(id) FROM societies), 1));
+
+ALTER TABLE users ADD COLUMN IF NOT EXISTS society_id INTEGER NOT NULL DEFAULT 1 REFERENCES societies(id);
+ALTER TABLE flats ADD COLUMN IF NOT EXISTS society_id INTEGER NOT NULL DEFAULT 1 REFERENCES societies(id);
+ALTER TABLE tenant_history ADD COLUMN IF NOT EXISTS society_id INTEGER NOT NULL DEFAULT 1 REFERENCES societies(id);
+ALTER TABLE flat_residents ADD COLUMN IF NOT EXISTS society_id INTEGER NOT NULL DEFAULT 1 REFERENCES societies(id);
+ALTER TABLE maintenance ADD COLUMN IF NOT EXISTS society_id INTEGER NOT NULL DEFAULT 1 REFERENCES societies(id);
+ALTER TABLE vendors ADD COLUMN IF NOT EXISTS society_id INTEGER NOT NULL DEFAULT 1 REFERENCES societies(id);
+
+-- Flat numbers repeat across societies
+CREATE UNIQUE INDEX IF NOT EXISTS uq_flats_society_number ON flats(society_id, flat_number);
+ALTER TABLE flats DROP CONSTRAINT IF EXISTS flats_flat_number_key;
+DROP INDEX IF EXISTS ix_flats_flat_number;
+
+-- Per-society indexes
+CREATE INDEX IF NOT EXISTS idx_users_society ON users(society_id);
+DROP INDEX IF EXISTS idx_maintenance_period;
+CREATE INDEX idx_maintenance_period ON maintenance(society_id, year, month);
+DROP INDEX IF EXISTS idx_vendor_status;
+CREATE INDEX IF NOT EXISTS idx_vendor_society_status ON vendors(society_id, status);
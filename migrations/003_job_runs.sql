@@ -0,0 +1,37 @@
+-- Migration 003: background job runs and maintenance rollups
+--   psql "$DATABASE_URL" -1 -f migrations/003_job_runs.sql
+
+CREATE TABLE IF NOT EXISTS maintenance_rollups (
+    id SERIAL PRIMARY KEY,
+    society_id INTEGER NOT NULL DEFAULT 1 REFERENCES societies(id),
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    flats_billed INTEGER NOT NULL DEFAULT 0,
+    total_billed FLOAT NOT NULL DEFAULT 0.0,
+    total_paid FLOAT NOT NULL DEFAULT 0.0,
+    outstanding FLOAT NOT NULL DEFAULT 0.0,
+    overdue_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_rollup_society_period ON maintenance_rollups(society_id, year, month);
+
+DO $$ BEGIN
+    CREATE TYPE job_status AS ENUM ('queued', 'running', 'succeeded', 'failed');
+EXCEPTION WHEN duplicate_object THEN NULL;
+END $$;
+
+CREATE TABLE IF NOT EXISTS job_runs (
+    id SERIAL PRIMARY KEY,
+    job_name VARCHAR(100) NOT NULL,
+    society_id INTEGER REFERENCES societies(id),
+    status job_status NOT NULL DEFAULT 'queued',
+    scheduled_for TIMESTAMP,
+    processed INTEGER DEFAULT 0,
+    total INTEGER,
+    message TEXT,
+    error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_job_runs_name_scheduled ON job_runs(job_name, scheduled_for);
@@ -0,0 +1,14 @@
+-- Migration 004: trigram indexes for GET /search
+-- CREATE INDEX CONCURRENTLY cannot run inside a transaction block, so apply with
+-- autocommit, e.g.:
+--   psql "$DATABASE_URL" -f migrations/004_search_trigram_indexes.sql
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_flats_number_trgm ON flats USING gin (flat_number gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_flats_owner_name_trgm ON flats USING gin (owner_name gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tenant_name_trgm ON tenant_history USING gin (tenant_name gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tenant_phone_trgm ON tenant_history USING gin (tenant_phone gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_resident_name_trgm ON flat_residents USING gin (resident_name gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_vendor_name_trgm ON vendors USING gin (vendor_name gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_vendor_work_trgm ON vendors USING gin (vendor_work gin_trgm_ops);
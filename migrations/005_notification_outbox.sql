@@ -0,0 +1,25 @@
+-- Migration 005: outbox for dues reminder notifications
+--   psql "$DATABASE_URL" -1 -f migrations/005_notification_outbox.sql
+
+DO $$ BEGIN
+    CREATE TYPE notification_status AS ENUM ('pending', 'sent', 'failed');
+EXCEPTION WHEN duplicate_object THEN NULL;
+END $$;
+
+CREATE TABLE IF NOT EXISTS notification_outbox (
+    id SERIAL PRIMARY KEY,
+    society_id INTEGER NOT NULL DEFAULT 1 REFERENCES societies(id),
+    maintenance_id INTEGER REFERENCES maintenance(id),
+    dedupe_key VARCHAR(255) NOT NULL,
+    recipient VARCHAR(255) NOT NULL,
+    subject VARCHAR(255) NOT NULL,
+    body TEXT NOT NULL,
+    status notification_status NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    sent_at TIMESTAMP
+);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_notification_dedupe ON notification_outbox(dedupe_key);
+CREATE INDEX IF NOT EXISTS idx_notification_pending ON notification_outbox(status, next_attempt_at);
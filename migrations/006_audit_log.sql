@@ -0,0 +1,16 @@
+-- Migration 006: audit log of changes to flats, tenants, residents, maintenance and vendors
+--   psql "$DATABASE_URL" -1 -f migrations/006_audit_log.sql
+
+CREATE TABLE IF NOT EXISTS audit_log (
+    id SERIAL PRIMARY KEY,
+    society_id INTEGER NOT NULL DEFAULT 1 REFERENCES societies(id),
+    entity_type VARCHAR(100) NOT NULL,
+    entity_id INTEGER NOT NULL,
+    action VARCHAR(20) NOT NULL,
+    changes JSON NOT NULL,
+    user_id INTEGER,
+    username VARCHAR(100),
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_audit_entity_time ON audit_log(entity_type, entity_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_audit_society_time ON audit_log(society_id, created_at);
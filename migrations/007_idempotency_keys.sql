@@ -0,0 +1,15 @@
+-- Migration 007: stored responses for POSTs retried with an Idempotency-Key
+--   psql "$DATABASE_URL" -1 -f migrations/007_idempotency_keys.sql
+
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    id SERIAL PRIMARY KEY,
+    key_hash VARCHAR(64) NOT NULL,
+    request_hash VARCHAR(64) NOT NULL,
+    status_code INTEGER,
+    content_type VARCHAR(255),
+    response_body TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_idempotency_key_hash ON idempotency_keys(key_hash);
+CREATE INDEX IF NOT EXISTS idx_idempotency_expires ON idempotency_keys(expires_at);
@@ -0,0 +1,8 @@
+-- Migration 008: shared rate limit state for RATE_LIMIT_BACKEND=database
+--   psql "$DATABASE_URL" -1 -f migrations/008_rate_limit_buckets.sql
+
+CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+    key VARCHAR(512) PRIMARY KEY,
+    tat DOUBLE PRECISION NOT NULL,
+    allowed BOOLEAN NOT NULL DEFAULT TRUE
+);
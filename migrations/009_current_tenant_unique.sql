@@ -0,0 +1,18 @@
+-- Migration 009: at most one current tenancy per flat, and the expiring-agreements index
+-- Tenant changeover now clears only the flat's current row, found through this index.
+--
+-- CREATE/DROP INDEX CONCURRENTLY cannot run inside a transaction block, so apply with
+-- autocommit, e.g.:
+--   psql "$DATABASE_URL" -f migrations/009_current_tenant_unique.sql
+
+-- Keep only the newest current tenancy of each flat
+UPDATE tenant_history t SET is_current = FALSE
+WHERE t.is_current AND EXISTS (
+    SELECT 1 FROM tenant_history newer
+    WHERE newer.flat_id = t.flat_id AND newer.is_current
+      AND (newer.agreement_start_date, newer.id) > (t.agreement_start_date, t.id)
+);
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS uq_tenant_current_flat ON tenant_history(flat_id) WHERE is_current;
+DROP INDEX CONCURRENTLY IF EXISTS idx_tenant_current_flat;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tenant_current_end ON tenant_history(agreement_end_date) WHERE is_current;
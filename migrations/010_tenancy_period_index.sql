@@ -0,0 +1,10 @@
+-- Migration 010: interval index for point-in-time and date range occupancy queries
+-- Indexes each tenancy as tsrange(agreement_start_date, agreement_end_date, '[)');
+-- crud.get_occupancy queries the same expression with &&.
+--
+-- CREATE INDEX CONCURRENTLY cannot run inside a transaction block, so apply with
+-- autocommit, e.g.:
+--   psql "$DATABASE_URL" -f migrations/010_tenancy_period_index.sql
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tenant_period ON tenant_history
+    USING gist (tsrange(agreement_start_date, agreement_end_date, '[)'));
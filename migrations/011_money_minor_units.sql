@@ -0,0 +1,31 @@
+-- Migration 011: store money as integer paise instead of FLOAT
+-- models.Money converts to and from rupees, so the API still sends and receives decimals.
+-- Existing values are rounded to the nearest paisa.
+--
+-- Each ALTER rewrites its table under an ACCESS EXCLUSIVE lock; run during a quiet
+-- period, in one transaction:
+--   psql "$DATABASE_URL" -1 -f migrations/011_money_minor_units.sql
+
+ALTER TABLE maintenance
+    ALTER COLUMN base_amount TYPE BIGINT USING round(base_amount::numeric * 100),
+    ALTER COLUMN interest TYPE BIGINT USING round(interest::numeric * 100),
+    ALTER COLUMN interest SET DEFAULT 0,
+    ALTER COLUMN total_amount TYPE BIGINT USING round(total_amount::numeric * 100),
+    ALTER COLUMN amount_paid TYPE BIGINT USING round(amount_paid::numeric * 100),
+    ALTER COLUMN amount_paid SET DEFAULT 0;
+
+ALTER TABLE vendors
+    ALTER COLUMN total_charges TYPE BIGINT USING round(total_charges::numeric * 100),
+    ALTER COLUMN total_charges SET DEFAULT 0,
+    ALTER COLUMN amount_paid TYPE BIGINT USING round(amount_paid::numeric * 100),
+    ALTER COLUMN amount_paid SET DEFAULT 0,
+    ALTER COLUMN amount_remaining TYPE BIGINT USING round(amount_remaining::numeric * 100),
+    ALTER COLUMN amount_remaining SET DEFAULT 0;
+
+ALTER TABLE maintenance_rollups
+    ALTER COLUMN total_billed TYPE BIGINT USING round(total_billed::numeric * 100),
+    ALTER COLUMN total_billed SET DEFAULT 0,
+    ALTER COLUMN total_paid TYPE BIGINT USING round(total_paid::numeric * 100),
+    ALTER COLUMN total_paid SET DEFAULT 0,
+    ALTER COLUMN outstanding TYPE BIGINT USING round(outstanding::numeric * 100),
+    ALTER COLUMN outstanding SET DEFAULT 0;
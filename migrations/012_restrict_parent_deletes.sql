@@ -0,0 +1,23 @@
+-- Migration 012: refuse to delete a user who owns flats or a flat that has records
+-- ON DELETE CASCADE removed a user's flats with all their tenant, resident and
+-- maintenance history, none of it audited. crud.py now checks for these rows and
+-- returns 409; RESTRICT also stops children added concurrently.
+--
+-- Each ALTER briefly locks its table; apply in one transaction:
+--   psql "$DATABASE_URL" -1 -f migrations/012_restrict_parent_deletes.sql
+
+ALTER TABLE flats
+    DROP CONSTRAINT IF EXISTS flats_owner_id_fkey,
+    ADD CONSTRAINT flats_owner_id_fkey FOREIGN KEY (owner_id) REFERENCES users(id) ON DELETE RESTRICT;
+
+ALTER TABLE tenant_history
+    DROP CONSTRAINT IF EXISTS tenant_history_flat_id_fkey,
+    ADD CONSTRAINT tenant_history_flat_id_fkey FOREIGN KEY (flat_id) REFERENCES flats(id) ON DELETE RESTRICT;
+
+ALTER TABLE flat_residents
+    DROP CONSTRAINT IF EXISTS flat_residents_flat_id_fkey,
+    ADD CONSTRAINT flat_residents_flat_id_fkey FOREIGN KEY (flat_id) REFERENCES flats(id) ON DELETE RESTRICT;
+
+ALTER TABLE maintenance
+    DROP CONSTRAINT IF EXISTS maintenance_flat_id_fkey,
+    ADD CONSTRAINT maintenance_flat_id_fkey FOREIGN KEY (flat_id) REFERENCES flats(id) ON DELETE RESTRICT;
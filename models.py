@@ -1,8 +1,13 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Enum, Boolean, Text
-from sqlalchemy.orm import relationship
-from database import Base
+from sqlalchemy import Column, Integer, BigInteger, String, Float, Numeric, DateTime, ForeignKey, Enum, Boolean, Text, JSON, Index, DDL, event, func, literal_column
+from sqlalchemy.sql import operators
+from sqlalchemy.types import TypeDecorator
+from sqlalchemy.orm import relationship, declared_attr, Session, with_loader_criteria
+from database import Base, DEFAULT_SOCIETY_ID
+from collections import OrderedDict
 from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP
 import enum
+import threading
 
 class UserRole(str, enum.Enum):
     ADMIN = "admin"
@@ -24,7 +29,136 @@ class PaymentStatus(str, enum.Enum):
     PENDING = "pending"
     OVERDUE = "overdue"
 
-class User(Base):
+# Trigram indexes back search.py; they need the pg_trgm extension
+event.listen(Base.metadata, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"))
+
+def _trigram_index(name: str, column: str):
+    return Index(
+        name, column, postgresql_using="gin", postgresql_ops={column: "gin_trgm_ops"}
+    ).ddl_if(dialect="postgresql")
+
+def _enum(enum_class):
+    """Native enum type on PostgreSQL; a VARCHAR checked against the members on SQLite"""
+    return Enum(enum_class, create_constraint=True)
+
+def period_range(lower, upper):
+    """Half-open PostgreSQL tsrange [lower, upper); a NULL upper is unbounded"""
+    # Queries must build the range exactly like the index expression to use it
+    return func.tsrange(lower, upper, literal_column("'[)'"))
+
+class Money(TypeDecorator):
+    """Amount stored exactly as integer paise; Python sees rupees as two-place Decimals
+
+    SUM and arithmetic on these columns run on integers in SQL, so totals never drift.
+    """
+    impl = BigInteger
+    cache_ok = True
+    
+    @property
+    def python_type(self):
+        return Decimal
+    
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return int((Decimal(str(value)) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+    
+    def process_result_value(self, value, dialect):
+        return None if value is None else Decimal(int(value)).scaleb(-2)
+    
+    def coerce_compared_value(self, op, value):
+        # Rates in amount * rate are plain numbers, not amounts
+        if op in (operators.mul, operators.truediv):
+            return Numeric()
+        return self
+    
+    class comparator_factory(TypeDecorator.Comparator, BigInteger.Comparator):
+        def _adapt_expression(self, op, other_comparator):
+            # Sums and differences of amounts are amounts too
+            if op in (operators.add, operators.sub):
+                return op, self.type
+            return super()._adapt_expression(op, other_comparator)
+
+class Society(Base):
+    __tablename__ = "societies"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, nullable=False)
+    code = Column(String, unique=True, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class SocietyScoped:
+    """Rows owned by one society; sessions opened for a society only see their own rows"""
+    
+    @declared_attr
+    def society_id(cls):
+        return Column(Integer, ForeignKey("societies.id"), nullable=False, default=DEFAULT_SOCIETY_ID)
+
+def _scoped(statement, society_id: int):
+    return statement.options(
+        with_loader_criteria(
+            SocietyScoped,
+            lambda cls: cls.society_id == society_id,
+            include_aliases=True
+        )
+    )
+
+# Scoped copies of statements built once at import (execution option reuse_scoped=True),
+# so their cache keys are computed once per society instead of on every execution.
+# Least recently used copies are dropped past the limit: sparse fieldset variants are
+# built on demand, so the set of statements is not fixed.
+SCOPED_STATEMENT_CACHE_SIZE = 1024
+_scoped_statements = OrderedDict()
+_scoped_statements_lock = threading.Lock()
+
+def _cached_scoped(statement, society_id: int):
+    key = (statement, society_id)
+    with _scoped_statements_lock:
+        scoped = _scoped_statements.get(key)
+        if scoped is not None:
+            _scoped_statements.move_to_end(key)
+            return scoped
+    scoped = _scoped(statement, society_id)
+    with _scoped_statements_lock:
+        _scoped_statements[key] = scoped
+        if len(_scoped_statements) > SCOPED_STATEMENT_CACHE_SIZE:
+            _scoped_statements.popitem(last=False)
+    return scoped
+
+@event.listens_for(Session, "do_orm_execute")
+def _scope_to_society(execute_state):
+    society_id = execute_state.session.info.get("society_id")
+    if society_id is None:
+        return
+    if (execute_state.is_select or execute_state.is_update or execute_state.is_delete) \
+            and not execute_state.is_column_load and not execute_state.is_relationship_load:
+        statement = execute_state.statement
+        if not statement.get_execution_options().get("reuse_scoped"):
+            execute_state.statement = _scoped(statement, society_id)
+            return
+        execute_state.statement = _cached_scoped(statement, society_id)
+
+@event.listens_for(Session, "before_flush")
+def _assign_society(session, flush_context, instances):
+    society_id = session.info.get("society_id")
+    if society_id is None:
+        return
+    for instance in session.new:
+        if isinstance(instance, SocietyScoped) and instance.society_id is None:
+            instance.society_id = society_id
+
+class JobStatus(str, enum.Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+class NotificationStatus(str, enum.Enum):
+    PENDING = "pending"
+    SENT = "sent"
+    FAILED = "failed"
+
+class User(SocietyScoped, Base):
     __tablename__ = "users"
     
     id = Column(Integer, primary_key=True, index=True)
@@ -33,7 +167,7 @@ class User(Base):
     hashed_password = Column(String, nullable=False)
     full_name = Column(String, nullable=False)
     phone_number = Column(String)
-    role = Column(Enum(UserRole), nullable=False)
+    role = Column(_enum(UserRole), nullable=False)
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -41,17 +175,21 @@ class User(Base):
     # Relationship
     flat = relationship("Flat", back_populates="owner", uselist=False)
 
-class Flat(Base):
+    __table_args__ = (
+        Index("idx_users_society", "society_id"),
+    )
+
+class Flat(SocietyScoped, Base):
     __tablename__ = "flats"
     
     id = Column(Integer, primary_key=True, index=True)
-    flat_number = Column(String, unique=True, index=True, nullable=False)
-    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    flat_number = Column(String, nullable=False)
+    owner_id = Column(Integer, ForeignKey("users.id", ondelete="RESTRICT"), nullable=False)
     owner_name = Column(String, nullable=False)
     owner_email = Column(String, nullable=False)
     owner_phone = Column(String, nullable=False)
     flat_sq_size = Column(Float, nullable=False)
-    flat_type = Column(Enum(FlatType), nullable=False, default=FlatType.RESIDENT)
+    flat_type = Column(_enum(FlatType), nullable=False, default=FlatType.RESIDENT)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -61,11 +199,19 @@ class Flat(Base):
     residents = relationship("FlatResident", back_populates="flat")
     maintenance_records = relationship("Maintenance", back_populates="flat")
 
-class TenantHistory(Base):
+    __table_args__ = (
+        # Flat numbers repeat across societies
+        Index("uq_flats_society_number", "society_id", "flat_number", unique=True),
+        Index("idx_flats_owner", "owner_id"),
+        _trigram_index("idx_flats_number_trgm", "flat_number"),
+        _trigram_index("idx_flats_owner_name_trgm", "owner_name"),
+    )
+
+class TenantHistory(SocietyScoped, Base):
     __tablename__ = "tenant_history"
     
     id = Column(Integer, primary_key=True, index=True)
-    flat_id = Column(Integer, ForeignKey("flats.id"), nullable=False)
+    flat_id = Column(Integer, ForeignKey("flats.id", ondelete="RESTRICT"), nullable=False)
     tenant_name = Column(String, nullable=False)
     tenant_email = Column(String, nullable=False)
     tenant_phone = Column(String, nullable=False)
@@ -82,11 +228,28 @@ class TenantHistory(Base):
     # Relationship
     flat = relationship("Flat", back_populates="tenant_history")
 
-class FlatResident(Base):
+    __table_args__ = (
+        # Tenant history of a flat, newest agreement first
+        Index("idx_tenant_flat_start", "flat_id", "agreement_start_date"),
+        # At most one current tenancy per flat; only current rows are indexed. SQLite
+        # only uses a partial index when the query repeats its condition, i.e. "= 1"
+        Index("uq_tenant_current_flat", "flat_id", unique=True,
+              postgresql_where=is_current.is_(True), sqlite_where=is_current == True),
+        # Expiring-agreements report over current tenancies
+        Index("idx_tenant_current_end", "agreement_end_date",
+              postgresql_where=is_current.is_(True), sqlite_where=is_current == True),
+        # Point-in-time and date range occupancy
+        Index("idx_tenant_period", period_range(agreement_start_date, agreement_end_date),
+              postgresql_using="gist").ddl_if(dialect="postgresql"),
+        _trigram_index("idx_tenant_name_trgm", "tenant_name"),
+        _trigram_index("idx_tenant_phone_trgm", "tenant_phone"),
+    )
+
+class FlatResident(SocietyScoped, Base):
     __tablename__ = "flat_residents"
     
     id = Column(Integer, primary_key=True, index=True)
-    flat_id = Column(Integer, ForeignKey("flats.id"), nullable=False)
+    flat_id = Column(Integer, ForeignKey("flats.id", ondelete="RESTRICT"), nullable=False)
     resident_name = Column(String, nullable=False)
     resident_email = Column(String)
     resident_phone = Column(String)
@@ -99,18 +262,23 @@ class FlatResident(Base):
     # Relationship
     flat = relationship("Flat", back_populates="residents")
 
-class Maintenance(Base):
+    __table_args__ = (
+        Index("idx_resident_flat", "flat_id"),
+        _trigram_index("idx_resident_name_trgm", "resident_name"),
+    )
+
+class Maintenance(SocietyScoped, Base):
     __tablename__ = "maintenance"
     
     id = Column(Integer, primary_key=True, index=True)
-    flat_id = Column(Integer, ForeignKey("flats.id"), nullable=False)
+    flat_id = Column(Integer, ForeignKey("flats.id", ondelete="RESTRICT"), nullable=False)
     month = Column(Integer, nullable=False)  # 1-12
     year = Column(Integer, nullable=False)
-    base_amount = Column(Float, nullable=False)
-    interest = Column(Float, default=0.0)
-    total_amount = Column(Float, nullable=False)
-    amount_paid = Column(Float, default=0.0)
-    payment_status = Column(Enum(PaymentStatus), default=PaymentStatus.PENDING)
+    base_amount = Column(Money, nullable=False)
+    interest = Column(Money, default=0)
+    total_amount = Column(Money, nullable=False)
+    amount_paid = Column(Money, default=0)
+    payment_status = Column(_enum(PaymentStatus), default=PaymentStatus.PENDING)
     due_date = Column(DateTime, nullable=False)
     paid_date = Column(DateTime)
     invoice_number = Column(String, unique=True)
@@ -121,7 +289,16 @@ class Maintenance(Base):
     # Relationship
     flat = relationship("Flat", back_populates="maintenance_records")
 
-class Vendor(Base):
+    __table_args__ = (
+        # One bill per flat per month; also serves the per-flat listing ordered by year/month
+        Index("uq_maintenance_flat_period", "flat_id", "year", "month", unique=True),
+        # Whole-society billing for a month
+        Index("idx_maintenance_period", "society_id", "year", "month"),
+        # Interest job and overdue reminders
+        Index("idx_maintenance_status_due", "payment_status", "due_date"),
+    )
+
+class Vendor(SocietyScoped, Base):
     __tablename__ = "vendors"
     
     id = Column(Integer, primary_key=True, index=True)
@@ -130,9 +307,121 @@ class Vendor(Base):
     phone_number = Column(String, nullable=False)
     email = Column(String)
     business_details = Column(Text)
-    status = Column(Enum(VendorStatus), default=VendorStatus.ACTIVE)
-    total_charges = Column(Float, default=0.0)
-    amount_paid = Column(Float, default=0.0)
-    amount_remaining = Column(Float, default=0.0)
+    status = Column(_enum(VendorStatus), default=VendorStatus.ACTIVE)
+    total_charges = Column(Money, default=0)
+    amount_paid = Column(Money, default=0)
+    amount_remaining = Column(Money, default=0)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        Index("idx_vendor_society_status", "society_id", "status"),
+        _trigram_index("idx_vendor_name_trgm", "vendor_name"),
+        _trigram_index("idx_vendor_work_trgm", "vendor_work"),
+    )
+
+class MaintenanceRollup(SocietyScoped, Base):
+    __tablename__ = "maintenance_rollups"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    year = Column(Integer, nullable=False)
+    month = Column(Integer, nullable=False)
+    flats_billed = Column(Integer, nullable=False, default=0)
+    total_billed = Column(Money, nullable=False, default=0)
+    total_paid = Column(Money, nullable=False, default=0)
+    outstanding = Column(Money, nullable=False, default=0)
+    overdue_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("uq_rollup_society_period", "society_id", "year", "month", unique=True),
+    )
+
+class JobRun(Base):
+    __tablename__ = "job_runs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    job_name = Column(String, nullable=False)
+    society_id = Column(Integer, ForeignKey("societies.id"))  # None for runs across all societies
+    status = Column(_enum(JobStatus), nullable=False, default=JobStatus.QUEUED)
+    scheduled_for = Column(DateTime)  # Cron slot for scheduled runs, None for manual runs
+    processed = Column(Integer, default=0)
+    total = Column(Integer)
+    message = Column(Text)
+    error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+    __table_args__ = (
+        Index("idx_job_runs_name_scheduled", "job_name", "scheduled_for"),
+    )
+
+class Notification(SocietyScoped, Base):
+    """Outbox of messages waiting to be sent by notifications.py"""
+    __tablename__ = "notification_outbox"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    maintenance_id = Column(Integer, ForeignKey("maintenance.id"))
+    dedupe_key = Column(String, nullable=False)  # One message per reminder, however often it is queued
+    recipient = Column(String, nullable=False)
+    subject = Column(String, nullable=False)
+    body = Column(Text, nullable=False)
+    status = Column(_enum(NotificationStatus), nullable=False, default=NotificationStatus.PENDING)
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    last_error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime)
+
+    __table_args__ = (
+        Index("uq_notification_dedupe", "dedupe_key", unique=True),
+        # The sender's queue: pending messages that are due
+        Index("idx_notification_pending", "status", "next_attempt_at"),
+    )
+
+class AuditLog(SocietyScoped, Base):
+    """Who changed what; written in batches by audit.py"""
+    __tablename__ = "audit_log"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    entity_type = Column(String, nullable=False)  # Table name, e.g. "flats"
+    entity_id = Column(Integer, nullable=False)
+    action = Column(String, nullable=False)  # create, update or delete
+    changes = Column(JSON, nullable=False)  # {field: [before, after]}
+    user_id = Column(Integer)  # No foreign key: entries outlive deleted users
+    username = Column(String)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        # History of one record
+        Index("idx_audit_entity_time", "entity_type", "entity_id", "created_at"),
+        # Recent activity across the society
+        Index("idx_audit_society_time", "society_id", "created_at"),
+    )
+
+class IdempotencyRecord(Base):
+    """Stored response for a POST retried with the same Idempotency-Key; see idempotency.py"""
+    __tablename__ = "idempotency_keys"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    key_hash = Column(String(64), nullable=False)  # sha256 of caller, method, path and key
+    request_hash = Column(String(64), nullable=False)  # sha256 of the request body
+    status_code = Column(Integer)  # None while the first request is still running
+    content_type = Column(String)
+    response_body = Column(Text)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("uq_idempotency_key_hash", "key_hash", unique=True),
+        Index("idx_idempotency_expires", "expires_at"),
+    )
+
+class RateLimitBucket(Base):
+    """Shared rate limit state for ratelimit.DatabaseBackend"""
+    __tablename__ = "rate_limit_buckets"
+    
+    key = Column(String, primary_key=True)
+    tat = Column(Float, nullable=False)  # Theoretical arrival time, epoch seconds
+    allowed = Column(Boolean, nullable=False, default=True)  # Outcome of the last request
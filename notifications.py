@@ -0,0 +1,255 @@
+"""
+Dues reminder notifications through a local outbox
+
+queue_dues_reminders finds maintenance that is due soon or overdue and writes one
+message per reminder into notification_outbox in a single transaction.
+send_pending_notifications drains the outbox in batches: each batch is claimed in a short
+transaction, an asyncio sender spreads it over a few reused SMTP connections, paced to
+SMTP_RATE_PER_SECOND, and the results are written in a second short transaction.
+Failed messages are retried with exponential backoff. Both run as scheduled jobs, never on the
+request path.
+
+For local testing, point SMTP_HOST/SMTP_PORT at a stand-in such as MailHog or
+`python -m aiosmtpd -n -l localhost:1025`.
+"""
+import asyncio
+import os
+import smtplib
+import time
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+
+import models
+
+SMTP_HOST = os.getenv("SMTP_HOST", "localhost")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "25"))
+SMTP_USERNAME = os.getenv("SMTP_USERNAME")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "false").lower() == "true"
+SMTP_FROM = os.getenv("SMTP_FROM", "noreply@society.local")
+# Concurrent SMTP connections per drain, and the overall send rate across them
+SMTP_CONNECTIONS = int(os.getenv("SMTP_CONNECTIONS", "4"))
+SMTP_RATE_PER_SECOND = float(os.getenv("SMTP_RATE_PER_SECOND", "20"))
+SMTP_TIMEOUT_SECONDS = 30
+
+NOTIFICATION_BATCH_SIZE = int(os.getenv("NOTIFICATION_BATCH_SIZE", "500"))
+NOTIFICATION_MAX_ATTEMPTS = int(os.getenv("NOTIFICATION_MAX_ATTEMPTS", "5"))
+RETRY_BASE_SECONDS = 60
+# A claimed batch is left alone by other drainers for this long; keep it well above
+# NOTIFICATION_BATCH_SIZE / SMTP_RATE_PER_SECOND
+NOTIFICATION_CLAIM_SECONDS = int(os.getenv("NOTIFICATION_CLAIM_SECONDS", "600"))
+# Pending bills get one reminder this many days before they are due
+REMINDER_DAYS_BEFORE_DUE = int(os.getenv("REMINDER_DAYS_BEFORE_DUE", "3"))
+
+def _money(value):
+    return f"{value or 0:,.2f}"
+
+def _reminder(row, today):
+    """(dedupe key, subject, body) for a due or overdue bill"""
+    period = datetime(row.year, row.month, 1).strftime("%B %Y")
+    balance = (row.total_amount or 0) - (row.amount_paid or 0)
+    if row.due_date.date() < today:
+        # Overdue bills are reminded once a week until paid
+        week = today.isocalendar()
+        key = f"overdue:{row.id}:{week[0]}-W{week[1]:02d}"
+        subject = f"Overdue: maintenance for {row.flat_number}, {period}"
+        lead = f"your maintenance for {period} was due on {row.due_date:%d %b %Y} and is overdue."
+    else:
+        key = f"due:{row.id}"
+        subject = f"Reminder: maintenance for {row.flat_number}, {period}"
+        lead = f"your maintenance for {period} is due on {row.due_date:%d %b %Y}."
+    body = (
+        f"Dear {row.owner_name},\n\n"
+        f"This is a reminder that {lead}\n\n"
+        f"Flat: {row.flat_number}\n"
+        f"Invoice: {row.invoice_number or '-'}\n"
+        f"Amount due: {_money(balance)}\n\n"
+        f"Please ignore this message if you have already paid.\n"
+    )
+    return key, subject, body
+
+def queue_dues_reminders(db: Session, progress=None):
+    """Scheduled job: write reminders for due and overdue bills to the outbox"""
+    now = datetime.utcnow()
+    rows = db.query(
+        models.Maintenance.id,
+        models.Maintenance.society_id,
+        models.Maintenance.year,
+        models.Maintenance.month,
+        models.Maintenance.total_amount,
+        models.Maintenance.amount_paid,
+        models.Maintenance.due_date,
+        models.Maintenance.invoice_number,
+        models.Flat.flat_number,
+        models.Flat.owner_name,
+        models.Flat.owner_email,
+    ).join(models.Flat, models.Flat.id == models.Maintenance.flat_id).filter(
+        or_(
+            models.Maintenance.payment_status == models.PaymentStatus.OVERDUE,
+            and_(
+                models.Maintenance.payment_status == models.PaymentStatus.PENDING,
+                models.Maintenance.due_date <= now + timedelta(days=REMINDER_DAYS_BEFORE_DUE)
+            )
+        )
+    ).all()
+
+    reminders = {}
+    for row in rows:
+        if row.owner_email:
+            key, subject, body = _reminder(row, now.date())
+            reminders[key] = models.Notification(
+                society_id=row.society_id,
+                maintenance_id=row.id,
+                dedupe_key=key,
+                recipient=row.owner_email,
+                subject=subject,
+                body=body,
+                next_attempt_at=now
+            )
+    queued = set()
+    keys = list(reminders)
+    for i in range(0, len(keys), 1000):
+        queued.update(key for key, in db.query(models.Notification.dedupe_key).filter(
+            models.Notification.dedupe_key.in_(keys[i:i + 1000])
+        ))
+    new = [notification for key, notification in reminders.items() if key not in queued]
+    db.add_all(new)
+    db.commit()
+    if progress:
+        progress(len(new), len(new))
+    return len(new)
+
+def _connect():
+    connection = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT_SECONDS)
+    if SMTP_STARTTLS:
+        connection.starttls()
+    if SMTP_USERNAME:
+        connection.login(SMTP_USERNAME, SMTP_PASSWORD or "")
+    return connection
+
+def _close(connection):
+    try:
+        connection.quit()
+    except (smtplib.SMTPException, OSError):
+        connection.close()
+
+def _message(notification: models.Notification):
+    message = EmailMessage()
+    message["From"] = SMTP_FROM
+    message["To"] = notification.recipient
+    message["Subject"] = notification.subject
+    message.set_content(notification.body)
+    return message
+
+class _RateLimiter:
+    """Spaces sends evenly so a drain never exceeds the configured rate"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next_at = 0.0
+
+    async def wait(self):
+        now = time.monotonic()
+        at = max(now, self.next_at)
+        self.next_at = at + self.interval
+        if at > now:
+            await asyncio.sleep(at - now)
+
+async def _send_batch(messages: list):
+    """Send (id, message) pairs over SMTP_CONNECTIONS connections; returns {id: error or None}"""
+    queue = asyncio.Queue()
+    for item in messages:
+        queue.put_nowait(item)
+    limiter = _RateLimiter(SMTP_RATE_PER_SECOND)
+    results = {}
+
+    async def sender():
+        connection = None
+        try:
+            while not queue.empty():
+                notification_id, message = queue.get_nowait()
+                await limiter.wait()
+                try:
+                    if connection is None:
+                        connection = await asyncio.to_thread(_connect)
+                    await asyncio.to_thread(connection.send_message, message)
+                    results[notification_id] = None
+                except (smtplib.SMTPServerDisconnected, OSError) as e:
+                    # Reconnect for the next message
+                    results[notification_id] = str(e) or type(e).__name__
+                    if connection is not None:
+                        connection.close()
+                        connection = None
+                except smtplib.SMTPException as e:
+                    results[notification_id] = str(e) or type(e).__name__
+        finally:
+            if connection is not None:
+                await asyncio.to_thread(_close, connection)
+
+    await asyncio.gather(*(sender() for _ in range(max(1, min(SMTP_CONNECTIONS, len(messages))))))
+    return results
+
+def _claim_batch(db: Session):
+    """Lease a batch of due messages for NOTIFICATION_CLAIM_SECONDS; returns (id, message) pairs
+
+    Commits before anything is sent, so no lock is held during SMTP (in SQLite mode
+    the lock would be the database's single writer slot). A drainer that dies mid-batch
+    leaves its messages to be picked up again once the lease runs out.
+    """
+    now = datetime.utcnow()
+    # SKIP LOCKED lets a second drainer claim other rows instead of waiting
+    batch = db.query(models.Notification).filter(
+        and_(
+            models.Notification.status == models.NotificationStatus.PENDING,
+            models.Notification.next_attempt_at <= now
+        )
+    ).order_by(models.Notification.next_attempt_at).limit(
+        NOTIFICATION_BATCH_SIZE
+    ).with_for_update(skip_locked=True).all()
+    messages = [(notification.id, _message(notification)) for notification in batch]
+    for notification in batch:
+        notification.next_attempt_at = now + timedelta(seconds=NOTIFICATION_CLAIM_SECONDS)
+    db.commit()
+    return messages
+
+def _record_results(db: Session, results: dict):
+    """Mark each claimed message sent, or schedule its retry; returns the number sent"""
+    finished_at = datetime.utcnow()
+    sent = 0
+    batch = db.query(models.Notification).filter(models.Notification.id.in_(list(results))).all()
+    for notification in batch:
+        error = results[notification.id]
+        notification.attempts += 1
+        if error is None:
+            notification.status = models.NotificationStatus.SENT
+            notification.sent_at = finished_at
+            notification.last_error = None
+            sent += 1
+        else:
+            notification.last_error = error
+            if notification.attempts >= NOTIFICATION_MAX_ATTEMPTS:
+                notification.status = models.NotificationStatus.FAILED
+            else:
+                delay = RETRY_BASE_SECONDS * 2 ** (notification.attempts - 1)
+                notification.next_attempt_at = finished_at + timedelta(seconds=delay)
+    db.commit()
+    return sent
+
+def send_pending_notifications(db: Session, progress=None):
+    """Scheduled job: drain due outbox messages in batches; returns the number sent"""
+    sent = 0
+    while True:
+        messages = _claim_batch(db)
+        if not messages:
+            break
+        results = asyncio.run(_send_batch(messages))
+        sent += _record_results(db, {
+            notification_id: results.get(notification_id, "Not sent") for notification_id, _ in messages
+        })
+        print(f"📧 Sent {sent} notifications so far")
+        if progress:
+            progress(sent)
+    return sent
@@ -0,0 +1,248 @@
+"""
+Per-IP, per-user and per-username rate limiting
+
+Each limited route has token buckets keyed by client IP, authenticated user and/or the
+`username` field of a submitted form (so a password guessing run spread over many
+addresses still hits the account's own limit). A
+bucket holds up to `count` tokens and refills at count per period; a request that finds
+it empty gets 429 with Retry-After. Buckets are kept as a GCRA "theoretical arrival
+time", which behaves exactly like a token bucket but needs one number per key, so the
+shared backend is a single atomic upsert.
+
+RATE_LIMIT_BACKEND=memory keeps buckets per worker process. With several gunicorn
+workers or instances use RATE_LIMIT_BACKEND=database, which stores them in the database
+(PostgreSQL, or the SQLite file in embedded mode).
+
+Limits are listed in ROUTE_LIMITS and can be extended or overridden with RATE_LIMITS, e.g.
+    RATE_LIMITS="POST /auth/login=ip:5/minute; POST /vendors/=user:30/minute"
+RATE_LIMIT_DEFAULT (e.g. "user:600/minute") applies to every other route.
+"""
+import asyncio
+import math
+import os
+import re
+import threading
+import time
+from urllib.parse import parse_qs
+
+from jose import JWTError
+from sqlalchemy import case, delete, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+
+import models
+import database
+from auth import decode_token
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+# (method, path template) -> "scope:count/period[, scope:count/period]"
+ROUTE_LIMITS = {
+    # Every attempt costs a bcrypt verification
+    ("POST", "/auth/login"): "ip:10/minute, username:5/minute",
+    ("POST", "/auth/refresh"): "ip:30/minute",
+    ("POST", "/maintenance/apply-interest"): "user:2/minute",
+    ("POST", "/maintenance/documents/render"): "user:5/minute",
+    ("POST", "/maintenance/archive/{year}"): "user:5/minute",
+    ("POST", "/jobs/{job_name}/run"): "user:5/minute",
+    ("GET", "/search"): "user:60/minute",
+}
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_DEFAULT = os.getenv("RATE_LIMIT_DEFAULT")
+# Behind nginx, take the client address from X-Real-IP
+RATE_LIMIT_TRUST_PROXY = os.getenv("RATE_LIMIT_TRUST_PROXY", "false").lower() == "true"
+# Larger form bodies are not searched for a username
+FORM_MAX_BYTES = 64 * 1024
+
+class Limit:
+    def __init__(self, spec: str):
+        match = re.fullmatch(r"\s*(ip|user|username):(\d+)/(second|minute|hour|day)\s*", spec)
+        if not match:
+            raise ValueError(f"Bad rate limit {spec!r}, expected e.g. ip:10/minute")
+        self.scope = match.group(1)
+        self.count = int(match.group(2))
+        self.period = PERIODS[match.group(3)]
+        self.interval = self.period / self.count
+        # Burst of up to count requests
+        self.tolerance = self.period
+
+def parse_limits(value: str):
+    return [Limit(spec) for spec in value.split(",") if spec.strip()]
+
+def _route_pattern(template: str):
+    return re.compile("^" + re.sub(r"\\{[^}]+\\}", "[^/]+", re.escape(template)) + "$")
+
+def _load_routes():
+    routes = dict(ROUTE_LIMITS)
+    for item in filter(None, (part.strip() for part in os.getenv("RATE_LIMITS", "").split(";"))):
+        route, spec = item.split("=", 1)
+        method, path = route.split()
+        routes[(method.upper(), path)] = spec
+    return [(method, template, _route_pattern(template), parse_limits(spec)) for (method, template), spec in routes.items()]
+
+class MemoryBackend:
+    """Buckets in this process only"""
+
+    def __init__(self):
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def take(self, key: str, limit: Limit):
+        """(allowed, retry_after_seconds) for one request against key"""
+        with self.lock:
+            now = time.time()
+            tat = max(self.buckets.get(key, now), now) + limit.interval
+            if tat - now > limit.tolerance:
+                return False, tat - limit.tolerance - now
+            self.buckets[key] = tat
+            if len(self.buckets) > 100000:
+                self.buckets = {k: v for k, v in self.buckets.items() if v > now}
+            return True, 0.0
+
+class DatabaseBackend:
+    """Buckets shared by every worker through one upsert per check"""
+
+    def __init__(self):
+        if database.engine.dialect.name == "sqlite":
+            self.insert = sqlite_insert
+            self.now = (func.julianday("now") - 2440587.5) * 86400.0
+            self.greatest = func.max
+        else:
+            self.insert = pg_insert
+            self.now = func.extract("epoch", func.now())
+            self.greatest = func.greatest
+
+    def take(self, key: str, limit: Limit):
+        bucket = models.RateLimitBucket
+        now = self.now
+        next_tat = self.greatest(bucket.tat, now) + limit.interval
+        allowed = next_tat - now <= limit.tolerance
+        statement = self.insert(bucket).values(key=key, tat=now + limit.interval, allowed=True)
+        statement = statement.on_conflict_do_update(
+            index_elements=[bucket.key],
+            set_={"tat": case((allowed, next_tat), else_=bucket.tat), "allowed": allowed}
+        ).returning(bucket.tat, bucket.allowed, now)
+        with database.engine.begin() as connection:
+            tat, was_allowed, at = connection.execute(statement).one()
+        if was_allowed:
+            return True, 0.0
+        return False, float(tat) + limit.interval - limit.tolerance - float(at)
+
+def purge_buckets(db, progress=None):
+    """Scheduled job: drop shared buckets that have fully refilled"""
+    if RATE_LIMIT_BACKEND != "database" or db.info.get("society_id") is not None:
+        return 0
+    deleted = db.execute(delete(models.RateLimitBucket).where(models.RateLimitBucket.tat < time.time())).rowcount
+    db.commit()
+    if progress:
+        progress(deleted, deleted)
+    return deleted
+
+def _client_ip(scope, headers: Headers):
+    if RATE_LIMIT_TRUST_PROXY and headers.get("x-real-ip"):
+        return headers["x-real-ip"]
+    return scope["client"][0] if scope.get("client") else "unknown"
+
+def _user(headers: Headers):
+    authorization = headers.get("authorization", "")
+    if not authorization.lower().startswith("bearer "):
+        return None
+    try:
+        claims = decode_token(authorization[7:])
+    except JWTError:
+        return None
+    return f"{claims.get('sid')}:{claims.get('sub')}"
+
+async def _read_body(receive):
+    """The whole request body, and a receive that replays it to the app"""
+    chunks = []
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message["type"] != "http.request":
+            break
+        chunks.append(message.get("body", b""))
+        more_body = message.get("more_body", False)
+    body = b"".join(chunks)
+    body_sent = False
+
+    async def replay_body():
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return await receive()
+
+    return body, replay_body
+
+def _form_username(headers: Headers, body: bytes):
+    if not headers.get("content-type", "").startswith("application/x-www-form-urlencoded"):
+        return None
+    if len(body) > FORM_MAX_BYTES:
+        return None
+    values = parse_qs(body.decode("utf-8", "replace")).get("username")
+    return values[0].strip().lower() if values and values[0].strip() else None
+
+class RateLimitMiddleware:
+    def __init__(self, app, backend=None):
+        self.app = app
+        self.backend = backend or (DatabaseBackend() if RATE_LIMIT_BACKEND == "database" else MemoryBackend())
+        self.routes = _load_routes()
+        self.default_limits = parse_limits(RATE_LIMIT_DEFAULT) if RATE_LIMIT_DEFAULT else []
+
+    def _limits_for(self, method: str, path: str):
+        for route_method, template, pattern, limits in self.routes:
+            if route_method == method and pattern.match(path):
+                return template, limits
+        return "*", self.default_limits
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not RATE_LIMIT_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        template, limits = self._limits_for(scope["method"], scope["path"])
+        if not limits:
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        user = None
+        username = None
+        if any(limit.scope == "username" for limit in limits):
+            body, receive = await _read_body(receive)
+            username = _form_username(headers, body)
+        for limit in limits:
+            if limit.scope == "username":
+                if username is None:
+                    # Nothing to key on; the route's other limits still apply
+                    continue
+                subject = f"username:{username}"
+            elif limit.scope == "user":
+                user = user or _user(headers)
+                # Anonymous callers are limited by address instead
+                subject = f"user:{user}" if user else f"ip:{_client_ip(scope, headers)}"
+            else:
+                subject = f"ip:{_client_ip(scope, headers)}"
+            key = f"{scope['method']} {template}|{subject}|{limit.count}/{limit.period}"
+            try:
+                if isinstance(self.backend, MemoryBackend):
+                    allowed, retry_after = self.backend.take(key, limit)
+                else:
+                    # A database round trip must not stall the event loop
+                    allowed, retry_after = await asyncio.to_thread(self.backend.take, key, limit)
+            except Exception as e:
+                # Fail open: an unavailable store must not take the API down
+                print(f"Rate limit check failed, allowing request: {e}")
+                break
+            if not allowed:
+                response = JSONResponse(
+                    {"detail": "Too many requests"},
+                    status_code=429,
+                    headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+                )
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
@@ -7,15 +7,31 @@ CREATE DATABASE society_management;
 -- Connect to the database
 \c society_management;
 
+-- Trigram matching for search
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 -- Create ENUM types
 CREATE TYPE user_role AS ENUM ('admin', 'accounts', 'operations', 'flat_owner');
 CREATE TYPE flat_type AS ENUM ('resident', 'tenant');
 CREATE TYPE vendor_status AS ENUM ('active', 'completed', 'on_hold');
 CREATE TYPE payment_status AS ENUM ('paid', 'pending', 'overdue');
+CREATE TYPE notification_status AS ENUM ('pending', 'sent', 'failed');
+
+-- Societies Table
+CREATE TABLE societies (
+    id SERIAL PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    code VARCHAR(100) UNIQUE NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO societies (id, name, code) VALUES (1, 'Default Society', 'default');
+SELECT setval('societies_id_seq', 1);
 
 -- Users Table
 CREATE TABLE users (
     id SERIAL PRIMARY KEY,
+    society_id INTEGER NOT NULL DEFAULT 1 REFERENCES societies(id),
     username VARCHAR(255) UNIQUE NOT NULL,
     email VARCHAR(255) UNIQUE NOT NULL,
     hashed_password VARCHAR(255) NOT NULL,
@@ -30,8 +46,9 @@ CREATE TABLE users (
 -- Flats Table
 CREATE TABLE flats (
     id SERIAL PRIMARY KEY,
-    flat_number VARCHAR(50) UNIQUE NOT NULL,
-    owner_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    society_id INTEGER NOT NULL DEFAULT 1 REFERENCES societies(id),
+    flat_number VARCHAR(50) NOT NULL,
+    owner_id INTEGER NOT NULL REFERENCES users(id) ON DELETE RESTRICT,
     owner_name VARCHAR(255) NOT NULL,
     owner_email VARCHAR(255) NOT NULL,
     owner_phone VARCHAR(20) NOT NULL,
@@ -44,7 +61,8 @@ CREATE TABLE flats (
 -- Tenant History Table
 CREATE TABLE tenant_history (
     id SERIAL PRIMARY KEY,
-    flat_id INTEGER NOT NULL REFERENCES flats(id) ON DELETE CASCADE,
+    society_id INTEGER NOT NULL DEFAULT 1 REFERENCES societies(id),
+    flat_id INTEGER NOT NULL REFERENCES flats(id) ON DELETE RESTRICT,
     tenant_name VARCHAR(255) NOT NULL,
     tenant_email VARCHAR(255) NOT NULL,
     tenant_phone VARCHAR(20) NOT NULL,
@@ -62,7 +80,8 @@ CREATE TABLE tenant_history (
 -- Flat Residents Table
 CREATE TABLE flat_residents (
     id SERIAL PRIMARY KEY,
-    flat_id INTEGER NOT NULL REFERENCES flats(id) ON DELETE CASCADE,
+    society_id INTEGER NOT NULL DEFAULT 1 REFERENCES societies(id),
+    flat_id INTEGER NOT NULL REFERENCES flats(id) ON DELETE RESTRICT,
     resident_name VARCHAR(255) NOT NULL,
     resident_email VARCHAR(255),
     resident_phone VARCHAR(20),
@@ -76,52 +95,153 @@ CREATE TABLE flat_residents (
 -- Maintenance Table
 CREATE TABLE maintenance (
     id SERIAL PRIMARY KEY,
-    flat_id INTEGER NOT NULL REFERENCES flats(id) ON DELETE CASCADE,
+    society_id INTEGER NOT NULL DEFAULT 1 REFERENCES societies(id),
+    flat_id INTEGER NOT NULL REFERENCES flats(id) ON DELETE RESTRICT,
     month INTEGER NOT NULL CHECK (month >= 1 AND month <= 12),
     year INTEGER NOT NULL,
-    base_amount FLOAT NOT NULL,
-    interest FLOAT DEFAULT 0.0,
-    total_amount FLOAT NOT NULL,
-    amount_paid FLOAT DEFAULT 0.0,
+    -- Amounts are integer paise (models.Money)
+    base_amount BIGINT NOT NULL,
+    interest BIGINT DEFAULT 0,
+    total_amount BIGINT NOT NULL,
+    amount_paid BIGINT DEFAULT 0,
     payment_status payment_status DEFAULT 'pending',
     due_date TIMESTAMP NOT NULL,
     paid_date TIMESTAMP,
     invoice_number VARCHAR(100) UNIQUE,
     receipt_number VARCHAR(100) UNIQUE,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    UNIQUE(flat_id, month, year)
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
 -- Vendors Table
 CREATE TABLE vendors (
     id SERIAL PRIMARY KEY,
+    society_id INTEGER NOT NULL DEFAULT 1 REFERENCES societies(id),
     vendor_name VARCHAR(255) NOT NULL,
     vendor_work VARCHAR(255) NOT NULL,
     phone_number VARCHAR(20) NOT NULL,
     email VARCHAR(255),
     business_details TEXT,
     status vendor_status DEFAULT 'active',
-    total_charges FLOAT DEFAULT 0.0,
-    amount_paid FLOAT DEFAULT 0.0,
-    amount_remaining FLOAT DEFAULT 0.0,
+    total_charges BIGINT DEFAULT 0,
+    amount_paid BIGINT DEFAULT 0,
+    amount_remaining BIGINT DEFAULT 0,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Maintenance Rollups Table (maintained by the rollup_balances job)
+CREATE TABLE maintenance_rollups (
+    id SERIAL PRIMARY KEY,
+    society_id INTEGER NOT NULL DEFAULT 1 REFERENCES societies(id),
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    flats_billed INTEGER NOT NULL DEFAULT 0,
+    total_billed BIGINT NOT NULL DEFAULT 0,
+    total_paid BIGINT NOT NULL DEFAULT 0,
+    outstanding BIGINT NOT NULL DEFAULT 0,
+    overdue_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Job Runs Table
+CREATE TYPE job_status AS ENUM ('queued', 'running', 'succeeded', 'failed');
+
+CREATE TABLE job_runs (
+    id SERIAL PRIMARY KEY,
+    job_name VARCHAR(100) NOT NULL,
+    society_id INTEGER REFERENCES societies(id),
+    status job_status NOT NULL DEFAULT 'queued',
+    scheduled_for TIMESTAMP,
+    processed INTEGER DEFAULT 0,
+    total INTEGER,
+    message TEXT,
+    error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+-- Notification Outbox Table
+CREATE TABLE notification_outbox (
+    id SERIAL PRIMARY KEY,
+    society_id INTEGER NOT NULL DEFAULT 1 REFERENCES societies(id),
+    maintenance_id INTEGER REFERENCES maintenance(id),
+    dedupe_key VARCHAR(255) NOT NULL,
+    recipient VARCHAR(255) NOT NULL,
+    subject VARCHAR(255) NOT NULL,
+    body TEXT NOT NULL,
+    status notification_status NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    sent_at TIMESTAMP
+);
+
+-- Audit Log Table
+CREATE TABLE audit_log (
+    id SERIAL PRIMARY KEY,
+    society_id INTEGER NOT NULL DEFAULT 1 REFERENCES societies(id),
+    entity_type VARCHAR(100) NOT NULL,
+    entity_id INTEGER NOT NULL,
+    action VARCHAR(20) NOT NULL,
+    changes JSON NOT NULL,
+    user_id INTEGER,
+    username VARCHAR(100),
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Idempotency Keys Table
+CREATE TABLE idempotency_keys (
+    id SERIAL PRIMARY KEY,
+    key_hash VARCHAR(64) NOT NULL,
+    request_hash VARCHAR(64) NOT NULL,
+    status_code INTEGER,
+    content_type VARCHAR(255),
+    response_body TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL
+);
+
+-- Rate Limit Buckets Table (RATE_LIMIT_BACKEND=database)
+CREATE TABLE rate_limit_buckets (
+    key VARCHAR(512) PRIMARY KEY,
+    tat DOUBLE PRECISION NOT NULL,
+    allowed BOOLEAN NOT NULL DEFAULT TRUE
+);
+
 -- Create Indexes for better performance
-CREATE INDEX idx_users_email ON users(email);
-CREATE INDEX idx_users_username ON users(username);
-CREATE INDEX idx_users_role ON users(role);
-CREATE INDEX idx_flats_number ON flats(flat_number);
+-- Keep in sync with __table_args__ in models.py; changes ship as files in migrations/
+-- users.username and users.email are covered by their UNIQUE constraints
+CREATE INDEX idx_users_society ON users(society_id);
+CREATE UNIQUE INDEX uq_flats_society_number ON flats(society_id, flat_number);
 CREATE INDEX idx_flats_owner ON flats(owner_id);
-CREATE INDEX idx_tenant_flat ON tenant_history(flat_id);
-CREATE INDEX idx_tenant_current ON tenant_history(is_current);
+CREATE INDEX idx_tenant_flat_start ON tenant_history(flat_id, agreement_start_date);
+CREATE UNIQUE INDEX uq_tenant_current_flat ON tenant_history(flat_id) WHERE is_current;
+CREATE INDEX idx_tenant_current_end ON tenant_history(agreement_end_date) WHERE is_current;
+CREATE INDEX idx_tenant_period ON tenant_history USING gist (tsrange(agreement_start_date, agreement_end_date, '[)'));
 CREATE INDEX idx_resident_flat ON flat_residents(flat_id);
-CREATE INDEX idx_maintenance_flat ON maintenance(flat_id);
-CREATE INDEX idx_maintenance_status ON maintenance(payment_status);
-CREATE INDEX idx_maintenance_month_year ON maintenance(month, year);
-CREATE INDEX idx_vendor_status ON vendors(status);
+CREATE UNIQUE INDEX uq_maintenance_flat_period ON maintenance(flat_id, year, month);
+CREATE INDEX idx_maintenance_period ON maintenance(society_id, year, month);
+CREATE INDEX idx_maintenance_status_due ON maintenance(payment_status, due_date);
+CREATE INDEX idx_vendor_society_status ON vendors(society_id, status);
+CREATE UNIQUE INDEX uq_rollup_society_period ON maintenance_rollups(society_id, year, month);
+CREATE INDEX idx_job_runs_name_scheduled ON job_runs(job_name, scheduled_for);
+CREATE UNIQUE INDEX uq_notification_dedupe ON notification_outbox(dedupe_key);
+CREATE INDEX idx_notification_pending ON notification_outbox(status, next_attempt_at);
+CREATE INDEX idx_audit_entity_time ON audit_log(entity_type, entity_id, created_at);
+CREATE INDEX idx_audit_society_time ON audit_log(society_id, created_at);
+CREATE UNIQUE INDEX uq_idempotency_key_hash ON idempotency_keys(key_hash);
+CREATE INDEX idx_idempotency_expires ON idempotency_keys(expires_at);
+-- Trigram indexes for GET /search
+CREATE INDEX idx_flats_number_trgm ON flats USING gin (flat_number gin_trgm_ops);
+CREATE INDEX idx_flats_owner_name_trgm ON flats USING gin (owner_name gin_trgm_ops);
+CREATE INDEX idx_tenant_name_trgm ON tenant_history USING gin (tenant_name gin_trgm_ops);
+CREATE INDEX idx_tenant_phone_trgm ON tenant_history USING gin (tenant_phone gin_trgm_ops);
+CREATE INDEX idx_resident_name_trgm ON flat_residents USING gin (resident_name gin_trgm_ops);
+CREATE INDEX idx_vendor_name_trgm ON vendors USING gin (vendor_name gin_trgm_ops);
+CREATE INDEX idx_vendor_work_trgm ON vendors USING gin (vendor_work gin_trgm_ops);
 
 -- Create function to update updated_at timestamp
 CREATE OR REPLACE FUNCTION update_updated_at_column()
@@ -1,7 +1,13 @@
-from pydantic import BaseModel, EmailStr, validator
-from typing import Optional, List
+from pydantic import BaseModel, EmailStr, Field, PlainSerializer, validator
+from typing import Annotated, Any, Dict, Optional, List
 from datetime import datetime
-from models import UserRole, FlatType, VendorStatus, PaymentStatus
+from decimal import Decimal
+from models import UserRole, FlatType, VendorStatus, PaymentStatus, JobStatus
+
+# Rupees, exact to the paisa: requests with more than two decimal places are rejected,
+# and responses are JSON numbers (any 15-digit amount survives the float conversion)
+Money = Annotated[Decimal, Field(max_digits=15, decimal_places=2),
+                  PlainSerializer(float, return_type=float, when_used="json")]
 
 # User Schemas
 class UserBase(BaseModel):
@@ -22,6 +28,7 @@ class UserUpdate(BaseModel):
 
 class UserResponse(UserBase):
     id: int
+    society_id: int
     is_active: bool
     created_at: datetime
     
@@ -31,9 +38,29 @@ class UserResponse(UserBase):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
 
 class TokenData(BaseModel):
     username: Optional[str] = None
+    society_id: Optional[int] = None
+
+# Society Schemas
+class SocietyBase(BaseModel):
+    name: str
+    code: str
+
+class SocietyCreate(SocietyBase):
+    admin: UserCreate
+
+class SocietyResponse(SocietyBase):
+    id: int
+    created_at: datetime
+    
+    class Config:
+        from_attributes = True
 
 # Flat Schemas
 class FlatBase(BaseModel):
@@ -94,6 +121,18 @@ class TenantHistoryResponse(TenantHistoryBase):
     class Config:
         from_attributes = True
 
+class CurrentOccupantResponse(BaseModel):
+    flat_id: int
+    flat_number: str
+    flat_type: FlatType
+    owner_name: str
+    tenant: Optional[TenantHistoryResponse] = None
+
+class StoredDocumentResponse(BaseModel):
+    reference: str
+    size: int
+    deduplicated: bool
+
 # Flat Resident Schemas
 class FlatResidentBase(BaseModel):
     resident_name: str
@@ -123,7 +162,7 @@ class FlatResidentResponse(FlatResidentBase):
 
 # Maintenance Schemas
 class MaintenanceBase(BaseModel):
-    base_amount: float
+    base_amount: Money
     month: int
     year: int
 
@@ -132,14 +171,14 @@ class MaintenanceCreate(MaintenanceBase):
 
 class MaintenanceUpdate(BaseModel):
     payment_status: Optional[PaymentStatus] = None
-    amount_paid: Optional[float] = None
+    amount_paid: Optional[Money] = None
 
 class MaintenanceResponse(MaintenanceBase):
     id: int
     flat_id: int
-    interest: float
-    total_amount: float
-    amount_paid: float
+    interest: Money
+    total_amount: Money
+    amount_paid: Money
     payment_status: PaymentStatus
     due_date: datetime
     paid_date: Optional[datetime] = None
@@ -168,17 +207,198 @@ class VendorUpdate(BaseModel):
     email: Optional[EmailStr] = None
     business_details: Optional[str] = None
     status: Optional[VendorStatus] = None
-    total_charges: Optional[float] = None
-    amount_paid: Optional[float] = None
+    total_charges: Optional[Money] = None
+    amount_paid: Optional[Money] = None
 
 class VendorResponse(VendorBase):
     id: int
     status: VendorStatus
-    total_charges: float
-    amount_paid: float
-    amount_remaining: float
+    total_charges: Money
+    amount_paid: Money
+    amount_remaining: Money
     created_at: datetime
     updated_at: datetime
     
     class Config:
         from_attributes = True
+
+# Bulk Update Schemas
+MAX_BULK_ITEMS = 500
+
+def _check_bulk_items(items):
+    if not 1 <= len(items) <= MAX_BULK_ITEMS:
+        raise ValueError(f"between 1 and {MAX_BULK_ITEMS} items are allowed")
+    if len({item.id for item in items}) != len(items):
+        raise ValueError("each id may appear only once")
+    return items
+
+class MaintenanceBulkItem(MaintenanceUpdate):
+    id: int
+
+class MaintenanceBulkUpdate(BaseModel):
+    items: List[MaintenanceBulkItem]
+    
+    @validator("items")
+    def check_items(cls, v):
+        return _check_bulk_items(v)
+
+class VendorBulkItem(VendorUpdate):
+    id: int
+
+class VendorBulkUpdate(BaseModel):
+    items: List[VendorBulkItem]
+    
+    @validator("items")
+    def check_items(cls, v):
+        return _check_bulk_items(v)
+
+class MaintenanceBulkResult(BaseModel):
+    id: int
+    status: str
+    record: Optional[MaintenanceResponse] = None
+
+class MaintenanceBulkResponse(BaseModel):
+    updated: int
+    results: List[MaintenanceBulkResult]
+
+class VendorBulkResult(BaseModel):
+    id: int
+    status: str
+    record: Optional[VendorResponse] = None
+
+class VendorBulkResponse(BaseModel):
+    updated: int
+    results: List[VendorBulkResult]
+
+# Maintenance Rollup Schemas
+class MaintenanceRollupResponse(BaseModel):
+    year: int
+    month: int
+    flats_billed: int
+    total_billed: Money
+    total_paid: Money
+    outstanding: Money
+    overdue_count: int
+    updated_at: datetime
+    
+    class Config:
+        from_attributes = True
+
+# Maintenance Grid Schemas
+class MaintenanceGridResponse(BaseModel):
+    """Column arrays: flat_id[i] is row i; status[i][j] is that flat in months[j]"""
+    months: List[str]
+    flat_id: List[int]
+    flat_number: List[str]
+    owner_name: List[str]
+    status: List[List[Optional[PaymentStatus]]]
+    amount: List[List[Optional[Money]]]
+    paid: List[List[Optional[Money]]]
+    next_after: Optional[str] = None
+
+# Job Schemas
+class JobRunResponse(BaseModel):
+    id: int
+    job_name: str
+    society_id: Optional[int] = None
+    status: JobStatus
+    scheduled_for: Optional[datetime] = None
+    processed: int
+    total: Optional[int] = None
+    message: Optional[str] = None
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    
+    class Config:
+        from_attributes = True
+
+class JobResponse(BaseModel):
+    name: str
+    schedule: str
+    description: str
+    last_run: Optional[JobRunResponse] = None
+
+# Audit Log Schemas
+class AuditLogResponse(BaseModel):
+    id: int
+    entity_type: str
+    entity_id: int
+    action: str
+    changes: Dict[str, List[Any]]
+    user_id: Optional[int] = None
+    username: Optional[str] = None
+    created_at: datetime
+    
+    class Config:
+        from_attributes = True
+
+# Simulation Schemas
+class SimulationScenario(BaseModel):
+    name: str
+    rate_type: str = "current"
+    rate: float = 0.0
+    interest_rate: float = 0.10
+    interest_mode: str = "once"
+    payment_rate: Optional[float] = None
+    arrears_recovery: float = 0.0
+    
+    @validator("rate_type")
+    def check_rate_type(cls, v):
+        if v not in ("current", "flat", "per_sq_ft"):
+            raise ValueError("rate_type must be current, flat or per_sq_ft")
+        return v
+    
+    @validator("interest_mode")
+    def check_interest_mode(cls, v):
+        if v not in ("once", "monthly"):
+            raise ValueError("interest_mode must be once or monthly")
+        return v
+    
+    @validator("interest_rate", "payment_rate", "arrears_recovery")
+    def check_fraction(cls, v):
+        if v is not None and not 0 <= v <= 1:
+            raise ValueError("must be between 0 and 1")
+        return v
+
+class SimulationRequest(BaseModel):
+    months: int = 12
+    scenarios: List[SimulationScenario]
+    
+    @validator("months")
+    def check_months(cls, v):
+        if not 1 <= v <= 120:
+            raise ValueError("months must be between 1 and 120")
+        return v
+    
+    @validator("scenarios")
+    def check_scenarios(cls, v):
+        if not 1 <= len(v) <= 20:
+            raise ValueError("between 1 and 20 scenarios are allowed")
+        return v
+
+class SimulationMonth(BaseModel):
+    month: int
+    billed: float
+    collected: float
+    interest: float
+    arrears: float
+
+class SimulationResult(BaseModel):
+    name: str
+    monthly_billed: float
+    change_vs_current: float
+    average_bill: float
+    flats_paying_more: int
+    total_billed: float
+    total_collected: float
+    total_interest: float
+    closing_arrears: float
+    months: List[SimulationMonth]
+
+class SimulationResponse(BaseModel):
+    flats: int
+    opening_arrears: float
+    current_interest_rate: float
+    scenarios: List[SimulationResult]
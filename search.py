@@ -0,0 +1,72 @@
+"""
+Ranked search across flats, residents, tenants and vendors
+
+On PostgreSQL, matching uses pg_trgm similarity backed by GIN trigram indexes, so typo
+tolerant ("plumbr") and prefix ("B-30") queries are answered from indexes. Other
+databases fall back to case-insensitive substring matching.
+"""
+from sqlalchemy import case, func, literal, or_
+from sqlalchemy.orm import Session
+
+import models
+
+SEARCH_TYPES = {
+    "flat": (models.Flat, (models.Flat.flat_number, models.Flat.owner_name)),
+    "resident": (models.FlatResident, (models.FlatResident.resident_name,)),
+    "tenant": (models.TenantHistory, (models.TenantHistory.tenant_name, models.TenantHistory.tenant_phone)),
+    "vendor": (models.Vendor, (models.Vendor.vendor_name, models.Vendor.vendor_work)),
+}
+
+def _score(columns, q: str, fuzzy: bool):
+    prefix = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    prefix_match = or_(*(column.ilike(prefix, escape="\\") for column in columns))
+    if fuzzy:
+        similarity = func.greatest(*(func.similarity(column, q) for column in columns)) \
+            if len(columns) > 1 else func.similarity(columns[0], q)
+        # The % operator is what the GIN trigram index accelerates
+        matches = or_(prefix_match, *(column.op("%")(q) for column in columns))
+    else:
+        contains = "%" + prefix
+        similarity = case((or_(*(column.ilike(contains, escape="\\") for column in columns)), 0.5), else_=0.0)
+        matches = or_(*(column.ilike(contains, escape="\\") for column in columns))
+    # Prefix hits rank above any fuzzy hit
+    return similarity + case((prefix_match, 1.0), else_=0.0), matches
+
+def _results(db: Session, kind: str, q: str, limit: int, fuzzy: bool):
+    model, columns = SEARCH_TYPES[kind]
+    score, matches = _score(columns, q, fuzzy)
+    if kind == "flat":
+        extra = (model.id.label("flat_id"), model.owner_name.label("detail"))
+    elif kind == "resident":
+        extra = (model.flat_id, model.relationship_with_owner.label("detail"))
+    elif kind == "tenant":
+        extra = (model.flat_id, model.tenant_phone.label("detail"))
+    else:
+        extra = (literal(None).label("flat_id"), model.vendor_work.label("detail"))
+    rows = db.query(
+        model.id, columns[0].label("title"), *extra, score.label("score")
+    ).filter(matches).order_by(score.desc()).limit(limit).all()
+    return [
+        {
+            "type": kind,
+            "id": row.id,
+            "flat_id": row.flat_id,
+            "title": row.title,
+            "detail": row.detail,
+            "score": round(float(row.score), 4),
+        }
+        for row in rows
+    ]
+
+def search(db: Session, q: str, types=None, limit: int = 20):
+    """Best matches for q across the requested entity types, highest score first"""
+    q = q.strip()
+    if not q:
+        return []
+    # Fuzzy matches need pg_trgm's default similarity threshold of 0.3
+    fuzzy = db.get_bind().dialect.name == "postgresql"
+    results = []
+    for kind in types or SEARCH_TYPES:
+        results.extend(_results(db, kind, q, limit, fuzzy))
+    results.sort(key=lambda result: result["score"], reverse=True)
+    return results[:limit]
@@ -0,0 +1,94 @@
+"""
+Fast JSON serialization for large list responses
+
+Instead of loading ORM objects and validating each through a schemas.*Response model,
+list routes select only the columns the response schema declares and encode the rows
+with orjson. The output matches what FastAPI produces through response_model; run
+check_serialization.py after changing a response schema or a converter here.
+
+Routes also accept a sparse fieldset, fields=id,flat_number,..., which narrows both the
+selected columns and the JSON to the named schema fields.
+"""
+import enum
+import os
+import typing
+from decimal import Decimal
+from functools import lru_cache
+from typing import Optional
+
+from fastapi import HTTPException
+from fastapi.responses import ORJSONResponse
+
+FAST_SERIALIZATION = os.getenv("FAST_SERIALIZATION", "true").lower() == "true"
+
+def _enum_value(value):
+    return value.value if isinstance(value, enum.Enum) else value
+
+def _float(value):
+    return float(value) if value is not None else None
+
+def _int(value):
+    return int(value) if value is not None else None
+
+def _converter(annotation):
+    """Cheap stand-in for the coercion pydantic applies to a field, or None"""
+    args = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+    if typing.get_origin(annotation) is typing.Union and len(args) == 1:
+        annotation = args[0]
+    if typing.get_origin(annotation) is typing.Annotated:
+        annotation = typing.get_args(annotation)[0]
+    if isinstance(annotation, type):
+        if issubclass(annotation, Decimal):
+            return _float  # schemas.Money is sent as a JSON number
+        if issubclass(annotation, enum.Enum):
+            return _enum_value
+        if issubclass(annotation, bool):
+            return None
+        if issubclass(annotation, float):
+            return _float
+        if issubclass(annotation, int):
+            return _int
+    # Strings pass through (EmailStr values were normalized when written) and orjson
+    # writes naive datetimes exactly as pydantic does
+    return None
+
+@lru_cache(maxsize=None)
+def _schema_fields(schema):
+    return tuple((name, _converter(field.annotation)) for name, field in schema.model_fields.items())
+
+@lru_cache(maxsize=1024)
+def _sparse_fields(schema, requested: str):
+    names = [name.strip() for name in requested.split(",") if name.strip()]
+    known = dict(_schema_fields(schema))
+    unknown = [name for name in names if name not in known]
+    if unknown or not names:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields: {', '.join(unknown) or '(none given)'}; available: {', '.join(known)}"
+        )
+    # Keep the schema's field order whatever order they were asked in
+    return tuple((name, convert) for name, convert in _schema_fields(schema) if name in names)
+
+def fields(schema, requested: Optional[str] = None):
+    """(name, converter) for each response field, limited to a comma-separated fields= value"""
+    if not requested:
+        return _schema_fields(schema)
+    return _sparse_fields(schema, requested)
+
+def columns(model, schema, requested: Optional[str] = None):
+    """Model columns backing a response schema, for db.query(*columns)"""
+    return [getattr(model, name) for name, _ in fields(schema, requested)]
+
+def _to_dict(item, schema_fields):
+    return {name: convert(getattr(item, name)) if convert else getattr(item, name) for name, convert in schema_fields}
+
+def to_dicts(items, schema, requested: Optional[str] = None):
+    """Rows (or ORM objects) to plain dicts shaped like schema.model_dump(mode="json")"""
+    schema_fields = fields(schema, requested)
+    return [_to_dict(item, schema_fields) for item in items]
+
+def json_response(items, schema, requested: Optional[str] = None, status_code: int = 200):
+    return ORJSONResponse(to_dicts(items, schema, requested), status_code=status_code)
+
+def json_object(item, schema, requested: Optional[str] = None, status_code: int = 200):
+    return ORJSONResponse(_to_dict(item, fields(schema, requested)), status_code=status_code)
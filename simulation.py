@@ -0,0 +1,135 @@
+"""
+What-if projection of maintenance collections under different rate and interest rules
+
+Flat sizes, each flat's current bill, its open arrears and its historical on-time payment
+rate are loaded once into arrays. Every scenario is then evaluated at the same time as an
+(scenarios x flats) array, stepping month by month, so a 5,000-flat society with a dozen
+scenarios projects in milliseconds.
+
+Each month, per flat:
+    bill       scenario rate (flat fee, per sq ft, or the flat's current bill)
+    paid       bill x on-time payment rate
+    interest   "once":    interest_rate x the newly unpaid part of the bill (today's rule)
+               "monthly": interest_rate x arrears carried into the month
+    recovered  arrears_recovery x arrears (after monthly interest)
+    arrears    arrears + interest + unpaid bill - recovered
+"""
+import numpy as np
+from sqlalchemy import case, func
+from sqlalchemy.orm import Session
+
+import models
+import crud
+
+def load_flats(db: Session):
+    """Column arrays: sizes, current bills, open arrears and on-time payment rates"""
+    maintenance = models.Maintenance
+    open_balance = case(
+        (maintenance.payment_status != models.PaymentStatus.PAID,
+         func.coalesce(maintenance.total_amount, 0) - func.coalesce(maintenance.amount_paid, 0)),
+        else_=0
+    )
+    totals = db.query(
+        maintenance.flat_id.label("flat_id"),
+        func.sum(open_balance).label("arrears"),
+        func.count(maintenance.id).label("bills"),
+        func.sum(case((maintenance.payment_status == models.PaymentStatus.PAID, 1), else_=0)).label("paid_bills")
+    ).group_by(maintenance.flat_id).subquery()
+    ranked = db.query(
+        maintenance.flat_id.label("flat_id"),
+        maintenance.base_amount.label("base_amount"),
+        func.row_number().over(
+            partition_by=maintenance.flat_id, order_by=(maintenance.year.desc(), maintenance.month.desc())
+        ).label("position")
+    ).subquery()
+    rows = db.query(
+        models.Flat.flat_sq_size,
+        ranked.c.base_amount,
+        totals.c.arrears,
+        totals.c.bills,
+        totals.c.paid_bills
+    ).outerjoin(
+        ranked, (ranked.c.flat_id == models.Flat.id) & (ranked.c.position == 1)
+    ).outerjoin(
+        totals, totals.c.flat_id == models.Flat.id
+    ).all()
+
+    columns = np.array(rows, dtype=float).reshape(len(rows), 5) if rows else np.zeros((0, 5))
+    columns = np.nan_to_num(columns)
+    sizes, current_bills, arrears, bills, paid_bills = columns.T
+    # Flats without a payment history are assumed to pay like the society as a whole
+    society_rate = paid_bills.sum() / bills.sum() if bills.sum() else 1.0
+    payment_rates = np.where(bills > 0, paid_bills / np.maximum(bills, 1), society_rate)
+    return {"sizes": sizes, "current_bills": current_bills, "arrears": arrears, "payment_rates": payment_rates}
+
+def _bills(scenario, flats):
+    if scenario.rate_type == "per_sq_ft":
+        return flats["sizes"] * scenario.rate
+    if scenario.rate_type == "flat":
+        return np.full_like(flats["sizes"], scenario.rate)
+    return flats["current_bills"] * (1 + (scenario.rate or 0.0))
+
+def simulate(flats: dict, scenarios: list, months: int):
+    """Project every scenario over months; returns one result dict per scenario"""
+    count = len(scenarios)
+    bills = np.stack([_bills(scenario, flats) for scenario in scenarios]) if flats["sizes"].size \
+        else np.zeros((count, 0))
+    payment_rates = np.stack([
+        np.full_like(flats["payment_rates"], scenario.payment_rate)
+        if scenario.payment_rate is not None else flats["payment_rates"]
+        for scenario in scenarios
+    ]) if flats["sizes"].size else np.zeros((count, 0))
+    interest_rates = np.array([scenario.interest_rate for scenario in scenarios])[:, None]
+    monthly = np.array([scenario.interest_mode == "monthly" for scenario in scenarios])[:, None]
+    recovery = np.array([scenario.arrears_recovery for scenario in scenarios])[:, None]
+
+    paid_on_time = bills * payment_rates
+    unpaid = bills - paid_on_time
+    arrears = np.broadcast_to(flats["arrears"], bills.shape).copy()
+
+    collected = np.zeros((count, months))
+    interest = np.zeros((count, months))
+    closing_arrears = np.zeros((count, months))
+    for month in range(months):
+        charged = np.where(monthly, arrears * interest_rates, unpaid * interest_rates)
+        recovered = (arrears + np.where(monthly, charged, 0.0)) * recovery
+        arrears = arrears + charged + unpaid - recovered
+        collected[:, month] = (paid_on_time + recovered).sum(axis=1)
+        interest[:, month] = charged.sum(axis=1)
+        closing_arrears[:, month] = arrears.sum(axis=1)
+
+    billed = bills.sum(axis=1)
+    current_total = flats["current_bills"].sum()
+    results = []
+    for i, scenario in enumerate(scenarios):
+        results.append({
+            "name": scenario.name,
+            "monthly_billed": round(float(billed[i]), 2),
+            "change_vs_current": round(float(billed[i] - current_total), 2),
+            "average_bill": round(float(bills[i].mean()), 2) if bills.shape[1] else 0.0,
+            "flats_paying_more": int((bills[i] > flats["current_bills"] + 0.005).sum()),
+            "total_billed": round(float(billed[i] * months), 2),
+            "total_collected": round(float(collected[i].sum()), 2),
+            "total_interest": round(float(interest[i].sum()), 2),
+            "closing_arrears": round(float(closing_arrears[i, -1]), 2) if months else 0.0,
+            "months": [
+                {
+                    "month": month + 1,
+                    "billed": round(float(billed[i]), 2),
+                    "collected": round(float(collected[i, month]), 2),
+                    "interest": round(float(interest[i, month]), 2),
+                    "arrears": round(float(closing_arrears[i, month]), 2),
+                }
+                for month in range(months)
+            ],
+        })
+    return results
+
+def run(db: Session, scenarios: list, months: int):
+    flats = load_flats(db)
+    return {
+        "flats": int(flats["sizes"].size),
+        "opening_arrears": round(float(flats["arrears"].sum()), 2),
+        "current_interest_rate": crud.INTEREST_RATE,
+        "scenarios": simulate(flats, scenarios, months),
+    }
@@ -0,0 +1,90 @@
+"""
+Content-addressed file storage for agreement documents and ID proofs
+
+Uploads are streamed to disk in chunks while being hashed, then moved to
+objects/<aa>/<bb>/<sha256> under STORAGE_DIR. Identical files are stored once.
+Database columns reference stored files as "sha256:<digest>".
+"""
+import hashlib
+import os
+import tempfile
+from typing import AsyncIterator, Optional
+
+STORAGE_DIR = os.getenv("STORAGE_DIR", "storage")
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "50")) * 1024 * 1024
+# When set (e.g. "/protected-storage/"), downloads are handed to nginx via
+# X-Accel-Redirect so it can serve them with sendfile
+STORAGE_ACCEL_REDIRECT = os.getenv("STORAGE_ACCEL_REDIRECT")
+
+REFERENCE_PREFIX = "sha256:"
+
+class UploadTooLarge(Exception):
+    pass
+
+def _objects_dir():
+    return os.path.join(STORAGE_DIR, "objects")
+
+def object_relpath(digest: str):
+    return os.path.join(digest[:2], digest[2:4], digest)
+
+def object_path(digest: str):
+    return os.path.join(_objects_dir(), object_relpath(digest))
+
+def to_reference(digest: str):
+    return REFERENCE_PREFIX + digest
+
+def from_reference(reference: Optional[str]):
+    """Digest of a stored file, or None for empty/legacy path references"""
+    if not reference or not reference.startswith(REFERENCE_PREFIX):
+        return None
+    digest = reference[len(REFERENCE_PREFIX):]
+    if len(digest) != 64 or any(c not in "0123456789abcdef" for c in digest):
+        return None
+    return digest
+
+async def save_stream(chunks: AsyncIterator[bytes]):
+    """Stream chunks to storage; returns (digest, size, created), digest None if empty"""
+    tmp_dir = os.path.join(STORAGE_DIR, "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    hasher = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise UploadTooLarge(f"Upload exceeds {MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
+                hasher.update(chunk)
+                f.write(chunk)
+        if size == 0:
+            os.remove(tmp_path)
+            return None, 0, False
+        digest = hasher.hexdigest()
+        path = object_path(digest)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+            return digest, size, False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+        return digest, size, True
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+_SIGNATURES = (
+    (b"%PDF", "application/pdf"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF8", "image/gif"),
+)
+
+def media_type(digest: str):
+    """Sniff the stored file's type from its leading bytes"""
+    with open(object_path(digest), "rb") as f:
+        head = f.read(8)
+    for signature, value in _SIGNATURES:
+        if head.startswith(signature):
+            return value
+    return "application/octet-stream"